@@ -0,0 +1,139 @@
+# 文章级检索结果聚合
+# 爬虫将每篇文章切分为500字的滑动窗口片段，按片段排序的前3个结果经常是同一篇文章的相邻窗口，
+# 导致上下文重复、浪费大模型token。本模块在片段排序之后增加一个聚合阶段：
+# 1. 通过建索引时保存的片段→文章映射数组（{prefix}_chunk_article.npy，每行为 [文章编号, 片段序号]）
+#    将候选片段按来源文章分组，分组只需数组查表，几乎没有开销。
+# 2. 以文章内片段得分的最大值（max）或温度化的log-sum-exp（softmax）为文章打分，返回得分最高的若干篇文章。
+# 3. 可选地使用MMR（最大边际相关性）在相关性与文章之间的差异性之间折中，避免选中内容相近的多篇文章。
+# 4. 同一文章中序号连续的入选片段拼接为一个段落，去掉滑动窗口的重叠部分和重复的标题。
+
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from context_packer import _overlap, split_title
+
+
+def build_chunk_articles(metadata: List[Dict]) -> np.ndarray:
+    """
+    根据元数据中的 "article" 和 "chunk" 字段构建片段→文章映射数组。
+
+    :param metadata: 与索引行一一对应的元数据
+    :return: (n, 2) 的int32数组，每行为 [文章编号, 片段在文章中的序号]；元数据缺少文章信息时返回None
+    """
+    if not metadata or any("article" not in meta for meta in metadata):
+        return None
+    return np.array([[meta["article"], meta.get("chunk", 0)] for meta in metadata], dtype=np.int32).reshape(-1, 2)
+
+
+def stitch_chunks(contents: List[str], min_overlap: int = 20, max_overlap: int = 200) -> str:
+    """
+    将同一文章中按顺序排列的相邻片段拼接为一个段落，标题只保留一次，去掉首尾重叠的部分。
+
+    :param contents: 按片段序号排列的片段内容（"标题\\n正文" 格式）
+    :return: 拼接后的内容，仍为 "标题\\n正文" 格式
+    """
+    title, body = split_title(contents[0])
+    body = body.strip()
+    for content in contents[1:]:
+        _, next_body = split_title(content)
+        next_body = next_body.strip()
+        length = _overlap(body, next_body, min_overlap, max_overlap)
+        body = body + next_body[length:] if length else body + "\n" + next_body
+    return f"{title}\n{body}" if title else body
+
+
+class ArticleAggregator:
+    def __init__(self,
+                 chunk_articles: np.ndarray,
+                 scoring: str = "max",
+                 temperature: float = 0.05,
+                 top_articles: int = 3,
+                 chunks_per_article: int = 3,
+                 mmr_lambda: Optional[float] = None):
+        """
+        :param chunk_articles: (n, 2) 的片段→文章映射数组，每行为 [文章编号, 片段序号]
+        :param scoring: 文章打分方式，"max" 取片段最高分；"softmax" 取 temperature * log(sum(exp(s / temperature)))，
+                        多个片段都相关的文章得分略高
+        :param temperature: softmax打分的温度，越小越接近max
+        :param top_articles: 返回的文章数
+        :param chunks_per_article: 每篇文章最多保留的片段数
+        :param mmr_lambda: 为None时按文章得分排序；否则使用MMR选择文章，取值越小越强调差异性
+        """
+        if scoring not in ("max", "softmax"):
+            raise ValueError(f"不支持的文章打分方式: {scoring}")
+        self.articles = np.ascontiguousarray(chunk_articles[:, 0])
+        self.positions = np.ascontiguousarray(chunk_articles[:, 1])
+        self.scoring = scoring
+        self.temperature = temperature
+        self.top_articles = top_articles
+        self.chunks_per_article = chunks_per_article
+        self.mmr_lambda = mmr_lambda
+
+    def _score(self, scores: np.ndarray) -> float:
+        if self.scoring == "max" or scores.size == 1:
+            return float(scores.max())
+        scaled = scores / self.temperature
+        peak = scaled.max()
+        return float(self.temperature * (peak + np.log(np.exp(scaled - peak).sum())))
+
+    def group(self, candidates: List[Dict]) -> List[Dict]:
+        """
+        将候选片段按文章分组并打分。
+
+        :param candidates: 候选片段，每项包含 "index"（索引行号）和 "content_sim"
+        :return: 按文章得分从高到低排列的分组，每项包含 article、score、chunks（按得分排序的候选片段）
+        """
+        groups: Dict[int, List[Dict]] = {}
+        for candidate in candidates:
+            groups.setdefault(int(self.articles[candidate["index"]]), []).append(candidate)
+        result = []
+        for article, chunks in groups.items():
+            chunks.sort(key=lambda c: c["content_sim"], reverse=True)
+            scores = np.array([c["content_sim"] for c in chunks], dtype=np.float64)
+            result.append({"article": article, "score": self._score(scores), "chunks": chunks})
+        result.sort(key=lambda g: g["score"], reverse=True)
+        return result
+
+    def _mmr(self, groups: List[Dict], vector_fn: Callable[[int], np.ndarray]) -> List[Dict]:
+        """以每篇文章得分最高的片段向量代表文章，按MMR贪心选择文章"""
+        vectors = np.stack([vector_fn(g["chunks"][0]["index"]) for g in groups]).astype(np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        relevance = np.array([g["score"] for g in groups])
+        selected = [0]
+        remaining = list(range(1, len(groups)))
+        while remaining and len(selected) < self.top_articles:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            mmr = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            selected.append(remaining.pop(int(np.argmax(mmr))))
+        return [groups[i] for i in selected]
+
+    def select(self, candidates: List[Dict], vector_fn: Optional[Callable[[int], np.ndarray]] = None) -> List[Dict]:
+        """
+        选出得分最高（或MMR意义下最优）的文章，并将每篇文章入选的片段按序号划分为连续的段。
+
+        :param candidates: 候选片段，每项包含 "index" 和 "content_sim"
+        :param vector_fn: 根据索引行号返回片段向量的函数，启用MMR时需要
+        :return: 入选文章列表，每项包含 article、score、runs（每段为按片段序号排列的候选片段列表）
+        """
+        groups = self.group(candidates)
+        if not groups:
+            return []
+        if self.mmr_lambda is not None and vector_fn is not None and len(groups) > self.top_articles:
+            groups = self._mmr(groups, vector_fn)
+        else:
+            groups = groups[:self.top_articles]
+
+        for group in groups:
+            chunks = sorted(group["chunks"][:self.chunks_per_article],
+                            key=lambda c: int(self.positions[c["index"]]))
+            runs = [[chunks[0]]]
+            for chunk in chunks[1:]:
+                previous = int(self.positions[runs[-1][-1]["index"]])
+                if int(self.positions[chunk["index"]]) == previous + 1:
+                    runs[-1].append(chunk)
+                else:
+                    runs.append([chunk])
+            group["runs"] = runs
+        return groups
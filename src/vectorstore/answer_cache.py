@@ -0,0 +1,52 @@
+# 答案缓存模块
+# single-flight只合并同时到达的相同问题，计算结束后结果不会保留。热门问题在几分钟内被反复提出时，
+# 每次仍会执行一次检索和一次大模型调用。本模块按规范化后的问题（及过滤条件）缓存成功生成的答案：
+# 1. LRU淘汰，条目数有上限；每个条目有过期时间，索引重建后旧答案会在TTL内自然失效。
+# 2. 只缓存大模型成功生成的答案，上游错误、排队超时和“无法回答”的答复不缓存。
+# 3. 输入提示（/suggest）会优先推荐已缓存答案的问题，引导用户提出可以直接命中缓存的问题。
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0):
+        """
+        :param max_entries: 最多缓存的答案数
+        :param ttl: 答案的有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # 键 -> (答案, 过期时间)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """返回未过期的缓存答案，没有时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        """是否有未过期的缓存答案（不影响LRU顺序）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def put(self, key: Hashable, answer: str):
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
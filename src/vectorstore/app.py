@@ -1,55 +1,253 @@
-# 该代码实现了一个简单的Flask Web应用，提供了基于StrictQASystem的问答服务。
-# 用户可以通过Web接口发送问题，系统会根据预先存储的文档和知识生成专业的答案。
-# Flask Web应用提供了一个问答接口，并允许前端通过API与后端交互。
-# 使用了CORS来允许跨域请求，支持在不同的前端和后端服务器之间的交互。
-# 在`qa`接口中，前端通过POST请求向后端发送问题，后端调用问答系统并返回生成的答案。
-# 该系统通过集成一个经过训练的文本生成模型，确保回答基于预定义的文档内容。
-
-from flask import Flask, render_template, request, jsonify
-from flask_cors import CORS
-from qa_system_pro import StrictQASystem  # 导入自定义的QA系统
-
-# 创建Flask应用实例
-app = Flask(__name__)
-CORS(app)  # 启用CORS，允许跨域请求
-
-# 初始化QA系统
-API_KEY = ""  # 这里替换成你的API密钥
-qa_system = StrictQASystem(api_key=API_KEY)  # 创建QA系统实例
-
-
-@app.route('/')
-def index():
-    """主页路由，渲染首页"""
-    return render_template('index.html')  # 返回主页的HTML模板
-
-
-@app.route('/qa', methods=['POST'])
-def qa():
-    """处理问答请求"""
-    try:
-        # 获取前端发送的JSON数据
-        data = request.json
-        question = data.get('question')  # 从数据中提取问题
-
-        if not question:
-            # 如果没有问题字段，则返回错误响应
-            return jsonify({'error': '问题不能为空'}), 400
-
-        # 使用QA系统生成答案
-        answer = qa_system.generate_answer(question)  # 调用自定义问答系统的生成答案方法
-
-        # 返回答案给前端
-        return jsonify({'answer': answer})
-
-    except Exception as e:
-        # 如果处理过程中发生错误，打印错误信息，并返回服务器内部错误响应
-        print(f"发生错误: {str(e)}")  # 在控制台打印错误信息
-        return jsonify({'error': '服务器内部错误'}), 500
-
-
-if __name__ == '__main__':
-    # 运行Flask应用，启动Web服务
-    print("启动Web服务...")
-    print("请在浏览器中访问 http://localhost:5000")  # 提示用户访问的地址
-    app.run(host='0.0.0.0', port=5000, debug=True)  # 监听所有IP地址，运行在5000端口，开启调试模式
+# 该代码实现了一个简单的Flask Web应用，提供了基于StrictQASystem的问答服务。
+# 用户可以通过Web接口发送问题，系统会根据预先存储的文档和知识生成专业的答案。
+# Flask Web应用提供了一个问答接口，并允许前端通过API与后端交互。
+# 使用了CORS来允许跨域请求，支持在不同的前端和后端服务器之间的交互。
+# 在`qa`接口中，前端通过POST请求向后端发送问题，后端调用问答系统并返回生成的答案。
+# 该系统通过集成一个经过训练的文本生成模型，确保回答基于预定义的文档内容。
+# `qa`接口可以通过 `filters` 字段将检索限定在部分文章、来源站点或抓取时间范围内（格式见filters.py）。
+# 一个服务可以托管多个知识库（配置见kb_registry.py），`qa`接口通过 `kb` 字段选择知识库，知识库在首次使用时加载。
+# `/suggest` 接口根据已输入的前缀返回匹配的文章标题和热门问题（答案已缓存的问题优先），用于输入提示。
+# 带管理员令牌和 X-QA-Profile 请求头（或按比例抽中）的请求会被cProfile剖析，结果按请求ID保存（见profiling.py）；
+# `/admin/slow-requests` 列出最近的慢请求及其各阶段耗时，`/admin/profiles/<request_id>` 下载剖析文件。
+# 设置 QA_CAPTURE_FILE 环境变量时，`qa`接口的请求被匿名化后采集为JSONL（见traffic_capture.py），可用replay.py回放；
+# 请求带 `return_doc_ids: true` 时响应中附带命中的文档ID；带管理员令牌和 X-QA-No-Cache 请求头的请求不使用答案缓存、
+# 不与相同问题合并，每次都执行检索（replay.py对比检索结果时使用）。其他配置同样可以通过 QA_ 开头的环境变量覆盖。
+# 每个`qa`请求从到达起有 QA_REQUEST_TIMEOUT 秒的时间预算（见deadline.py），同时处理的请求数受限，
+# 预计排队后无法在截止时间前完成的请求直接返回503和Retry-After，处理中超过截止时间的请求返回504。
+# `/metrics` 接口以Prometheus文本格式输出各阶段耗时、缓存命中、上游错误等运行指标。
+
+import atexit
+import os
+import time
+import uuid
+
+from flask import Flask, Response, abort, g, has_request_context, render_template, request, jsonify, send_file
+from flask_cors import CORS
+from deadline import AdmissionQueue, Deadline, Overloaded
+from upstream_scheduler import DeadlineExceeded, UpstreamScheduler, process_quota
+from filters import FilterError
+from kb_registry import KnowledgeBaseNotFound, KnowledgeBaseRegistry
+from profiling import Profiler, SlowRequestLog
+from suggest_index import SuggestIndex
+from traffic_capture import TrafficCapture, anonymize
+import metrics
+import request_log
+
+# 创建Flask应用实例
+app = Flask(__name__)
+CORS(app)  # 启用CORS，允许跨域请求
+
+# 初始化QA系统
+# 配置可以通过环境变量覆盖，便于在回放/负载测试时把服务指向假的上游接口
+API_KEY = os.environ.get("QA_API_KEY", "")  # 大模型API密钥
+API_URL = os.environ.get("QA_API_URL")  # 上游chat/completions接口地址，为空时使用默认地址
+INDEX_PREFIX = os.environ.get("QA_INDEX_PREFIX", "enhanced")  # 索引文件前缀
+KB_CONFIG = os.environ.get("QA_KB_CONFIG", "knowledge_bases.json")  # 多知识库配置文件，不存在时只托管 INDEX_PREFIX 一个知识库
+KB_MEMORY_BUDGET_MB = float(os.environ.get("QA_KB_MEMORY_BUDGET_MB", 4096))  # 已加载知识库的内存预算
+ADMIN_TOKEN = os.environ.get("QA_ADMIN_TOKEN", "")  # 管理员令牌，为空时不能通过请求头触发剖析，管理接口也不可用
+PROFILE_DIR = os.environ.get("QA_PROFILE_DIR", "profiles")  # 剖析结果保存目录
+PROFILE_SAMPLE_RATE = float(os.environ.get("QA_PROFILE_SAMPLE_RATE", 0.0))  # 随机剖析的请求比例，0表示只剖析管理员指定的请求
+SLOW_REQUEST_MS = float(os.environ.get("QA_SLOW_REQUEST_MS", 3000))  # 慢请求阈值（毫秒）
+CAPTURE_FILE = os.environ.get("QA_CAPTURE_FILE", "")  # 流量采集文件（JSONL，见traffic_capture.py），为空时不采集
+CAPTURE_SAMPLE_RATE = float(os.environ.get("QA_CAPTURE_SAMPLE_RATE", 1.0))  # 采集的请求比例
+REQUEST_TIMEOUT = float(os.environ.get("QA_REQUEST_TIMEOUT", 30))  # 问答请求从到达起的总时间预算（秒）
+MAX_CONCURRENT_QA = int(os.environ.get("QA_MAX_CONCURRENT", 16))  # 同时处理的问答请求数，超出的请求排队
+ANSWER_CACHE_SIZE = int(os.environ.get("QA_ANSWER_CACHE_SIZE", 1024))  # 每个知识库缓存的答案数，0表示不缓存
+ANSWER_CACHE_TTL = float(os.environ.get("QA_ANSWER_CACHE_TTL", 600))  # 缓存答案的有效期（秒），不应超过索引的重建周期
+SUGGEST_MIN_COUNT = int(os.environ.get("QA_SUGGEST_MIN_COUNT", 3))  # 问题至少被提问多少次才会出现在输入提示中
+
+qa_kwargs = {"api_key": API_KEY, "answer_cache_size": ANSWER_CACHE_SIZE, "answer_cache_ttl": ANSWER_CACHE_TTL,
+             **({"api_url": API_URL} if API_URL else {})}
+# 上游限额：配置 QA_UPSTREAM_RPM（及 QA_UPSTREAM_TPM）时，本服务只使用账号限额中不属于批量任务的部分
+# （批量任务的比例为 QA_BATCH_UPSTREAM_SHARE，见upstream_scheduler.process_quota），所有知识库共用一个调度器
+UPSTREAM_RPM, UPSTREAM_TPM = process_quota("interactive")
+if UPSTREAM_RPM:
+    qa_kwargs["upstream_scheduler"] = UpstreamScheduler(rpm=UPSTREAM_RPM, tpm=UPSTREAM_TPM)
+if os.path.exists(KB_CONFIG):
+    kb_registry = KnowledgeBaseRegistry.from_config(KB_CONFIG, memory_budget_mb=KB_MEMORY_BUDGET_MB, **qa_kwargs)
+else:
+    kb_registry = KnowledgeBaseRegistry({"default": {"index_prefix": INDEX_PREFIX}},
+                                        memory_budget_mb=KB_MEMORY_BUDGET_MB, **qa_kwargs)
+kb_registry.get()  # 启动时加载默认知识库
+
+
+def default_answer_cached(question):
+    """默认知识库是否已缓存该问题的答案（默认知识库被淘汰时视为未缓存）"""
+    qa_system = kb_registry.peek()
+    return qa_system is not None and qa_system.is_answer_cached(question)
+
+
+NO_CACHE_HEADER = 'X-QA-No-Cache'  # 管理员请求带该请求头时不使用答案缓存
+
+# 问答请求的准入控制：预计排队后无法在截止时间前完成的请求直接拒绝
+admission = AdmissionQueue(MAX_CONCURRENT_QA)
+
+# 按需剖析和慢请求记录
+profiler = Profiler(PROFILE_DIR, sample_rate=PROFILE_SAMPLE_RATE, admin_token=ADMIN_TOKEN)
+slow_requests = SlowRequestLog(SLOW_REQUEST_MS)
+request_log.add_finish_hook(slow_requests.record)
+
+
+def remember_request_record(record):
+    """请求结束回调：在Flask请求上下文中保存问答请求的结构化记录，供流量采集和返回命中文档ID使用"""
+    if has_request_context():
+        g.qa_record = record
+
+
+request_log.add_finish_hook(remember_request_record)
+traffic_capture = TrafficCapture(CAPTURE_FILE, sample_rate=CAPTURE_SAMPLE_RATE) if CAPTURE_FILE else None
+
+# 输入提示索引：默认知识库的文章标题和热门问题，热门问题在退出时保存，下次启动时加载
+DEFAULT_PREFIX = kb_registry.knowledge_bases[kb_registry.default_kb]["index_prefix"]
+suggest_index = SuggestIndex.load(DEFAULT_PREFIX, is_cached=default_answer_cached, min_count=SUGGEST_MIN_COUNT)
+atexit.register(suggest_index.save_questions, f"{DEFAULT_PREFIX}_questions.json")
+
+
+def capture_request(question, kb):
+    """取出本次问答请求的结构化记录，并采集匿名化的请求流（供replay.py回放），没有记录时返回None"""
+    record = g.pop('qa_record', None)
+    if traffic_capture is not None and record is not None:
+        traffic_capture.capture(record, question, kb)
+    return record
+
+
+@app.before_request
+def start_timer():
+    """记录请求开始时间，用于统计接口耗时"""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """按接口和状态码统计请求数量与耗时"""
+    endpoint = request.endpoint or "unknown"
+    if endpoint != "metrics_endpoint":
+        metrics.HTTP_REQUESTS.labels(endpoint, response.status_code).inc()
+        metrics.HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - g.request_start)
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """以Prometheus文本格式输出运行指标"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/')
+def index():
+    """主页路由，渲染首页"""
+    return render_template('index.html')  # 返回主页的HTML模板
+
+
+@app.route('/qa', methods=['POST'])
+def qa():
+    """处理问答请求"""
+    deadline = Deadline(REQUEST_TIMEOUT)  # 从请求到达开始计时
+    try:
+        # 获取前端发送的JSON数据
+        data = request.json
+        question = data.get('question')  # 从数据中提取问题
+
+        if not question:
+            # 如果没有问题字段，则返回错误响应
+            return jsonify({'error': '问题不能为空'}), 400
+
+        # 选择知识库，未指定时使用默认知识库
+        kb = data.get('kb') or kb_registry.default_kb
+        try:
+            qa_system = kb_registry.get(kb)
+        except KnowledgeBaseNotFound:
+            return jsonify({'error': f'知识库不存在: {kb}'}), 404
+
+        # 使用QA系统生成答案，可选的过滤条件如 {"sources": ["zh.wikipedia.org"], "crawled_after": "2025-02-01"}
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        # 只有管理员可以绕过答案缓存，避免普通客户端借此放大上游调用
+        use_cache = not (NO_CACHE_HEADER in request.headers and profiler.is_admin(request.headers))
+        try:
+            with admission.admit(deadline), profiler.maybe_profile(request_id, request.headers):
+                answer = qa_system.generate_answer(question, filters=data.get('filters'), request_id=request_id,
+                                                   deadline=deadline, use_cache=use_cache)
+        except FilterError as e:
+            capture_request(question, kb)
+            return jsonify({'error': f'过滤条件无效: {e}'}), 400
+        except Overloaded as e:
+            # 过载时尽早拒绝，客户端按Retry-After稍后重试；被拒绝的请求同样采集，回放时可以复现过载
+            if traffic_capture is not None:
+                traffic_capture.capture_rejected(question, "shed", (time.perf_counter() - g.request_start) * 1000,
+                                                 kb, data.get('filters'))
+            response = jsonify({'error': '当前请求较多，请稍后再试'})
+            response.status_code = 503
+            response.headers['Retry-After'] = e.retry_after_header()
+            return response
+        except (DeadlineExceeded, TimeoutError):
+            # 超过截止时间，或等待相同问题的进行中请求超时
+            capture_request(question, kb)
+            return jsonify({'error': '请求超时，请稍后再试'}), 504
+
+        # 默认知识库中成功回答（答案已进入缓存）的问题匿名化后计入热门问题，被提问足够多次后才用于输入提示
+        if kb == kb_registry.default_kb and qa_system.is_answer_cached(question):
+            suggest_index.record_question(anonymize(question))
+
+        # 采集匿名化的请求流，供replay.py回放
+        record = capture_request(question, kb)
+
+        # 返回答案给前端，请求带 return_doc_ids 时附带命中的文档ID（用于回放时对比检索结果）
+        body = {'answer': answer}
+        if data.get('return_doc_ids') and record is not None:
+            body['doc_ids'] = record['doc_ids']
+        response = jsonify(body)
+        response.headers['X-Request-ID'] = request_id
+        return response
+
+    except Exception as e:
+        # 如果处理过程中发生错误，打印错误信息，并返回服务器内部错误响应
+        print(f"发生错误: {str(e)}")  # 在控制台打印错误信息
+        return jsonify({'error': '服务器内部错误'}), 500
+
+
+@app.route('/kb')
+def knowledge_bases():
+    """列出已配置的知识库及其加载状态"""
+    return jsonify({'knowledge_bases': kb_registry.status()})
+
+
+@app.route('/admin/slow-requests')
+def admin_slow_requests():
+    """列出最近的慢请求及其各阶段耗时，已剖析的请求附带剖析文件地址"""
+    if not profiler.is_admin(request.headers):
+        abort(403)
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    records = []
+    for record in slow_requests.recent(limit):
+        record = dict(record)
+        if os.path.exists(profiler.profile_path(record['request_id'])):
+            record['profile'] = f"/admin/profiles/{record['request_id']}"
+        records.append(record)
+    return jsonify({'threshold_ms': slow_requests.threshold_ms, 'requests': records})
+
+
+@app.route('/admin/profiles/<request_id>')
+def admin_profile(request_id):
+    """下载请求的cProfile剖析文件（pstats格式）"""
+    if not profiler.is_admin(request.headers):
+        abort(403)
+    path = profiler.profile_path(request_id)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True)
+
+
+@app.route('/suggest')
+def suggest():
+    """输入提示：返回以参数q为前缀的文章标题和热门问题"""
+    prefix = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    suggest_index.maybe_refresh()  # 索引重建后增量加入新文章的标题
+    return jsonify({'suggestions': suggest_index.suggest(prefix, limit)})
+
+
+if __name__ == '__main__':
+    # 运行Flask应用，启动Web服务
+    print("启动Web服务...")
+    print("请在浏览器中访问 http://localhost:5000")  # 提示用户访问的地址
+    app.run(host='0.0.0.0', port=5000, debug=True)  # 监听所有IP地址，运行在5000端口，开启调试模式
@@ -0,0 +1,295 @@
+# 批量问答命令行工具
+# 读取JSON行格式的问题文件（每行 {"id": ..., "question": ...}，id可省略），批量生成答案，
+# 用于重新生成FAQ和在数万个问题上做回归检查：
+# 1. 检索按批进行：一批问题一次性向量化并在Faiss中检索（StrictQASystem.batch_search），
+#    可选地分发到多个检索进程（--workers），每个进程加载自己的模型和索引。
+# 2. 大模型调用在线程池中并发执行，并发数有上限（--concurrency），并通过令牌桶限制调用速率（--rate），
+#    并由上游调度器以批量优先级放行。调度器只在本进程内限流，不知道问答服务的调用，因此本任务默认只使用
+#    账号限额（--account-rpm/--account-tpm，默认读取 QA_UPSTREAM_RPM/QA_UPSTREAM_TPM）的 --batch-share 比例
+#    （默认0.25，环境变量 QA_BATCH_UPSTREAM_SHARE），问答服务按相同配置使用其余部分；--rpm/--tpm 可直接指定配额。
+# 3. 每个问题完成后立即将答案、检索到的文档ID（聚合结果包含合并进来的所有片段ID）、每个结果的相似度
+#    和各阶段耗时追加写入输出文件（JSON行）。
+# 4. 答案通过StrictQASystem.answer_retrieved生成，与在线问答一样经过答案缓存、相同问题合并和置信度门控；
+#    检索置信度低于门控阈值的问题不调用大模型，状态记为gated。
+# 5. 可断点续跑：再次运行时跳过输出文件中已成功完成的问题，失败的问题会重新执行。
+#    只检索模式的记录状态为retrieved，只在只检索模式下视为已完成，之后的完整运行仍会生成答案。
+# 用法：python batch_qa.py --input questions.jsonl --output answers.jsonl --concurrency 4 --rate 2
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from qa_system_pro import DEFAULT_API_URL, DEFAULT_LLM_MODEL, NO_ANSWER, StrictQASystem, UpstreamError
+from rate_limit import TokenBucket
+from upstream_scheduler import process_quota
+
+# 已完成、续跑时不再执行的状态
+DONE_STATUSES = ("ok", "no_results", "gated")
+# 只检索模式的完成状态，完整运行时不视为已完成
+RETRIEVED_STATUS = "retrieved"
+NO_RESULTS_ANSWER = NO_ANSWER
+
+_worker_qa = None
+
+
+def _init_worker(factory: Callable, qa_kwargs: dict):
+    """检索进程初始化：加载模型和索引"""
+    global _worker_qa
+    _worker_qa = factory(**qa_kwargs)
+
+
+def _retrieve_batch(questions: List[str]):
+    """在检索进程中批量检索，返回 (各问题的检索结果, 批量耗时)"""
+    start = time.perf_counter()
+    results = _worker_qa.batch_search(questions)
+    return results, time.perf_counter() - start
+
+
+def item_key(item: Dict) -> str:
+    """续跑时用于识别问题的键：优先使用id，否则使用问题文本"""
+    return str(item["id"]) if item.get("id") is not None else item["question"]
+
+
+def load_questions(path: str) -> List[Dict]:
+    """读取问题文件，忽略空行，缺少question字段的行会被跳过"""
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                logging.getLogger(__name__).warning(f"第 {line_no} 行缺少question字段，已跳过")
+                continue
+            items.append(item)
+    return items
+
+
+def completed_keys(path: str, statuses: Iterable[str] = DONE_STATUSES) -> Set[str]:
+    """读取已有输出文件中状态属于statuses的问题，中断时写了一半的最后一行会被忽略"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") in statuses:
+                done.add(item_key(record))
+    return done
+
+
+class BatchRunner:
+    def __init__(self, qa_kwargs: dict, workers: int = 0, batch_size: int = 64, concurrency: int = 4,
+                 rate: Optional[float] = None, retrieval_only: bool = False,
+                 qa_factory: Callable = StrictQASystem):
+        """
+        :param qa_kwargs: 创建StrictQASystem的参数，检索进程使用相同参数各自创建实例
+        :param workers: 检索进程数，0表示在当前进程中检索
+        :param batch_size: 每批一起向量化和检索的问题数
+        :param concurrency: 同时进行的大模型调用数上限
+        :param rate: 每秒最多发起的大模型调用数，None表示不限速
+        :param retrieval_only: 只做检索、不调用大模型（用于检索回归检查）
+        :param qa_factory: 创建问答系统的可调用对象，需要能被检索进程导入
+        """
+        self.qa_kwargs = qa_kwargs
+        self.workers = workers
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, capacity=max(1.0, rate)) if rate else None
+        self.retrieval_only = retrieval_only
+        self.qa_factory = qa_factory
+        self.logger = logging.getLogger(__name__)
+        self.qa = None
+
+    def _retrieval_batches(self, batches: List[List[Dict]]) -> Iterable:
+        """按顺序产出 (批, 检索结果, 批量耗时)；多进程时最多提前提交 2*workers 个批次"""
+        if not self.workers:
+            for batch in batches:
+                start = time.perf_counter()
+                results = self.qa.batch_search([item["question"] for item in batch])
+                yield batch, results, time.perf_counter() - start
+            return
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.qa_factory, self.qa_kwargs)) as pool:
+            queued = deque()
+            remaining = iter(batches)
+            try:
+                for batch in remaining:
+                    queued.append((batch, pool.submit(_retrieve_batch, [item["question"] for item in batch])))
+                    if len(queued) >= 2 * self.workers:
+                        break
+                while queued:
+                    batch, future = queued.popleft()
+                    results, elapsed = future.result()
+                    next_batch = next(remaining, None)
+                    if next_batch is not None:
+                        queued.append((next_batch, pool.submit(_retrieve_batch,
+                                                               [item["question"] for item in next_batch])))
+                    yield batch, results, elapsed
+            finally:
+                for _, future in queued:
+                    future.cancel()
+
+    def _answer(self, item: Dict, results: List[Dict], retrieval_ms: float) -> Dict:
+        """为一个问题生成答案并组装输出记录"""
+        record = {
+            "id": item.get("id"),
+            "question": item["question"],
+            "doc_ids": [doc_id for res in results for doc_id in res.get("ids", [res["id"]])],
+            "scores": [round(res["score"], 4) for res in results],
+            "retrieval_ms": round(retrieval_ms, 3),
+        }
+        if not results:
+            record.update(status="no_results", answer=NO_RESULTS_ANSWER)
+            return record
+        if self.retrieval_only:
+            record.update(status=RETRIEVED_STATUS, answer=None)
+            return record
+
+        if self.bucket is not None:
+            self.bucket.acquire()
+        start = time.perf_counter()
+        try:
+            # 检索结果非空时返回NO_ANSWER说明未通过置信度门控，没有调用大模型
+            answer = self.qa.answer_retrieved(item["question"], results, priority="batch")
+            record.update(answer=answer, status="gated" if answer == NO_ANSWER else "ok")
+        except UpstreamError as e:
+            record.update(status="upstream_error", answer=None, error=str(e))
+        except Exception as e:
+            self.logger.warning(f"生成答案失败: {item['question']}: {e}")
+            record.update(status="error", answer=None, error=str(e))
+        record["llm_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return record
+
+    def run(self, items: List[Dict], output_path: str) -> Dict:
+        """
+        处理所有尚未完成的问题，结果追加写入output_path。
+
+        :return: 本次运行的统计信息
+        """
+        statuses = DONE_STATUSES + (RETRIEVED_STATUS,) if self.retrieval_only else DONE_STATUSES
+        done = completed_keys(output_path, statuses)
+        pending = [item for item in items if item_key(item) not in done]
+        summary = {"total": len(items), "skipped": len(items) - len(pending), "processed": 0}
+        self.logger.info(f"共 {len(items)} 个问题，已完成 {summary['skipped']} 个，本次处理 {len(pending)} 个")
+        if not pending:
+            return summary
+
+        if self.qa is None:
+            self.qa = self.qa_factory(**self.qa_kwargs)
+        batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+        start = time.perf_counter()
+
+        # 如果上次运行在写一行的中途被中断，先补上换行，避免新记录与残缺行粘连
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        else:
+            needs_newline = False
+
+        with open(output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch-llm") as pool:
+            if needs_newline:
+                out.write("\n")
+            in_flight = set()
+
+            def drain(limit: int):
+                # 等待进行中的调用数降到limit以下，并写出已完成的结果
+                nonlocal in_flight
+                while len(in_flight) > limit:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record = future.result()
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        out.flush()
+                        summary["processed"] += 1
+                        summary[record["status"]] = summary.get(record["status"], 0) + 1
+
+            try:
+                for batch, results, elapsed in self._retrieval_batches(batches):
+                    # 批量检索的耗时按问题数平摊
+                    retrieval_ms = elapsed * 1000 / len(batch)
+                    for item, item_results in zip(batch, results):
+                        in_flight.add(pool.submit(self._answer, item, item_results, retrieval_ms))
+                        drain(2 * self.concurrency)
+                drain(0)
+            except KeyboardInterrupt:
+                self.logger.warning("收到中断信号，等待进行中的调用完成后退出，再次运行可继续处理")
+                pool.shutdown(wait=True, cancel_futures=True)
+                in_flight = {future for future in in_flight if not future.cancelled()}
+                drain(0)
+                raise
+
+        summary["seconds"] = round(time.perf_counter() - start, 3)
+        return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量问答：读取JSON行问题文件，输出答案、检索文档ID和耗时，支持断点续跑")
+    parser.add_argument("--input", required=True, help="问题文件，每行 {\"id\": ..., \"question\": ...}")
+    parser.add_argument("--output", required=True, help="结果追加写入的JSON行文件，同时用于断点续跑")
+    parser.add_argument("--api-key", default=os.environ.get("QA_API_KEY", ""), help="大模型API密钥")
+    parser.add_argument("--api-url", default=DEFAULT_API_URL)
+    parser.add_argument("--llm-model", default=DEFAULT_LLM_MODEL)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--index-prefix", default="enhanced")
+    parser.add_argument("--model-name", default="shibing624/text2vec-base-chinese")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批检索的问题数")
+    parser.add_argument("--workers", type=int, default=0, help="检索进程数，0表示在当前进程中检索")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的大模型调用数上限")
+    parser.add_argument("--rate", type=float, default=None, help="每秒最多发起的大模型调用数")
+    parser.add_argument("--account-rpm", type=float, default=None,
+                        help="上游账号每分钟请求数限额（默认读取QA_UPSTREAM_RPM），问答服务与本任务共用")
+    parser.add_argument("--account-tpm", type=float, default=None,
+                        help="上游账号每分钟token数限额（默认读取QA_UPSTREAM_TPM）")
+    parser.add_argument("--batch-share", type=float, default=None,
+                        help="本任务使用的账号限额比例（默认读取QA_BATCH_UPSTREAM_SHARE，未设置时为0.25），"
+                             "问答服务使用其余部分，两者需使用相同的配置")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="直接指定本任务的上游每分钟请求数配额（覆盖按比例计算的值），与问答服务的配额之和不能超过账号限额")
+    parser.add_argument("--tpm", type=float, default=None, help="直接指定本任务的上游每分钟token数配额")
+    parser.add_argument("--retrieval-only", action="store_true", help="只检索、不调用大模型")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    # 上游调度器只在本进程内限流：默认只使用账号限额中分给批量任务的部分，问答服务使用其余部分
+    rpm, tpm = process_quota("batch", args.account_rpm, args.account_tpm, args.batch_share)
+    rpm = args.rpm if args.rpm is not None else rpm
+    tpm = args.tpm if args.tpm is not None else tpm
+    if rpm is None and not args.retrieval_only:
+        logging.warning("未配置上游限额（--account-rpm 或 QA_UPSTREAM_RPM），大模型调用只受 --concurrency/--rate 限制")
+    qa_kwargs = {
+        "api_key": args.api_key,
+        "mongo_uri": args.mongo_uri,
+        "index_prefix": args.index_prefix,
+        "model_name": args.model_name,
+        "api_url": args.api_url,
+        "llm_model": args.llm_model,
+        "debug_sample_rate": 0.0,
+        "upstream_rpm": rpm,
+        "upstream_tpm": tpm,
+    }
+    runner = BatchRunner(qa_kwargs, workers=args.workers, batch_size=args.batch_size,
+                         concurrency=args.concurrency, rate=args.rate, retrieval_only=args.retrieval_only)
+    try:
+        summary = runner.run(load_questions(args.input), args.output)
+    except KeyboardInterrupt:
+        return
+    print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# 上下文打包基准测试脚本
+# 对一组问题比较两种prompt的token数量：
+#   - 基线（打包之前的链路）：Faiss取前7个片段，按相似度取前3个，逐个读取原始片段（不按文章聚合、不拼接、不去重），
+#     每个片段截断为1000字后直接拼接；
+#   - 当前链路：_strict_search（按文章聚合、拼接相邻片段）后由ContextPacker在token预算内打包（StrictQASystem.build_prompt）。
+# 输出每个问题以及汇总的对比结果。
+# 用法：python bench_context_packing.py questions.txt [--budget 1500]
+#       python bench_context_packing.py --synthetic-chunks 20000 --queries 200   # 不依赖MongoDB和模型，使用合成语料
+# questions.txt 每行一个问题。
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+
+from context_packer import estimate_tokens
+from qa_system_pro import PROMPT_TEMPLATE, StrictQASystem
+
+
+def legacy_prompt(query, results):
+    """旧版generate_answer的prompt构建方式"""
+    context = "\n".join([f"[文档 {i + 1}] {res['content'][:1000]}" for i, res in enumerate(results)])
+    return PROMPT_TEMPLATE.format(context=context, query=query)
+
+
+def baseline_results(qa, query, k=7, top=3):
+    """打包之前的检索方式：Faiss取前k个片段，按相似度取前top个，逐个读取原始片段"""
+    query_vectors = qa._encode_queries([query])
+    scores, indices = qa._search_vectors(query_vectors, k)
+    candidates = [{"index": int(idx), "content_sim": float(score)}
+                  for score, idx in zip(scores[0], indices[0]) if idx != -1]
+    candidates.sort(key=lambda res: res["content_sim"], reverse=True)
+    return qa._hydrate_chunks(candidates[:top], detail=False)
+
+
+def synthetic_setup(args):
+    """构建合成语料的索引，返回 (问答系统, 问题列表)"""
+    from synthetic_corpus import InMemoryCollection, StubEncoder, generate_documents, make_queries
+    from vectorstore_enhanced import EnhancedVectorStore
+
+    encoder = StubEncoder()
+    documents = generate_documents(args.synthetic_chunks, seed=0)
+    prefix = os.path.join(tempfile.mkdtemp(prefix="bench_packing_"), "bench")
+    store = EnhancedVectorStore(model_name="stub-hash", cache_dir=None, encoder=encoder)
+    store.create_indices()
+    store.process_data(documents=documents)
+    store.save_indices(prefix)
+    qa = StrictQASystem(api_key="bench", index_prefix=prefix, encoder=encoder,
+                        collection=InMemoryCollection(documents), context_tokens=args.budget,
+                        debug_sample_rate=0.0, async_logging=False)
+    return qa, [query for query, _ in make_queries(documents, args.queries, seed=1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较上下文打包前后的prompt token数量")
+    parser.add_argument("questions", nargs="?", help="问题文件，每行一个问题（使用 --synthetic-chunks 时可省略）")
+    parser.add_argument("--budget", type=int, default=1500, help="上下文token预算")
+    parser.add_argument("--api-key", default="", help="API密钥（本脚本不会调用大模型）")
+    parser.add_argument("--synthetic-chunks", type=int, default=0, help="使用该规模的合成语料和桩编码器，而不是MongoDB中的数据")
+    parser.add_argument("--queries", type=int, default=200, help="使用合成语料时的问题数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.synthetic_chunks:
+        qa, questions = synthetic_setup(args)
+    else:
+        if not args.questions:
+            parser.error("需要提供问题文件，或使用 --synthetic-chunks")
+        qa = StrictQASystem(api_key=args.api_key, context_tokens=args.budget)
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    before, after = [], []
+    for question in questions:
+        raw = baseline_results(qa, question)
+        results = qa._strict_search(question)
+        if not raw or not results:
+            continue
+        old_tokens = estimate_tokens(legacy_prompt(question, raw))
+        new_tokens = estimate_tokens(qa.build_prompt(question, results))
+        before.append(old_tokens)
+        after.append(new_tokens)
+        print(json.dumps({"question": question, "before": old_tokens, "after": new_tokens}, ensure_ascii=False))
+
+    if before:
+        summary = {
+            "questions": len(before),
+            "mean_before": statistics.mean(before),
+            "mean_after": statistics.mean(after),
+            "median_before": statistics.median(before),
+            "median_after": statistics.median(after),
+            "max_before": max(before),
+            "max_after": max(after),
+            "reduction": 1 - sum(after) / sum(before),
+        }
+        print(json.dumps(summary, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
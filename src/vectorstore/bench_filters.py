@@ -0,0 +1,130 @@
+# 过滤检索基准测试：位图选择器 vs 检索后过滤
+# 在合成的聚簇向量和文章级元数据（来源站点、抓取时间）上，对比以下几种检索方式：
+#   none          不过滤（基准延迟）
+#   bitmap        过滤条件编译为位图，由Faiss的IDSelectorBitmap在检索时跳过未选中的行（StrictQASystem的做法）
+#   post-filter   先检索 k*factor 个结果，再丢弃不满足条件的结果
+# 分别在选择性很强（约1%的行）和宽泛（约50%的行）的过滤条件下统计延迟、recall@k（以满足条件的行上的
+# 精确top-k为基准）和返回空结果的查询比例，并统计过滤条件编译（位图构建）首次与命中缓存时的耗时。
+# 用法：python bench_filters.py --synthetic 200000 --queries 500
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+import faiss
+import numpy as np
+
+from bench_quantization import noisy_queries, synthetic_vectors
+from bench_suite import percentiles
+from filters import FilterCompiler
+
+SOURCES = ["zh.wikipedia.org", "baike.baidu.com", "www.zhihu.com", "blog.csdn.net", "www.ithome.com"]
+SOURCE_WEIGHTS = [0.5, 0.2, 0.15, 0.14, 0.01]
+START = datetime(2025, 1, 1)
+
+
+def synthetic_articles(num_rows: int, chunks_per_article: int, days: int, seed: int):
+    """生成文章级元数据和片段→文章映射，每篇文章的片段在索引中连续存放（与process_data一致）"""
+    rng = np.random.default_rng(seed)
+    num_articles = (num_rows + chunks_per_article - 1) // chunks_per_article
+    sources = rng.choice(len(SOURCES), num_articles, p=SOURCE_WEIGHTS)
+    offsets = rng.integers(0, days * 86400, num_articles)
+    articles = [{"title": f"文章{i}", "url": f"https://{SOURCES[s]}/wiki/{i}", "source": SOURCES[s],
+                 "crawled_at": (START + timedelta(seconds=int(offset))).isoformat(timespec="seconds")}
+                for i, (s, offset) in enumerate(zip(sources, offsets))]
+    rows = np.arange(num_rows)
+    chunk_articles = np.stack([rows // chunks_per_article, rows % chunks_per_article], axis=1).astype(np.int32)
+    return articles, chunk_articles
+
+
+def exact_filtered(vectors: np.ndarray, queries: np.ndarray, rows: np.ndarray, k: int) -> np.ndarray:
+    """在满足条件的行上精确检索，返回全局行号（不足k个时以-1填充）"""
+    index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    index.add_with_ids(np.ascontiguousarray(vectors[rows]), rows.astype(np.int64))
+    _, ids = index.search(queries, k)
+    return ids
+
+
+def run_mode(mode: str, index, queries: np.ndarray, k: int, factor: int, row_filter, truth: np.ndarray) -> dict:
+    latencies, found = [], np.full((queries.shape[0], k), -1, dtype=np.int64)
+    mask = np.unpackbits(row_filter.bitmap, bitorder="little").astype(bool) if row_filter is not None else None
+    for row in range(queries.shape[0]):
+        query = queries[row:row + 1]
+        start = time.perf_counter()
+        if mode == "bitmap":
+            _, ids = index.search(query, k, params=row_filter.params)
+            ids = ids[0]
+        elif mode == "post-filter":
+            _, ids = index.search(query, k * factor)
+            ids = ids[0][ids[0] >= 0]
+            ids = ids[mask[ids]][:k]
+        else:
+            _, ids = index.search(query, k)
+            ids = ids[0]
+        latencies.append(time.perf_counter() - start)
+        found[row, :len(ids)] = ids
+
+    expected = sum(int((truth[row] >= 0).sum()) for row in range(truth.shape[0]))
+    hits = sum(len(set(found[row][found[row] >= 0]) & set(truth[row][truth[row] >= 0]))
+               for row in range(truth.shape[0]))
+    return dict({"mode": mode,
+                 "recall_at_k": round(hits / max(expected, 1), 4),
+                 "empty_fraction": round(float((found[:, 0] < 0).mean()), 4)},
+                **percentiles(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比位图过滤检索与检索后过滤的延迟和召回率")
+    parser.add_argument("--synthetic", type=int, default=200000, help="合成的向量数")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.5, help="查询向量相对语料向量的噪声强度")
+    parser.add_argument("-k", type=int, default=7, help="检索的结果数（与StrictQASystem一致）")
+    parser.add_argument("--post-filter-factor", type=int, default=4, help="检索后过滤时检索k的多少倍")
+    parser.add_argument("--chunks-per-article", type=int, default=8)
+    parser.add_argument("--days", type=int, default=100, help="抓取时间分布的天数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic, args.dim, args.seed)
+    queries = noisy_queries(vectors, args.queries, args.noise, args.seed + 1)
+    articles, chunk_articles = synthetic_articles(args.synthetic, args.chunks_per_article, args.days, args.seed)
+    index = faiss.IndexFlatIP(args.dim)
+    index.add(vectors)
+    compiler = FilterCompiler(articles, chunk_articles)
+
+    filters = {
+        "selective": {"sources": [SOURCES[-1]]},
+        "broad": {"crawled_after": (START + timedelta(days=args.days // 2)).isoformat()},
+    }
+    print(f"数据: {args.synthetic} 个 {args.dim} 维向量，{len(articles)} 篇文章，{args.queries} 个查询，k={args.k}")
+    print(f"{'过滤条件':<12}{'方式':<13}{'选中比例':>10}{'recall@k':>10}{'空结果':>8}{'p50 ms':>9}{'p99 ms':>9}")
+    for name, spec in [("none", None)] + list(filters.items()):
+        start = time.perf_counter()
+        row_filter = compiler.compile(spec)
+        compile_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        compiler.compile(spec)
+        cached_ms = (time.perf_counter() - start) * 1000
+
+        if row_filter is None:
+            _, truth = index.search(queries, args.k)
+            modes = ["none"]
+            selectivity = 1.0
+        else:
+            rows = np.flatnonzero(np.unpackbits(row_filter.bitmap, bitorder="little")[:args.synthetic])
+            truth = exact_filtered(vectors, queries, rows, args.k)
+            modes = ["bitmap", "post-filter"]
+            selectivity = row_filter.selectivity
+        for mode in modes:
+            record = run_mode(mode, index, queries, args.k, args.post_filter_factor, row_filter, truth)
+            print(f"{name:<12}{mode:<13}{selectivity:>10.4f}{record['recall_at_k']:>10.4f}"
+                  f"{record['empty_fraction']:>8.3f}{record['p50_ms']:>9.3f}{record['p99_ms']:>9.3f}")
+        if row_filter is not None:
+            print(json.dumps({"filter": name, "compile_ms": round(compile_ms, 3),
+                              "cached_compile_ms": round(cached_ms, 3)}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
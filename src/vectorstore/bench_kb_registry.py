@@ -0,0 +1,108 @@
+# 多知识库服务基准测试
+# 构建N个合成知识库（各自的索引、元数据和文档集合），在同一进程中通过KnowledgeBaseRegistry依次访问，统计：
+#   - 冷加载延迟：首次访问知识库时加载索引和元数据并完成一次检索的耗时
+#   - 热查询延迟：知识库加载后的检索延迟（p50/p99）
+#   - 随已加载知识库数量增长的常驻内存（匿名内存与文件映射分开统计，内容索引以内存映射方式打开）
+# 之后以只能容纳部分知识库的内存预算、按Zipf分布的知识库热度随机访问，统计命中率、淘汰次数和按需加载的延迟。
+# 用法：python bench_kb_registry.py --kbs 8 --chunks 20000
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from bench_quantization import rss_breakdown
+from bench_suite import percentiles
+from kb_registry import KB_EVICTIONS, KnowledgeBaseRegistry, estimate_kb_bytes
+from synthetic_corpus import InMemoryCollection, StubEncoder, generate_documents, make_queries
+from vectorstore_enhanced import EnhancedVectorStore
+
+MB = 1024 * 1024
+
+
+def build_kbs(args, encoder, workdir: str):
+    """构建合成知识库，返回 (配置, 数据库名 -> 文档, 知识库名 -> 查询)"""
+    config, documents, queries = {}, {}, {}
+    for i in range(args.kbs):
+        name = f"kb{i}"
+        docs = generate_documents(args.chunks, seed=i)
+        prefix = os.path.join(workdir, name)
+        store = EnhancedVectorStore(model_name="stub-hash", cache_dir=None, encoder=encoder)
+        store.create_indices()
+        store.process_data(documents=docs)
+        store.save_indices(prefix)
+        config[name] = {"index_prefix": prefix, "database": name, "collection": "articles"}
+        documents[name] = docs
+        queries[name] = [query for query, _ in make_queries(docs, args.queries, seed=i + 1000)]
+    return config, documents, queries
+
+
+def make_registry(config, documents, encoder, budget_mb: float) -> KnowledgeBaseRegistry:
+    collections = {name: InMemoryCollection(docs) for name, docs in documents.items()}
+    return KnowledgeBaseRegistry(config, memory_budget_mb=budget_mb, encoder=encoder,
+                                 collection_factory=lambda database, collection: collections[database],
+                                 api_key="bench", debug_sample_rate=0.0, async_logging=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多知识库服务的冷加载、热查询延迟和内存随知识库数量的变化")
+    parser.add_argument("--kbs", type=int, default=8, help="知识库数量")
+    parser.add_argument("--chunks", type=int, default=20000, help="每个知识库的片段数")
+    parser.add_argument("--queries", type=int, default=100, help="每个知识库的热查询次数")
+    parser.add_argument("--budget-kbs", type=float, default=3.5, help="淘汰测试中内存预算可容纳的知识库数")
+    parser.add_argument("--accesses", type=int, default=300, help="淘汰测试的访问次数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    encoder = StubEncoder()
+    with tempfile.TemporaryDirectory(prefix="bench_kb_") as workdir:
+        config, documents, queries = build_kbs(args, encoder, workdir)
+        kb_mb = estimate_kb_bytes(config["kb0"]["index_prefix"]) / MB
+        print(f"{args.kbs} 个知识库，每个 {args.chunks} 个片段，估算 {kb_mb:.1f} MB")
+
+        # 不限内存：依次加载所有知识库
+        registry = make_registry(config, documents, encoder, budget_mb=1e9)
+        anon_base, file_base = rss_breakdown()
+        print(f"{'已加载':>6}{'冷加载 ms':>12}{'热p50 ms':>10}{'热p99 ms':>10}{'匿名RSS MB':>12}{'文件RSS MB':>12}")
+        for count, name in enumerate(config, 1):
+            start = time.perf_counter()
+            registry.get(name)._strict_search(queries[name][0])
+            cold_ms = (time.perf_counter() - start) * 1000
+            latencies = []
+            for query in queries[name][1:]:
+                t0 = time.perf_counter()
+                registry.get(name)._strict_search(query)
+                latencies.append(time.perf_counter() - t0)
+            warm = percentiles(latencies)
+            anon, file = rss_breakdown()
+            print(f"{count:>6}{cold_ms:>12.1f}{warm['p50_ms']:>10.3f}{warm['p99_ms']:>10.3f}"
+                  f"{(anon - anon_base) / MB:>12.1f}{(file - file_base) / MB:>12.1f}")
+        del registry
+
+        # 内存预算只能容纳部分知识库：按Zipf分布的热度随机访问，统计命中、淘汰和按需加载
+        registry = make_registry(config, documents, encoder, budget_mb=kb_mb * args.budget_kbs)
+        evictions_before = sum(KB_EVICTIONS.labels(name).value for name in config)
+        rng = random.Random(0)
+        names = list(config)
+        weights = [1.0 / (rank + 1) for rank in range(len(names))]
+        loads, hits = [], []
+        for i in range(args.accesses):
+            name = rng.choices(names, weights)[0]
+            loaded = registry.peek(name) is not None
+            start = time.perf_counter()
+            registry.get(name)._strict_search(queries[name][i % len(queries[name])])
+            (hits if loaded else loads).append(time.perf_counter() - start)
+        evictions = sum(KB_EVICTIONS.labels(name).value for name in config) - evictions_before
+        print(json.dumps({"budget_mb": round(kb_mb * args.budget_kbs, 1),
+                          "loaded": sum(1 for kb in registry.status() if kb["loaded"]),
+                          "hit_rate": round(len(hits) / args.accesses, 3),
+                          "evictions": int(evictions),
+                          "load_on_access": percentiles(loads),
+                          "hit": percentiles(hits)}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
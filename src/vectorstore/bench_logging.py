@@ -0,0 +1,115 @@
+# 日志模式基准测试脚本
+# 在多个线程中模拟问答请求的日志输出，比较两种模式下每秒可处理的请求数：
+# 1. legacy：旧版StrictQASystem的行为，每个请求同步输出约15行INFO日志到文件。
+# 2. structured：队列异步日志，每个请求一行JSON，详细日志按采样比例输出并脱敏。
+# 用法：python bench_logging.py [--requests 20000] [--threads 8] [--sample-rate 0.01]
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import request_log
+
+_PREVIEW = "机器学习\n机器学习是人工智能的一个分支，它使计算机能够从数据中学习而无需明确编程。" * 3
+_HEADERS = {"Authorization": "Bearer sk-0123456789abcdef", "Content-Type": "application/json"}
+
+
+def legacy_request(logger, i):
+    """旧版每个请求输出的同步INFO日志"""
+    logger.info(f"\n=== 内容匹配结果 ===")
+    for rank in range(7):
+        logger.info(f"匹配 {rank + 1}: 相似度={0.8 - rank * 0.01:.4f} | 内容={_PREVIEW[:100]}")
+    for rank in range(7):
+        logger.info(f"内容匹配检查：内容相似度={0.8 - rank * 0.01:.4f}")
+    logger.info(f"候选结果数量: 7")
+    for rank in range(3):
+        logger.info(f"正在处理索引 {i + rank}，对应的文档ID: 67adbf5972124f95d98255{rank:02d}")
+        logger.info(f"成功存储文档 67adbf5972124f95d98255{rank:02d}，内容: {_PREVIEW[:100]}")
+    logger.info(f"请求头: {_HEADERS}")
+    logger.info(f"API响应内容: {json.dumps({'choices': [{'message': {'content': _PREVIEW}}]}, ensure_ascii=False)[:200]}...")
+
+
+def structured_request(detail_logger, i, sample_rate):
+    """新版每个请求的日志：一行JSON，详细日志按比例采样"""
+    context, token = request_log.start_request(f"问题{i}", sample_rate)
+    if context.sampled:
+        for rank in range(7):
+            detail_logger.debug(f"匹配 {rank + 1}: 相似度={0.8 - rank * 0.01:.4f} | 内容={_PREVIEW[:100]}")
+        detail_logger.debug(f"请求头: {_HEADERS}")
+    for stage in ("encode", "search", "reconstruct", "hydrate", "prompt", "llm"):
+        context.add_stage(stage, 0.001)
+    context.doc_ids = [f"67adbf5972124f95d98255{rank:02d}" for rank in range(3)]
+    request_log.finish_request(context, token)
+
+
+def run(worker, requests, threads):
+    per_thread = requests // threads
+
+    def loop(offset):
+        for i in range(per_thread):
+            worker(offset + i)
+
+    workers = [threading.Thread(target=loop, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def reset_logging():
+    request_log.stop_logging()
+    for name in (None, request_log.REQUEST_LOGGER_NAME):
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较同步逐行日志与异步结构化日志的吞吐量")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sample-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_logging_")
+
+    # 旧版：同步文件日志
+    handler = logging.FileHandler(os.path.join(workdir, "legacy.log"), encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    legacy_logger = logging.getLogger("bench.legacy")
+    legacy_qps = run(lambda i: legacy_request(legacy_logger, i), args.requests, args.threads)
+    reset_logging()
+
+    # 新版：异步队列 + 结构化请求日志 + 采样详细日志
+    request_log.configure_logging(async_mode=True,
+                                  log_file=os.path.join(workdir, "qa.log"),
+                                  request_log_file=os.path.join(workdir, "requests.jsonl"),
+                                  console=False)
+    detail_logger = logging.getLogger("bench.detail")
+    detail_logger.setLevel(logging.DEBUG)
+    structured_qps = run(lambda i: structured_request(detail_logger, i, args.sample_rate), args.requests, args.threads)
+    reset_logging()
+
+    print(json.dumps({
+        "requests": args.requests,
+        "threads": args.threads,
+        "sample_rate": args.sample_rate,
+        "legacy_requests_per_second": round(legacy_qps, 1),
+        "structured_requests_per_second": round(structured_qps, 1),
+        "speedup": round(structured_qps / legacy_qps, 2),
+        "log_dir": workdir,
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# 过载负载测试：截止时间与准入控制
+# 在本地启动一个处理能力有限的假大模型服务（同时只处理 --upstream-concurrency 个请求，每个耗时 --llm-latency 秒），
+# 以超过其处理能力的速率（泊松到达）发送问题，按 /qa 接口的处理方式对比两种场景：
+#   - 不设截止时间、不做准入控制：请求全部堆积在上游调用上，延迟随积压线性增长
+#   - 每个请求从到达起有 --budget 秒的预算，并经过AdmissionQueue：预计无法按时完成的请求立即被拒绝（503），
+#     被接受的请求在各阶段前检查截止时间，上游超时取剩余时间
+# 统计各状态的请求数、成功请求和所有请求的端到端延迟分布以及被拒绝请求的响应时间。
+# 用法：python bench_overload.py --rps 16 --duration 15 --budget 3
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import request_log
+from bench_suite import percentiles
+from deadline import AdmissionQueue, Deadline, Overloaded
+from fake_llm_server import FakeLLMServer
+from qa_system_pro import StrictQASystem
+from synthetic_corpus import InMemoryCollection, StubEncoder, generate_documents, make_queries
+from upstream_scheduler import DeadlineExceeded
+from vectorstore_enhanced import EnhancedVectorStore
+
+
+def build_index(documents, encoder) -> str:
+    prefix = os.path.join(tempfile.mkdtemp(prefix="bench_overload_"), "bench")
+    store = EnhancedVectorStore(model_name="stub-hash", cache_dir=None, encoder=encoder)
+    store.create_indices()
+    store.process_data(documents=documents)
+    store.save_indices(prefix)
+    return prefix
+
+
+# 请求ID -> 请求结束时的状态（由request_log的请求结束回调记录）
+finished = {}
+
+
+def run_scenario(args, prefix, documents, encoder, queries, protected: bool) -> dict:
+    with FakeLLMServer(latency=args.llm_latency, max_concurrency=args.upstream_concurrency) as upstream:
+        qa = StrictQASystem(api_key="bench", index_prefix=prefix, encoder=encoder,
+                            collection=InMemoryCollection(documents), api_url=upstream.url,
+                            debug_sample_rate=0.0, async_logging=False, answer_cache_size=0,
+                            confidence_gate=False)
+        admission = AdmissionQueue(args.max_concurrent, initial_service_time=args.llm_latency)
+        lock = threading.Lock()
+        statuses, latencies, ok_latencies, shed_latencies = Counter(), [], [], []
+
+        def handle(i: int):
+            # 与 /qa 接口相同：到达时创建截止时间，经过准入控制后生成答案
+            start = time.perf_counter()
+            request_id = f"overload-{i}"
+            question = f"{queries[i % len(queries)][0]} #{i}"
+            try:
+                if protected:
+                    deadline = Deadline(args.budget)
+                    with admission.admit(deadline):
+                        qa.generate_answer(question, request_id=request_id, deadline=deadline)
+                else:
+                    qa.generate_answer(question, request_id=request_id)
+                status = finished.pop(request_id, "unknown")
+            except (DeadlineExceeded, TimeoutError):
+                # 接口返回504，状态由请求结束回调记录
+                status = finished.pop(request_id, "unknown")
+            except Overloaded:
+                status = "shed_503"
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                latencies.append(elapsed)
+                if status == "ok":
+                    ok_latencies.append(elapsed)
+                elif status == "shed_503":
+                    shed_latencies.append(elapsed)
+
+        rng = random.Random(0)
+        threads = []
+        start = time.monotonic()
+        i = 0
+        while time.monotonic() - start < args.duration:
+            thread = threading.Thread(target=handle, args=(i,), daemon=True)
+            thread.start()
+            threads.append(thread)
+            i += 1
+            time.sleep(rng.expovariate(args.rps))
+        for thread in threads:
+            thread.join()
+
+        return {
+            "protected": protected,
+            "requests": i,
+            "wall_seconds": round(time.monotonic() - start, 1),
+            "status": dict(statuses),
+            "upstream_requests": upstream.requests,
+            "all_latency": dict(percentiles(latencies), max_ms=round(max(latencies) * 1000, 1)),
+            "ok_latency": percentiles(ok_latencies),
+            "shed_latency": percentiles(shed_latencies),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上游变慢时对比有无截止时间和准入控制的尾延迟")
+    parser.add_argument("--rps", type=float, default=16.0, help="问题每秒到达数（泊松到达）")
+    parser.add_argument("--duration", type=float, default=15.0, help="每个场景发送问题的时间（秒）")
+    parser.add_argument("--budget", type=float, default=3.0, help="每个请求从到达起的时间预算（秒）")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="准入控制同时处理的请求数")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="假大模型服务处理每个请求的时间（秒）")
+    parser.add_argument("--upstream-concurrency", type=int, default=4, help="假大模型服务同时处理的请求数")
+    parser.add_argument("--chunks", type=int, default=2000, help="合成语料的片段数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    request_log.add_finish_hook(lambda record: finished.__setitem__(record["request_id"], record["status"]))
+    encoder = StubEncoder()
+    documents = generate_documents(args.chunks, seed=0)
+    queries = make_queries(documents, 500, seed=1)
+    prefix = build_index(documents, encoder)
+    capacity = args.upstream_concurrency / args.llm_latency
+    print(f"上游处理能力约 {capacity:.1f} 个请求/秒，到达速率 {args.rps:.1f} 个/秒")
+
+    for protected in (False, True):
+        result = run_scenario(args, prefix, documents, encoder, queries, protected)
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# 标量量化索引基准测试：召回率 / 内存 / 延迟
+# 对比以下几种内容索引的配置：
+#   flat            全精度IndexFlatIP（当前默认）
+#   sq8 / fp16      只使用标量量化索引检索
+#   sq8+rescore     标量量化索引检索 k*factor 个候选，再用内存映射的全精度向量精确重排序（StrictQASystem的做法）
+#   fp16+rescore    同上，使用fp16量化
+# 召回率以全精度精确检索的top-k为基准（recall@k）。每种配置在独立的子进程中加载和查询，
+# 以便准确统计加载后的常驻内存（RSS）增量。RSS分为匿名内存和文件映射两部分：匿名内存是每个服务进程独占的，
+# 而内存映射文件中被访问到的页面属于页缓存，可在进程间共享并在内存紧张时被回收（文件系统可能以大页映射，
+# 因此少量随机访问也可能使文件映射部分明显增长）。
+# 数据可以来自已有的索引（--index enhanced_content.index，查询为加噪声的语料向量），
+# 也可以是合成的聚簇向量（--synthetic 1000000，近似真实句向量的分布）。
+# 用法：python bench_quantization.py --index enhanced_content.index
+#       python bench_quantization.py --synthetic 1000000 --queries 1000
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+
+from bench_suite import percentiles
+from quantization import build_quantized_index, rescore
+
+VARIANTS = ["flat", "sq8", "sq8+rescore", "fp16", "fp16+rescore"]
+
+
+def rss_breakdown() -> tuple:
+    """当前进程的 (匿名常驻内存, 文件映射常驻内存)，单位字节"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                name, amount, _ = line.split()
+                values[name] = int(amount) * 1024
+    return values["RssAnon:"], values["RssFile:"]
+
+
+def synthetic_vectors(num: int, dim: int, seed: int, clusters: int = 1000, batch: int = 100000) -> np.ndarray:
+    """生成聚簇分布的已归一化向量，分批生成以控制峰值内存"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = np.empty((num, dim), dtype=np.float32)
+    for start in range(0, num, batch):
+        end = min(start + batch, num)
+        labels = rng.integers(0, clusters, end - start)
+        vectors[start:end] = centers[labels] + 0.8 * rng.standard_normal((end - start, dim), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def noisy_queries(vectors: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    """从语料中随机抽取向量并叠加噪声作为查询，模拟与某个片段相关但不完全相同的问题"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, vectors.shape[0], count)
+    queries = vectors[rows] + noise * rng.standard_normal((count, vectors.shape[1]), dtype=np.float32) / np.sqrt(
+        vectors.shape[1])
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def prepare(args, workdir: str) -> dict:
+    """准备向量、查询、各索引文件和精确检索的基准结果"""
+    if args.index:
+        base = faiss.read_index(args.index)
+        vectors = base.reconstruct_n(0, base.ntotal)
+        source = args.index
+        del base
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim, args.seed)
+        source = f"synthetic-{args.synthetic}"
+    queries = noisy_queries(vectors, args.queries, args.noise, args.seed + 1)
+
+    paths = {"vectors": os.path.join(workdir, "vectors.npy"), "queries": os.path.join(workdir, "queries.npy")}
+    np.save(paths["vectors"], vectors)
+    np.save(paths["queries"], queries)
+    # 之后改为内存映射读取，避免在构建各索引时同时持有多份全量向量
+    del vectors
+    vectors = np.load(paths["vectors"], mmap_mode="r")
+
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    paths["flat"] = os.path.join(workdir, "flat.index")
+    faiss.write_index(flat, paths["flat"])
+    _, truth = flat.search(queries, args.k)
+    del flat
+
+    build_seconds = {}
+    for quantization in ("sq8", "fp16"):
+        start = time.perf_counter()
+        index = build_quantized_index(vectors, quantization)
+        build_seconds[quantization] = round(time.perf_counter() - start, 3)
+        paths[quantization] = os.path.join(workdir, f"{quantization}.index")
+        faiss.write_index(index, paths[quantization])
+        del index
+
+    return {"source": source, "num_vectors": int(vectors.shape[0]), "dim": int(vectors.shape[1]),
+            "paths": paths, "truth": truth, "build_seconds": build_seconds}
+
+
+def run_variant(variant: str, paths: dict, k: int, factor: int, truth: np.ndarray) -> dict:
+    """在子进程中加载一种配置并逐条查询"""
+    queries = np.load(paths["queries"])
+    quantization, _, mode = variant.partition("+")
+    anon_before, file_before = rss_breakdown()
+    index = faiss.read_index(paths[quantization])
+    full_vectors = np.load(paths["vectors"], mmap_mode="r") if mode == "rescore" else None
+    anon_loaded, _ = rss_breakdown()
+
+    latencies, found = [], np.empty((queries.shape[0], k), dtype=np.int64)
+    for row in range(queries.shape[0]):
+        query = queries[row:row + 1]
+        start = time.perf_counter()
+        if full_vectors is None:
+            _, ids = index.search(query, k)
+        else:
+            _, candidates = index.search(query, k * factor)
+            _, ids = rescore(query, candidates, full_vectors, k)
+        latencies.append(time.perf_counter() - start)
+        found[row] = ids[0]
+
+    hits = sum(len(set(found[row]) & set(truth[row])) for row in range(truth.shape[0]))
+    index_bytes = os.path.getsize(paths[quantization])
+    anon_after, file_after = rss_breakdown()
+    return dict({"variant": variant,
+                 "recall_at_k": round(hits / truth.size, 4),
+                 "index_bytes": index_bytes,
+                 "side_file_bytes": os.path.getsize(paths["vectors"]) if full_vectors is not None else 0,
+                 "anon_rss_loaded_bytes": anon_loaded - anon_before,
+                 "anon_rss_after_queries_bytes": anon_after - anon_before,
+                 "file_rss_after_queries_bytes": file_after - file_before},
+                **percentiles(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比全精度与标量量化内容索引的召回率、内存和延迟")
+    parser.add_argument("--index", help="已有的内容索引文件，例如 enhanced_content.index")
+    parser.add_argument("--synthetic", type=int, default=100000, help="未指定--index时合成的向量数")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--noise", type=float, default=0.5, help="查询向量相对语料向量的噪声强度")
+    parser.add_argument("-k", type=int, default=7, help="检索的结果数（与StrictQASystem一致）")
+    parser.add_argument("--rescore-factor", type=int, default=4, help="重排序时第一阶段候选数为k的倍数")
+    parser.add_argument("--variants", default=",".join(VARIANTS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="结果追加写入的JSON行文件")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_quantization_") as workdir:
+        data = prepare(args, workdir)
+        print(f"数据: {data['source']}，{data['num_vectors']} 个 {data['dim']} 维向量，{args.queries} 个查询，"
+              f"k={args.k}，重排序倍数={args.rescore_factor}，量化训练+添加耗时: {data['build_seconds']}")
+        print(f"{'配置':<14}{'recall@k':>10}{'索引MB':>10}{'旁路MB':>10}{'匿名RSS MB':>12}"
+              f"{'文件RSS MB':>12}{'p50 ms':>9}{'p99 ms':>9}")
+
+        context = multiprocessing.get_context("spawn")
+        for variant in args.variants.split(","):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                record = pool.submit(run_variant, variant, data["paths"], args.k, args.rescore_factor,
+                                     data["truth"]).result()
+            mb = 1024 * 1024
+            print(f"{variant:<14}{record['recall_at_k']:>10.4f}{record['index_bytes'] / mb:>10.1f}"
+                  f"{record['side_file_bytes'] / mb:>10.1f}{record['anon_rss_after_queries_bytes'] / mb:>12.1f}"
+                  f"{record['file_rss_after_queries_bytes'] / mb:>12.1f}{record['p50_ms']:>9.3f}{record['p99_ms']:>9.3f}")
+            if args.output:
+                record.update({"source": data["source"], "num_vectors": data["num_vectors"], "k": args.k,
+                               "rescore_factor": args.rescore_factor, "queries": args.queries,
+                               "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")})
+                with open(args.output, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# 输入提示索引基准测试
+# 在合成语料的文章标题和由语料句子构成的历史问题（被提问次数服从Zipf分布）上构建约10万个条目的前缀索引，统计：
+#   - 构建耗时和常驻内存增量
+#   - 不同前缀长度下 /suggest 查询的延迟（p50/p99），前缀取自已有条目，短前缀匹配的区间最大
+#   - 增量记录新问题的延迟，以及缓冲区满时合并到有序数组的耗时
+# 用法：python bench_suggest.py --entries 100000
+
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from bench_suite import current_rss, percentiles
+from suggest_index import SuggestIndex
+from synthetic_corpus import generate_documents, make_queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输入提示前缀索引的构建、查询和增量更新耗时")
+    parser.add_argument("--entries", type=int, default=100000, help="索引的条目数（标题 + 历史问题）")
+    parser.add_argument("--chunks", type=int, default=20000, help="合成语料的片段数，文章标题来自该语料")
+    parser.add_argument("--lookups", type=int, default=2000, help="每种前缀长度的查询次数")
+    parser.add_argument("--limit", type=int, default=8, help="每次返回的提示数")
+    parser.add_argument("--max-pending", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    documents = generate_documents(args.chunks, seed=args.seed)
+    titles = sorted({doc["title"] for doc in documents})
+    questions = list(dict.fromkeys(query for query, _ in make_queries(documents, args.entries * 2, seed=args.seed + 1)))
+    questions = questions[:max(args.entries - len(titles), 0)]
+    counts = np.random.default_rng(args.seed).zipf(1.5, len(questions))
+    new_questions = [query for query, _ in make_queries(documents, args.max_pending * 2, seed=args.seed + 2)]
+
+    rss_before = current_rss()
+    start = time.perf_counter()
+    index = SuggestIndex(max_pending=float("inf"))
+    for title in titles:
+        index.add(title)
+    for question, count in zip(questions, counts):
+        index.record_question(question, int(count))
+    with index._lock:
+        index._merge()
+    index.max_pending = args.max_pending
+    build_seconds = time.perf_counter() - start
+    record = {"entries": len(index), "titles": len(titles), "build_seconds": round(build_seconds, 3),
+              "rss_delta_bytes": current_rss() - rss_before}
+
+    entries = titles + questions
+    for length in (1, 2, 4, 8):
+        prefixes = [rng.choice(entries)[:length] for _ in range(args.lookups)]
+        latencies, matched = [], 0
+        for prefix in prefixes:
+            t0 = time.perf_counter()
+            matched += len(index.suggest(prefix, args.limit))
+            latencies.append(time.perf_counter() - t0)
+        record[f"prefix_{length}"] = dict(percentiles(latencies), mean_results=round(matched / len(prefixes), 2))
+
+    # 增量记录新问题：缓冲区满时触发合并，单独统计合并耗时
+    latencies, merges = [], []
+    for question in new_questions:
+        pending = len(index._pending)
+        t0 = time.perf_counter()
+        index.record_question(question)
+        elapsed = time.perf_counter() - t0
+        (merges if pending and not index._pending else latencies).append(elapsed)
+    record["record_question"] = percentiles(latencies)
+    record["merge_ms"] = [round(m * 1000, 1) for m in merges]
+
+    # 缓冲区中有条目时的查询延迟
+    latencies = []
+    for _ in range(args.lookups):
+        prefix = rng.choice(entries)[:2]
+        t0 = time.perf_counter()
+        index.suggest(prefix, args.limit)
+        latencies.append(time.perf_counter() - t0)
+    record["prefix_2_with_pending"] = dict(percentiles(latencies), pending=len(index._pending))
+    print(json.dumps(record, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
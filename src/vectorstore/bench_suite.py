@@ -0,0 +1,191 @@
+# 离线检索基准测试套件
+# 不依赖MongoDB、向量化模型下载和远程大模型接口，端到端地衡量索引构建和问答检索的性能：
+# 1. 使用synthetic_corpus生成指定规模的中文合成语料（例如1万到100万个片段）。
+# 2. 使用确定性的桩编码器（或真实模型）驱动EnhancedVectorStore构建索引，记录构建时间和索引大小，
+#    以及不使用向量缓存、首次写入缓存和缓存全部命中时重建索引的总耗时和其中向量化阶段的耗时。
+#    桩编码器几乎不耗时，重建测试用SlowEncoder为每个片段加上 --rebuild-encode-ms 毫秒，模拟真实模型的向量化开销。
+# 3. 使用内存文档集合和进程内的假大模型服务驱动StrictQASystem，
+#    记录检索延迟的p50/p95/p99、QPS、召回率以及端到端问答延迟。
+# 4. 每个规模在独立的子进程中运行，以便准确统计常驻内存（RSS），结果以JSON行追加写入输出文件，便于跟踪回归。
+# 用法：python bench_suite.py --sizes 10000,100000 --queries 500 --output bench_results.jsonl
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+
+def current_rss() -> int:
+    """当前进程的常驻内存（字节）"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss() -> int:
+    """当前进程的峰值常驻内存（字节）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(latencies) -> dict:
+    values = np.asarray(latencies, dtype=np.float64) * 1000
+    if values.size == 0:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+            "mean_ms": round(float(values.mean()), 3)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def make_encoder(args):
+    """根据参数创建桩编码器或真实的SentenceTransformer模型"""
+    if args.encoder == "stub":
+        from synthetic_corpus import StubEncoder
+        return StubEncoder(dim=args.dim), "stub-hash"
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(args.encoder), args.encoder
+
+
+def run_size(size: int, args) -> dict:
+    """在当前进程中完成一个规模的构建与查询测试"""
+    logging.basicConfig(level=logging.WARNING)
+    from fake_llm_server import FakeLLMServer
+    from qa_system_pro import StrictQASystem
+    from synthetic_corpus import InMemoryCollection, generate_documents, make_queries
+    from vectorstore_enhanced import EnhancedVectorStore
+
+    record = {"size": size, "encoder": args.encoder, "dedup": args.dedup}
+    encoder, model_name = make_encoder(args)
+
+    start = time.perf_counter()
+    documents = generate_documents(size, seed=args.seed)
+    record["corpus_seconds"] = round(time.perf_counter() - start, 3)
+
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    prefix = os.path.join(workdir, "bench")
+
+    # 索引构建
+    store = EnhancedVectorStore(model_name=model_name, dedup=args.dedup, cache_dir=None, encoder=encoder)
+    start = time.perf_counter()
+    store.create_indices()
+    store.process_data(documents=documents)
+    store.save_indices(prefix)
+    record["build_seconds"] = round(time.perf_counter() - start, 3)
+    record["indexed_chunks"] = int(store.content_index.ntotal)
+    record["index_bytes"] = sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir))
+    del store
+
+    # 重建耗时：不使用向量缓存、首次构建写入缓存、缓存全部命中，分别记录总耗时和向量化阶段的耗时
+    if args.rebuild:
+        from synthetic_corpus import SlowEncoder
+        rebuild_encoder = SlowEncoder(encoder, args.rebuild_encode_ms) if args.encoder == "stub" else encoder
+        rebuild_documents = documents[:args.rebuild_chunks]
+        cache_dir = os.path.join(tempfile.mkdtemp(prefix="bench_cache_"), "embedding_cache")
+        rebuild = {"chunks": len(rebuild_documents),
+                   "encode_ms_per_chunk": args.rebuild_encode_ms if args.encoder == "stub" else None}
+        for label, directory in (("no_cache", None), ("cache_cold", cache_dir), ("cache_warm", cache_dir)):
+            store = EnhancedVectorStore(model_name=model_name, dedup=args.dedup, cache_dir=directory,
+                                        encoder=rebuild_encoder)
+            start = time.perf_counter()
+            store.create_indices()
+            store.process_data(documents=rebuild_documents)
+            rebuild[f"{label}_seconds"] = round(time.perf_counter() - start, 3)
+            rebuild[f"{label}_encode_seconds"] = round(store.encode_seconds, 3)
+            del store
+        rebuild["warm_speedup"] = round(rebuild["no_cache_seconds"] / rebuild["cache_warm_seconds"], 2)
+        rebuild["warm_encode_speedup"] = round(rebuild["no_cache_encode_seconds"] /
+                                               max(rebuild["cache_warm_encode_seconds"], 1e-6), 2)
+        record["rebuild"] = rebuild
+
+    # 加载问答系统
+    collection = InMemoryCollection(documents)
+    queries = make_queries(documents, args.queries, seed=args.seed + 1)
+    rss_before = current_rss()
+    with FakeLLMServer(latency=args.llm_latency, jitter=args.llm_jitter) as fake:
+        start = time.perf_counter()
+        # 测量完整链路，不使用答案缓存
+        qa = StrictQASystem(api_key="bench", index_prefix=prefix, encoder=encoder, collection=collection,
+                            api_url=fake.url, debug_sample_rate=0.0, answer_cache_size=0)
+        record["load_seconds"] = round(time.perf_counter() - start, 3)
+        record["serving_rss_delta_bytes"] = current_rss() - rss_before
+
+        # 单线程检索延迟与召回率
+        latencies, hits = [], 0
+        start = time.perf_counter()
+        for query, source_id in queries:
+            t0 = time.perf_counter()
+            results = qa._strict_search(query)
+            latencies.append(time.perf_counter() - t0)
+            hits += any(source_id in res.get("ids", [res["id"]]) for res in results)
+        elapsed = time.perf_counter() - start
+        record["retrieval"] = dict(percentiles(latencies), qps=round(len(queries) / elapsed, 2),
+                                   recall_at_3=round(hits / max(len(queries), 1), 4))
+
+        # 并发端到端问答（检索 + 假大模型调用）
+        e2e_queries = [query for query, _ in queries[:args.e2e_queries]]
+
+        def answer(query):
+            t0 = time.perf_counter()
+            qa.generate_answer(query)
+            return time.perf_counter() - t0
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            e2e_latencies = list(pool.map(answer, e2e_queries))
+        elapsed = time.perf_counter() - start
+        record["end_to_end"] = dict(percentiles(e2e_latencies), qps=round(len(e2e_queries) / elapsed, 2),
+                                    concurrency=args.concurrency, upstream_calls=fake.requests,
+                                    llm_latency=args.llm_latency)
+
+    record["rss_bytes"] = current_rss()
+    record["peak_rss_bytes"] = peak_rss()
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线检索基准测试：合成语料 + 桩编码器 + 假大模型服务")
+    parser.add_argument("--sizes", default="10000", help="逗号分隔的语料规模（片段数），例如 10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=500, help="检索延迟测试的查询数")
+    parser.add_argument("--e2e-queries", type=int, default=100, help="端到端问答测试的查询数")
+    parser.add_argument("--concurrency", type=int, default=8, help="端到端问答测试的并发数")
+    parser.add_argument("--encoder", default="stub", help="stub 或 SentenceTransformer模型名称")
+    parser.add_argument("--dim", type=int, default=768, help="桩编码器的向量维度")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false", help="构建时不做近似重复检测")
+    parser.add_argument("--no-rebuild", dest="rebuild", action="store_false", help="不测量有无向量缓存时的重建耗时")
+    parser.add_argument("--rebuild-chunks", type=int, default=5000, help="重建测试使用的片段数（语料的前N个）")
+    parser.add_argument("--rebuild-encode-ms", type=float, default=4.0,
+                        help="使用桩编码器时，重建测试中每个片段模拟的向量化耗时（毫秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假大模型服务的延迟（秒）")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="假大模型服务的随机抖动（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.jsonl", help="结果追加写入的JSON行文件")
+    args = parser.parse_args()
+
+    revision = git_revision()
+    context = multiprocessing.get_context("spawn")
+    for size in (int(s) for s in args.sizes.split(",")):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            record = pool.submit(run_size, size, args).result()
+        record.update({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": revision})
+        line = json.dumps(record, ensure_ascii=False)
+        print(line)
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# 上游调度器验证脚本
+# 在本地启动一个按滑动窗口执行RPM/TPM限额的假大模型服务（QuotaLLMServer），
+# 让批量任务线程持续提问，同时以固定速率到达交互式问题，对比启用和不启用上游调度器时：
+#   - 上游收到的请求中有多少被429拒绝
+#   - 交互式问题的端到端延迟、因排队超时被放弃的数量
+#   - 批量问题完成的数量
+#   - 各优先级的排队等待时间（来自调度器指标）
+# 用法：python bench_upstream_scheduler.py --quota-rpm 120 --duration 30
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from bench_suite import percentiles
+from fake_llm_server import QuotaLLMServer
+from qa_system_pro import StrictQASystem
+from synthetic_corpus import InMemoryCollection, StubEncoder, generate_documents, make_queries
+from upstream_scheduler import QUEUE_WAIT_SECONDS, UpstreamScheduler
+from vectorstore_enhanced import EnhancedVectorStore
+
+BUSY_ANSWER = "当前请求较多，请稍后再试"
+
+
+def build_index(documents, encoder) -> str:
+    prefix = os.path.join(tempfile.mkdtemp(prefix="bench_scheduler_"), "bench")
+    store = EnhancedVectorStore(model_name="stub-hash", cache_dir=None, encoder=encoder)
+    store.create_indices()
+    store.process_data(documents=documents)
+    store.save_indices(prefix)
+    return prefix
+
+
+def run_scenario(args, prefix, documents, encoder, queries, use_scheduler: bool) -> dict:
+    with QuotaLLMServer(rpm=args.quota_rpm, tpm=args.quota_tpm, latency=args.llm_latency) as upstream:
+        scheduler = None
+        if use_scheduler:
+            # 令牌桶在一分钟内最多放行 容量 + 速率，为限额留出余量
+            scheduler = UpstreamScheduler(rpm=args.quota_rpm * args.headroom,
+                                          tpm=args.quota_tpm * args.headroom if args.quota_tpm else None)
+        qa = StrictQASystem(api_key="bench", index_prefix=prefix, encoder=encoder,
+                            collection=InMemoryCollection(documents), api_url=upstream.url,
+                            debug_sample_rate=0.0, upstream_scheduler=scheduler,
+                            upstream_queue_timeout=args.queue_timeout)
+        stop = threading.Event()
+        lock = threading.Lock()
+        stats = {"batch_done": 0, "batch_failed": 0, "interactive": [], "interactive_busy": 0,
+                 "interactive_failed": 0}
+        waits_before = {p: (QUEUE_WAIT_SECONDS.labels(p).count, QUEUE_WAIT_SECONDS.labels(p).sum)
+                        for p in ("interactive", "batch")}
+
+        def batch_worker(offset: int):
+            i = offset
+            while not stop.is_set():
+                answer = qa.generate_answer(f"{queries[i % len(queries)][0]} #{i}", priority="batch")
+                with lock:
+                    stats["batch_done" if answer == upstream.answer else "batch_failed"] += 1
+                i += args.batch_threads
+
+        def interactive(i: int):
+            start = time.perf_counter()
+            answer = qa.generate_answer(f"{queries[i % len(queries)][0]} ?{i}")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if answer == upstream.answer:
+                    stats["interactive"].append(elapsed)
+                elif answer == BUSY_ANSWER:
+                    stats["interactive_busy"] += 1
+                else:
+                    stats["interactive_failed"] += 1
+
+        threads = [threading.Thread(target=batch_worker, args=(i,), daemon=True) for i in range(args.batch_threads)]
+        for thread in threads:
+            thread.start()
+        interactive_threads = []
+        start = time.monotonic()
+        i = 0
+        while time.monotonic() - start < args.duration:
+            thread = threading.Thread(target=interactive, args=(i,), daemon=True)
+            thread.start()
+            interactive_threads.append(thread)
+            i += 1
+            time.sleep(1.0 / args.interactive_rate)
+        stop.set()
+        for thread in interactive_threads + threads:
+            thread.join(timeout=args.queue_timeout + 35)
+
+        result = {
+            "scheduler": use_scheduler,
+            "upstream_accepted": upstream.accepted,
+            "upstream_429": upstream.rejected,
+            "batch_done": stats["batch_done"],
+            "batch_failed": stats["batch_failed"],
+            "interactive_ok": len(stats["interactive"]),
+            "interactive_busy": stats["interactive_busy"],
+            "interactive_failed": stats["interactive_failed"],
+            "interactive_latency": percentiles(stats["interactive"]),
+        }
+        for priority, (count, total) in waits_before.items():
+            histogram = QUEUE_WAIT_SECONDS.labels(priority)
+            n = histogram.count - count
+            result[f"{priority}_mean_queue_wait_ms"] = round((histogram.sum - total) / n * 1000, 1) if n else None
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在限额的假大模型服务上验证上游调度器")
+    parser.add_argument("--quota-rpm", type=int, default=120, help="假服务每分钟接受的请求数")
+    parser.add_argument("--quota-tpm", type=int, default=None, help="假服务每分钟接受的token数")
+    parser.add_argument("--headroom", type=float, default=0.9, help="调度器配置为限额的多少倍")
+    parser.add_argument("--duration", type=float, default=30.0, help="每个场景的运行时间（秒）")
+    parser.add_argument("--batch-threads", type=int, default=8, help="批量任务并发线程数")
+    parser.add_argument("--interactive-rate", type=float, default=0.5, help="交互式问题每秒到达数")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="交互式请求等待上游配额的最长时间（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--chunks", type=int, default=2000, help="合成语料的片段数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    encoder = StubEncoder()
+    documents = generate_documents(args.chunks, seed=0)
+    queries = make_queries(documents, 500, seed=1)
+    prefix = build_index(documents, encoder)
+
+    for use_scheduler in (False, True):
+        result = run_scenario(args, prefix, documents, encoder, queries, use_scheduler)
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
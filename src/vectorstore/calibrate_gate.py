@@ -0,0 +1,53 @@
+# 检索置信度门控校准工具
+# 读取标注过的问题文件（每行 {"question": ..., "answerable": true/false}），对所有问题批量检索，
+# 提取置信度特征（见confidence_gate.py），在保证可回答问题通过率不低于目标值的前提下拟合阈值，
+# 保存为 {prefix}_gate.json，StrictQASystem启动时自动加载。
+# 不可回答的问题应取自知识库范围以外的真实提问（例如与通信/计算机无关的问题），可回答的问题取自FAQ或人工标注。
+# 用法：python calibrate_gate.py --input labeled.jsonl --index-prefix enhanced --target-recall 0.98
+
+import argparse
+import json
+import logging
+
+from batch_qa import load_questions
+from confidence_gate import calibrate, gate_features
+from qa_system_pro import StrictQASystem
+
+
+def collect_features(qa: StrictQASystem, items, batch_size: int = 64):
+    """批量检索标注问题，返回 (可回答问题的特征, 不可回答问题的特征)"""
+    answerable, unanswerable = [], []
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        for item, results in zip(batch, qa.batch_search([item["question"] for item in batch])):
+            (answerable if item.get("answerable", True) else unanswerable).append(gate_features(results))
+    return answerable, unanswerable
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在标注问题集上拟合检索置信度门控的阈值")
+    parser.add_argument("--input", required=True, help="标注问题文件，每行 {\"question\": ..., \"answerable\": true/false}")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--index-prefix", default="enhanced")
+    parser.add_argument("--model-name", default="shibing624/text2vec-base-chinese")
+    parser.add_argument("--target-recall", type=float, default=0.98, help="可回答问题的最低通过率")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", help="阈值文件路径，默认为 {index_prefix}_gate.json")
+    parser.add_argument("--dry-run", action="store_true", help="只输出拟合结果，不写文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    qa = StrictQASystem(api_key="", mongo_uri=args.mongo_uri, index_prefix=args.index_prefix,
+                        model_name=args.model_name, debug_sample_rate=0.0, confidence_gate=False)
+    answerable, unanswerable = collect_features(qa, load_questions(args.input), args.batch_size)
+    config = calibrate(answerable, unanswerable, target_recall=args.target_recall)
+    print(json.dumps(config, ensure_ascii=False, indent=2))
+    if not args.dry_run:
+        output = args.output or f"{args.index_prefix}_gate.json"
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+        print(f"阈值已保存到 {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# 检索置信度门控
+# 只要Faiss返回了结果（无论相似度多低），问题都会被发送给大模型，再由prompt要求模型回答“暂无相关信息”，
+# 对知识库范围外的问题来说这是一次完整但没有意义的上游调用（最长30秒）。本模块根据检索得分判断问题是否可回答：
+# 1. 从检索结果中提取置信度特征：最高相似度（top）和前3个结果的平均相似度（mean）。
+# 2. 阈值由calibrate_gate.py在标注过的问题集（可回答/不可回答）上拟合，保存为 {prefix}_gate.json：
+#    在保证可回答问题的通过率不低于目标值的前提下，拒绝尽可能多的不可回答问题。
+# 3. 任一特征低于阈值的问题直接在本地返回标准的“无法回答”答复，不调用大模型。
+# 门控决策通过指标 qa_confidence_gate_total{decision} 和结构化请求日志的 gate 字段记录，便于统计节省的上游调用。
+
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import metrics
+
+GATE_DECISIONS = metrics.REGISTRY.counter("qa_confidence_gate_total",
+                                          "Retrieval confidence gate decisions (rejected questions skip the LLM)",
+                                          ("decision",))
+
+
+def gate_features(results: List[Dict], top_n: int = 3) -> Dict[str, float]:
+    """
+    从检索结果中提取置信度特征。
+
+    :param results: 检索结果，每项包含 "score"
+    :return: {"top": 最高相似度, "mean": 前top_n个结果的平均相似度}，没有结果时均为0
+    """
+    scores = sorted((float(res["score"]) for res in results), reverse=True)[:top_n]
+    if not scores:
+        return {"top": 0.0, "mean": 0.0}
+    return {"top": scores[0], "mean": float(np.mean(scores))}
+
+
+class ConfidenceGate:
+    def __init__(self, min_top_score: float, min_mean_score: Optional[float] = None):
+        """
+        :param min_top_score: 最高相似度的阈值，低于该值的问题被拒绝
+        :param min_mean_score: 前3个结果平均相似度的阈值，None表示不使用
+        """
+        self.min_top_score = min_top_score
+        self.min_mean_score = min_mean_score
+
+    def accept(self, features: Dict[str, float]) -> bool:
+        """判断问题是否足够可信、需要调用大模型"""
+        if features["top"] < self.min_top_score:
+            return False
+        return self.min_mean_score is None or features["mean"] >= self.min_mean_score
+
+    @classmethod
+    def load(cls, path: str) -> Optional["ConfidenceGate"]:
+        """从calibrate_gate.py生成的JSON文件加载阈值，文件不存在时返回None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config["min_top_score"], config.get("min_mean_score"))
+
+
+def _passes(features: np.ndarray, top: float, mean: float) -> np.ndarray:
+    return (features[:, 0] >= top) & (features[:, 1] >= mean)
+
+
+def calibrate(answerable: Sequence[Dict[str, float]], unanswerable: Sequence[Dict[str, float]],
+              target_recall: float = 0.98, grid: int = 50) -> Dict:
+    """
+    在标注问题的特征上拟合门控阈值。
+
+    候选阈值取可回答问题特征的低分位数（两个特征各grid个），在可回答问题通过率不低于target_recall的组合中，
+    选择拒绝不可回答问题最多的一组；拒绝数相同时选择通过率更高的一组。
+
+    :param answerable: 可回答问题的特征
+    :param unanswerable: 不可回答（知识库范围外）问题的特征
+    :param target_recall: 可回答问题的最低通过率
+    :return: 阈值和在标注集上的统计，可直接保存为 {prefix}_gate.json
+    """
+    if not answerable:
+        raise ValueError("标注集中没有可回答的问题，无法拟合阈值")
+    pos = np.array([[f["top"], f["mean"]] for f in answerable], dtype=np.float64)
+    neg = np.array([[f["top"], f["mean"]] for f in unanswerable], dtype=np.float64).reshape(-1, 2)
+
+    # 只有阈值不高于可回答问题特征的 (1 - target_recall) 分位数时通过率才可能达标
+    quantiles = np.linspace(0.0, 1.0 - target_recall, grid)
+    top_candidates = np.unique(np.quantile(pos[:, 0], quantiles, method="lower"))
+    mean_candidates = np.unique(np.concatenate([[-np.inf], np.quantile(pos[:, 1], quantiles, method="lower")]))
+
+    best = None
+    for top in top_candidates:
+        for mean in mean_candidates:
+            recall = float(_passes(pos, top, mean).mean())
+            if recall < target_recall:
+                continue
+            rejected = float(1.0 - _passes(neg, top, mean).mean()) if len(neg) else 0.0
+            if best is None or (rejected, recall) > (best[0], best[1]):
+                best = (rejected, recall, float(top), float(mean))
+    rejected, recall, top, mean = best
+    return {
+        "min_top_score": top,
+        "min_mean_score": mean if np.isfinite(mean) else None,
+        "target_recall": target_recall,
+        "answerable_pass_rate": round(recall, 4),
+        "unanswerable_reject_rate": round(rejected, 4),
+        "answerable": int(len(pos)),
+        "unanswerable": int(len(neg)),
+        "calibrated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
@@ -0,0 +1,154 @@
+# 上下文打包模块
+# 检索返回的片段来自爬虫的500字滑动窗口：相邻片段重叠50字，并且每个片段开头都重复了文章标题。
+# 直接截断拼接会把重复内容和标题一并送入大模型，浪费token并增加上游延迟与费用。
+# 本模块在构建prompt前对检索结果进行打包：
+# 1. 按文章标题分组，合并同一文章中相互重叠或相邻的片段，标题只保留一次。
+# 2. 丢弃被其他片段完全包含的冗余片段。
+# 3. 按得分从高到低贪心地填充可配置的token预算，超出预算的片段在句子边界处截断。
+
+import math
+import re
+from typing import Callable, Dict, List, Optional
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_SENTENCE_END = "。！？；.!?;\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量：中日韩字符及全角标点按每字1个token计算，其余字符按每4个字符1个token计算。
+    这一估算对中文语料略偏保守，适合作为预算上限使用。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk - text.count(" ") - text.count("\n")
+    return cjk + math.ceil(max(other, 0) / 4)
+
+
+def split_title(content: str):
+    """将爬虫存储的 "标题\\n正文" 格式拆分为 (标题, 正文)"""
+    if "\n" in content:
+        title, body = content.split("\n", 1)
+        return title.strip(), body
+    return "", content
+
+
+def _overlap(left: str, right: str, min_overlap: int, max_overlap: int) -> int:
+    """返回left的后缀与right的前缀最长重合的长度，不足min_overlap时返回0"""
+    upper = min(len(left), len(right), max_overlap)
+    for length in range(upper, min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+class ContextPacker:
+    def __init__(self,
+                 max_tokens: int = 1500,
+                 token_counter: Optional[Callable[[str], int]] = None,
+                 min_overlap: int = 20,
+                 max_overlap: int = 200,
+                 min_fragment_tokens: int = 50):
+        """
+        :param max_tokens: 上下文的token预算
+        :param token_counter: token计数函数，默认使用estimate_tokens估算
+        :param min_overlap: 判定两个片段首尾相接所需的最小重合字符数
+        :param max_overlap: 检查首尾重合时的最大字符数（爬虫切片重叠为50字）
+        :param min_fragment_tokens: 预算剩余不足该值时不再截断填充片段
+        """
+        self.max_tokens = max_tokens
+        self.count_tokens = token_counter or estimate_tokens
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.min_fragment_tokens = min_fragment_tokens
+
+    def _merge_group(self, passages: List[Dict]) -> List[Dict]:
+        """合并同一文章内重叠或包含关系的片段，直到无法继续合并"""
+        merged = True
+        while merged and len(passages) > 1:
+            merged = False
+            for i in range(len(passages)):
+                for j in range(len(passages)):
+                    if i == j:
+                        continue
+                    a, b = passages[i], passages[j]
+                    if b["body"] in a["body"]:
+                        combined = a["body"]
+                    else:
+                        length = _overlap(a["body"], b["body"], self.min_overlap, self.max_overlap)
+                        if not length:
+                            continue
+                        combined = a["body"] + b["body"][length:]
+                    passages[i] = {
+                        "title": a["title"],
+                        "body": combined,
+                        "score": max(a["score"], b["score"]),
+                        "ids": a["ids"] + b["ids"],
+                    }
+                    del passages[j]
+                    merged = True
+                    break
+                if merged:
+                    break
+        return passages
+
+    def _truncate(self, text: str, budget: int) -> str:
+        """将文本截断到token预算以内，尽量在句子边界处截断"""
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count_tokens(text[:mid]) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        cut = text[:low]
+        boundary = max(cut.rfind(ch) for ch in _SENTENCE_END)
+        if boundary > len(cut) // 2:
+            cut = cut[:boundary + 1]
+        return cut
+
+    def pack(self, results: List[Dict]) -> List[Dict]:
+        """
+        将检索结果打包为满足token预算的上下文段落。
+
+        :param results: 检索结果列表，每项包含 "content" 和 "score"，可选 "id"（或拼接段落的 "ids"）
+        :return: 按得分从高到低排列的段落列表，每项包含 title、body、score、ids、tokens
+        """
+        groups: Dict[str, List[Dict]] = {}
+        for res in results:
+            title, body = split_title(res["content"])
+            groups.setdefault(title, []).append({
+                "title": title,
+                "body": body.strip(),
+                "score": float(res.get("score", 0.0)),
+                "ids": list(res["ids"]) if res.get("ids") else ([res["id"]] if res.get("id") is not None else []),
+            })
+
+        passages = []
+        for group in groups.values():
+            passages.extend(self._merge_group(group))
+        passages.sort(key=lambda p: p["score"], reverse=True)
+
+        packed = []
+        remaining = self.max_tokens
+        for passage in passages:
+            header = self.count_tokens(passage["title"])
+            tokens = header + self.count_tokens(passage["body"])
+            if tokens > remaining:
+                if remaining - header < self.min_fragment_tokens:
+                    continue
+                passage["body"] = self._truncate(passage["body"], remaining - header)
+                tokens = header + self.count_tokens(passage["body"])
+            passage["tokens"] = tokens
+            packed.append(passage)
+            remaining -= tokens
+        return packed
+
+    def render(self, passages: List[Dict]) -> str:
+        """将打包后的段落渲染为prompt中的上下文文本"""
+        blocks = []
+        for i, passage in enumerate(passages):
+            title = f"{passage['title']}\n" if passage["title"] else ""
+            blocks.append(f"[文档 {i + 1}] {title}{passage['body']}")
+        return "\n".join(blocks)
@@ -0,0 +1,125 @@
+# 请求截止时间与准入控制
+# 上游变慢时，/qa 请求都阻塞在固定30秒超时的上游调用上，请求越积越多，整个服务失去响应。本模块提供：
+# 1. Deadline：请求到达时按总时间预算创建，随请求上下文传递；问答链路在进入每个阶段（向量化、检索、文档获取、
+#    大模型调用等）前检查，已超时的请求不再继续执行，上游调用的超时取剩余时间而不是固定值。
+# 2. AdmissionQueue：限制同时处理的问答请求数，超出的请求排队；根据排队人数和近期平均处理时间估算等待时间，
+#    需要排队且预计无法在截止时间前完成的请求立即拒绝（由接口返回503和Retry-After），而不是占着线程等到超时；
+#    有空闲处理位置时总是放行，处理时间的估计值因此总能由新的观测更新。
+# 过载时被拒绝的请求很快得到答复，被接受的请求的延迟受截止时间约束，尾延迟不会随积压无限增长。
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+import metrics
+from upstream_scheduler import DeadlineExceeded
+
+ADMISSION_DECISIONS = metrics.REGISTRY.counter("qa_admission_total", "Admission decisions for /qa requests",
+                                               ("decision",))
+ADMISSION_QUEUE_DEPTH = metrics.REGISTRY.gauge("qa_admission_queue_depth", "Requests waiting for a /qa slot")
+DEADLINE_EXCEEDED = metrics.REGISTRY.counter("qa_deadline_exceeded_total",
+                                             "Requests abandoned because their deadline passed", ("stage",))
+
+
+class Deadline:
+    """一个请求的截止时间（time.monotonic()时钟）"""
+
+    def __init__(self, budget: float, start: Optional[float] = None):
+        """
+        :param budget: 从start开始的总时间预算（秒）
+        :param start: 请求到达时间（time.monotonic()的值），为None时取当前时间
+        """
+        self.budget = budget
+        self.expires = (time.monotonic() if start is None else start) + budget
+
+    def remaining(self) -> float:
+        """剩余时间（秒），已超时时为负数"""
+        return self.expires - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, stage: str):
+        """进入stage阶段前检查，已超时时抛出DeadlineExceeded"""
+        if self.expired():
+            DEADLINE_EXCEEDED.labels(stage).inc()
+            raise DeadlineExceeded(f"请求在 {stage} 阶段前超过截止时间（预算 {self.budget:.1f} 秒）")
+
+    def timeout(self, cap: float) -> float:
+        """取剩余时间和cap中较小的值，作为下游调用的超时（至少1毫秒，避免下游把0当作非阻塞调用）"""
+        return max(min(cap, self.remaining()), 0.001)
+
+
+class Overloaded(Exception):
+    """预计排队等待超过请求的截止时间，请求被拒绝"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def retry_after_header(self) -> str:
+        """Retry-After响应头的值（整数秒，至少1秒）"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionQueue:
+    def __init__(self, max_concurrent: int = 16, initial_service_time: float = 1.0, smoothing: float = 0.2):
+        """
+        :param max_concurrent: 同时处理的最大请求数
+        :param initial_service_time: 还没有观测数据时假定的单个请求处理时间（秒）
+        :param smoothing: 处理时间指数移动平均的权重
+        """
+        self.max_concurrent = max_concurrent
+        self.service_time = initial_service_time
+        self.smoothing = smoothing
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    def expected_wait(self) -> float:
+        """按当前排队人数和平均处理时间估算新请求获得处理位置前的等待时间（秒，调用方持有锁）"""
+        if self._active < self.max_concurrent and self._waiting == 0:
+            return 0.0
+        return (self._waiting + 1) * self.service_time / self.max_concurrent
+
+    @contextmanager
+    def admit(self, deadline: Deadline):
+        """
+        获得一个处理位置后执行请求，结束时释放。
+
+        :param deadline: 请求的截止时间
+        :raises Overloaded: 预计等待加上处理时间超过剩余时间，或排队期间截止时间已过
+        """
+        with self._cond:
+            wait = self.expected_wait()
+            # 只拒绝需要排队的请求：有空闲处理位置时总是放行（超时由各阶段的截止时间检查处理），
+            # 否则几个慢请求把处理时间的估计值推到接近预算后，即使没有排队也会拒绝所有请求，
+            # 估计值只由被放行的请求更新，将永远无法恢复
+            if wait > 0 and wait + self.service_time > deadline.remaining():
+                ADMISSION_DECISIONS.labels("rejected").inc()
+                raise Overloaded(f"预计排队 {wait:.2f} 秒，超过请求的剩余时间", retry_after=wait)
+            self._waiting += 1
+            ADMISSION_QUEUE_DEPTH.set(self._waiting)
+            try:
+                admitted = self._cond.wait_for(lambda: self._active < self.max_concurrent,
+                                               timeout=max(deadline.remaining() - self.service_time, 0.0))
+            finally:
+                self._waiting -= 1
+                ADMISSION_QUEUE_DEPTH.set(self._waiting)
+            if not admitted:
+                ADMISSION_DECISIONS.labels("timeout").inc()
+                raise Overloaded("排队期间超过请求的截止时间", retry_after=self.expected_wait())
+            self._active += 1
+        ADMISSION_DECISIONS.labels("admitted").inc()
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._active -= 1
+                self.service_time += self.smoothing * (elapsed - self.service_time)
+                self._cond.notify()
@@ -0,0 +1,201 @@
+# 近似重复文本检测模块
+# 爬虫按500字切片、相邻片段重叠50字，并且每个片段都拼接了文章标题，再加上重复抓取，
+# 知识库中存在大量几乎相同的片段。它们浪费索引空间和向量化时间，也会挤占问答时有限的前3个上下文位置。
+# 本模块基于SimHash指纹和分段LSH（banded LSH）实现近似重复检测：
+# 1. 使用numpy对字符n-gram进行向量化哈希，批量计算64位SimHash指纹。
+# 2. 将指纹切分为若干段，同一段完全相同的片段进入同一个桶，作为候选对。
+# 3. 对候选对计算汉明距离，距离不超过阈值的视为近似重复，并用并查集合并为重复组。
+# 该模块既用于建索引前的语料去重（EnhancedVectorStore），也用于查询时折叠近似重复的检索结果（StrictQASystem）。
+
+import unicodedata
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# splitmix64 混合常量，用于把n-gram的滚动哈希打散为均匀的64位哈希
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def normalize_text(text: str, strip_title: bool = True) -> str:
+    """
+    规范化文本，用于指纹计算。
+
+    :param text: 原始文本
+    :param strip_title: 是否去掉第一行的文章标题（爬虫会把标题拼接到每个片段前面，保留它会让同一文章的所有片段显得更相似）
+    :return: 规范化后的文本（NFKC、小写、去除所有空白）
+    """
+    if not text:
+        return ""
+    if strip_title and "\n" in text:
+        text = text.split("\n", 1)[1]
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(text.split())
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    """对uint64数组执行splitmix64混合（溢出按模2^64回绕）"""
+    with np.errstate(over="ignore"):
+        z = values + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * _MIX_1
+        z = (z ^ (z >> np.uint64(27))) * _MIX_2
+        return z ^ (z >> np.uint64(31))
+
+
+def _shingle_hashes(text: str, ngram: int) -> np.ndarray:
+    """计算文本中所有字符n-gram的64位哈希（向量化实现）"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if codes.size == 0:
+        return codes
+    if codes.size < ngram:
+        ngram = codes.size
+    count = codes.size - ngram + 1
+    with np.errstate(over="ignore"):
+        hashes = np.zeros(count, dtype=np.uint64)
+        for offset in range(ngram):
+            hashes = _splitmix64(hashes ^ codes[offset:offset + count])
+    return hashes
+
+
+def simhash(text: str, ngram: int = 3, strip_title: bool = True) -> int:
+    """计算单个文本的64位SimHash指纹"""
+    return int(simhash_signatures([text], ngram=ngram, strip_title=strip_title)[0])
+
+
+def simhash_signatures(texts: Sequence[str], ngram: int = 3, strip_title: bool = True) -> np.ndarray:
+    """
+    批量计算文本的64位SimHash指纹。
+
+    :param texts: 文本列表
+    :param ngram: 字符n-gram长度，中文文本默认3
+    :param strip_title: 是否在计算前去掉标题行
+    :return: 形状为 (len(texts),) 的uint64数组
+    """
+    signatures = np.zeros(len(texts), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        hashes = _shingle_hashes(normalize_text(text, strip_title), ngram)
+        if hashes.size == 0:
+            continue
+        # 每一位统计为1的n-gram数量，超过半数则该位为1
+        bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+        ones = bits.sum(axis=0)
+        mask = (ones * 2 > hashes.size).astype(np.uint64)
+        signatures[i] = np.bitwise_or.reduce(mask << _BIT_SHIFTS)
+    return signatures
+
+
+def hamming_distance(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """计算两组uint64指纹之间逐元素的汉明距离"""
+    x = np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64))
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class NearDuplicateDetector:
+    """
+    基于SimHash + 分段LSH的近似重复检测器。
+
+    当两个指纹的汉明距离不超过 max_distance 且分段数 bands > max_distance 时，
+    根据抽屉原理，二者至少有一段完全相同，因此分段分桶不会漏掉任何近似重复对。
+    """
+
+    def __init__(self, max_distance: int = 3, bands: int = 4, ngram: int = 3, strip_title: bool = True):
+        """
+        :param max_distance: 判定为近似重复的最大汉明距离
+        :param bands: 指纹切分的段数，必须整除64且大于max_distance
+        :param ngram: 字符n-gram长度
+        :param strip_title: 计算指纹前是否去掉标题行
+        """
+        if 64 % bands != 0:
+            raise ValueError(f"分段数必须整除64: {bands}")
+        if bands <= max_distance:
+            raise ValueError(f"分段数({bands})必须大于最大汉明距离({max_distance})，否则会漏检")
+        self.max_distance = max_distance
+        self.bands = bands
+        self.ngram = ngram
+        self.strip_title = strip_title
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        """批量计算文本指纹"""
+        return simhash_signatures(texts, ngram=self.ngram, strip_title=self.strip_title)
+
+    def _candidate_pairs(self, signatures: np.ndarray) -> np.ndarray:
+        """按段分桶，返回同桶的候选对 (i, j)，i < j"""
+        width = 64 // self.bands
+        band_mask = np.uint64((1 << width) - 1)
+        pairs = []
+        for band in range(self.bands):
+            keys = (signatures >> np.uint64(band * width)) & band_mask
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            # 排序后同桶元素相邻：依次比较相距offset的元素，直到没有任何同桶元素为止
+            offset = 1
+            while offset < len(sorted_keys):
+                same = np.flatnonzero(sorted_keys[offset:] == sorted_keys[:-offset])
+                if same.size == 0:
+                    break
+                pairs.append(np.stack((order[same], order[same + offset]), axis=1))
+                offset += 1
+        if not pairs:
+            return np.empty((0, 2), dtype=np.int64)
+        pairs = np.concatenate(pairs)
+        pairs.sort(axis=1)
+        # 多个段可能命中同一对，编码为单个整数后去重比按行去重快得多
+        n = np.int64(len(signatures))
+        keys = np.unique(pairs[:, 0].astype(np.int64) * n + pairs[:, 1])
+        return np.stack((keys // n, keys % n), axis=1)
+
+    def find_duplicates(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        找出近似重复组。
+
+        :param signatures: uint64指纹数组
+        :return: 与输入等长的数组，每个元素为其所属重复组的代表下标（组内最小下标），非重复元素指向自身
+        """
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        parent = np.arange(len(signatures))
+        if len(signatures) < 2:
+            return parent
+
+        pairs = self._candidate_pairs(signatures)
+        if len(pairs):
+            distances = hamming_distance(signatures[pairs[:, 0]], signatures[pairs[:, 1]])
+            pairs = pairs[distances <= self.max_distance]
+
+        def find(x: int) -> int:
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        # 并查集合并，始终以较小的下标作为代表
+        for i, j in pairs:
+            root_i, root_j = find(int(i)), find(int(j))
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        # 路径压缩：反复跳转直到每个元素都直接指向代表
+        while True:
+            compressed = parent[parent]
+            if np.array_equal(compressed, parent):
+                return parent
+            parent = compressed
+
+    def keep_mask(self, signatures: np.ndarray) -> np.ndarray:
+        """返回布尔掩码，True表示该元素是其重复组的代表，应当保留"""
+        representatives = self.find_duplicates(signatures)
+        return representatives == np.arange(len(representatives))
+
+    def collapse(self, items: List[Dict], signatures: Sequence[int]) -> List[Dict]:
+        """
+        折叠已按得分排序的检索结果中的近似重复项，每组只保留排名最靠前的一个。
+
+        :param items: 按相关性从高到低排序的结果列表
+        :param signatures: 与items一一对应的指纹
+        :return: 去重后的结果列表，保持原有顺序
+        """
+        if len(items) < 2:
+            return list(items)
+        keep = self.keep_mask(np.asarray(signatures, dtype=np.uint64))
+        return [item for item, kept in zip(items, keep) if kept]
@@ -0,0 +1,147 @@
+# 持久化向量缓存模块
+# 每次重建索引时，EnhancedVectorStore都会重新对全部片段进行向量化，即使绝大多数文本自上次构建以来并未改变。
+# 本模块提供一个以（模型名称，规范化文本哈希）为键的持久化向量缓存：
+# 1. 向量以float16格式追加写入磁盘文件，并通过内存映射（np.memmap）读取，不占用额外的常驻内存。
+# 2. 键（SHA-1摘要）按行追加写入单独的键文件，打开缓存时加载为 摘要->行号 的哈希索引。
+# 3. 缓存键包含模型名称，文件名包含模型名称和向量维度，更换模型后旧条目自动失效。
+# 4. 重建索引时只对缓存未命中的文本进行向量化。
+# 5. 直接传入的向量化模型（encoder）不一定有可靠的名称，缓存标识取 模型名称@探针向量指纹，
+#    不同的模型即使使用相同的model_name也不会共用缓存条目。
+
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+_DIGEST_SIZE = 20  # SHA-1摘要长度（字节）
+
+# 计算向量化模型指纹时使用的探针文本
+_PROBE_TEXTS = ["向量缓存探针", "Embedding cache probe 0123456789", "问答系统检索与生成"]
+
+
+def normalize_for_cache(text: str) -> str:
+    """规范化文本（NFKC、合并空白），使仅有空白差异的文本命中同一个缓存条目"""
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split())
+
+
+def encoder_fingerprint(encoder) -> str:
+    """
+    根据向量化模型对固定探针文本的输出计算指纹，输出不同的模型得到不同的指纹。
+    向量先转为float16再取摘要，忽略微小的浮点误差。
+    """
+    vectors = np.asarray(encoder.encode(_PROBE_TEXTS), dtype=np.float16)
+    digest = hashlib.sha1(type(encoder).__name__.encode("utf-8") + vectors.tobytes()).hexdigest()
+    return digest[:12]
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str, dim: int):
+        """
+        打开（或创建）指定模型的向量缓存。
+
+        :param cache_dir: 缓存文件所在目录
+        :param model_name: 向量化模型名称，作为缓存键的一部分
+        :param dim: 向量维度
+        """
+        self.model_name = model_name
+        self.dim = dim
+        self.logger = logging.getLogger(__name__)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        safe_name = re.sub(r"[^0-9A-Za-z_.-]", "_", model_name)
+        base = os.path.join(cache_dir, f"{safe_name}_{dim}")
+        self.vectors_path = f"{base}.f16"
+        self.keys_path = f"{base}.keys"
+
+        self._row_bytes = dim * np.dtype(np.float16).itemsize
+        self._index = {}  # 摘要 -> 行号
+        self._vectors = None  # 向量文件的内存映射
+        self._load()
+
+    def _load(self):
+        """加载键文件构建哈希索引，并对意外中断造成的不完整尾部进行截断"""
+        keys = b""
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, "rb") as f:
+                keys = f.read()
+        vector_rows = os.path.getsize(self.vectors_path) // self._row_bytes if os.path.exists(self.vectors_path) else 0
+        rows = min(len(keys) // _DIGEST_SIZE, vector_rows)
+
+        # 两个文件追加写入时可能只写了一半，以行数较少的为准
+        if len(keys) != rows * _DIGEST_SIZE:
+            with open(self.keys_path, "r+b") as f:
+                f.truncate(rows * _DIGEST_SIZE)
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != rows * self._row_bytes:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(rows * self._row_bytes)
+
+        self._index = {keys[i * _DIGEST_SIZE:(i + 1) * _DIGEST_SIZE]: i for i in range(rows)}
+        self._remap()
+
+    def _remap(self):
+        """重新建立向量文件的内存映射（追加写入后调用）"""
+        rows = len(self._index)
+        self._vectors = None
+        if rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(rows, self.dim))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _key(self, text: str) -> bytes:
+        """计算缓存键：模型名称与规范化文本的SHA-1摘要"""
+        payload = f"{self.model_name}\x00{normalize_for_cache(text)}".encode("utf-8")
+        return hashlib.sha1(payload).digest()
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        """
+        批量查询缓存。
+
+        :param texts: 待查询的文本列表
+        :return: (vectors, misses)，vectors为 (len(texts), dim) 的float32数组，命中的行已填充；
+                 misses为未命中文本的下标列表
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        hit_positions, hit_rows, misses = [], [], []
+        for i, text in enumerate(texts):
+            row = self._index.get(self._key(text))
+            if row is None:
+                misses.append(i)
+            else:
+                hit_positions.append(i)
+                hit_rows.append(row)
+        if hit_rows:
+            vectors[hit_positions] = self._vectors[hit_rows]
+        return vectors, misses
+
+    def add(self, texts: Sequence[str], vectors: np.ndarray):
+        """
+        将新的向量追加写入缓存，已存在的键会被跳过。
+
+        :param texts: 文本列表
+        :param vectors: 与texts一一对应的向量
+        """
+        vectors = np.asarray(vectors, dtype=np.float16).reshape(-1, self.dim)
+        new_keys, new_rows = [], []
+        for text, vector in zip(texts, vectors):
+            key = self._key(text)
+            if key in self._index:
+                continue
+            self._index[key] = len(self._index)
+            new_keys.append(key)
+            new_rows.append(vector)
+        if not new_keys:
+            return
+
+        # 先写向量再写键，中断时键文件不会指向不存在的向量
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(new_rows, dtype=np.float16).tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(new_keys))
+        self._remap()
+        self.logger.info(f"向量缓存新增 {len(new_keys)} 条，共 {len(self._index)} 条")
@@ -0,0 +1,163 @@
+# 进程内的假大模型接口服务
+# 模拟上游 chat/completions 接口（与xf-yun/DeepSeek的OpenAI兼容格式一致），用于离线基准测试和负载测试：
+# 1. 可配置的固定延迟和随机抖动，模拟上游推理耗时。
+# 2. 统计收到的请求数量和prompt字符数，便于验证请求合并等优化是否生效。
+# 3. 在后台线程中运行ThreadingHTTPServer，可在测试脚本中直接启动和停止，也可以作为独立进程运行。
+# 4. 可限制同时处理的请求数，超出的请求在服务端排队，模拟处理能力饱和、越来越慢的上游。
+# 5. QuotaLLMServer按滑动窗口执行每分钟请求数/token数限额，超出时返回429和Retry-After，用于验证上游调度器。
+
+import argparse
+import contextlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from context_packer import estimate_tokens
+
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.0,
+                 answer: str = "这是来自假大模型服务的回答。", max_concurrency: int = None):
+        """
+        :param host: 监听地址
+        :param port: 监听端口，0表示自动分配
+        :param latency: 每个请求的基础延迟（秒）
+        :param jitter: 在基础延迟上叠加的均匀随机抖动上限（秒）
+        :param answer: 返回的固定回答内容
+        :param max_concurrency: 同时处理的最大请求数，超出的请求排队等待，None表示不限制
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.answer = answer
+        self.requests = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_concurrency) if max_concurrency else None
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def _record(self, payload: dict):
+        prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+        with self._lock:
+            self.requests += 1
+            self.prompt_chars += len(prompt)
+
+    def handle(self, payload: dict):
+        """
+        处理一次请求，返回 (状态码, 响应体字典, 额外响应头)。
+        子类可以重写该方法以模拟限流、错误等上游行为。
+        """
+        self._record(payload)
+        with self._slots if self._slots is not None else contextlib.nullcontext():
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        return 200, {
+            "id": f"fake-{self.requests}",
+            "object": "chat.completion",
+            "model": payload.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.answer},
+                         "finish_reason": "stop"}],
+        }, {}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                status, body, headers = server.handle(payload)
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in headers.items():
+                        self.send_header(name, str(value))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端已超时断开
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class QuotaLLMServer(FakeLLMServer):
+    """按滑动窗口限额的假大模型服务，超出每分钟请求数或token数时返回429"""
+
+    def __init__(self, rpm: int, tpm: int = None, window: float = 60.0, **kwargs):
+        """
+        :param rpm: 窗口内最多接受的请求数
+        :param tpm: 窗口内最多接受的token数（prompt估算token数加回答token数），None表示不限制
+        :param window: 滑动窗口长度（秒）
+        """
+        super().__init__(**kwargs)
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self.accepted = 0
+        self.rejected = 0
+        self._history = deque()  # (时间, token数)
+
+    def handle(self, payload: dict):
+        prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+        tokens = estimate_tokens(prompt) + estimate_tokens(self.answer)
+        with self._lock:
+            now = time.monotonic()
+            while self._history and self._history[0][0] <= now - self.window:
+                self._history.popleft()
+            used_tokens = sum(t for _, t in self._history)
+            if len(self._history) >= self.rpm or (self.tpm and used_tokens + tokens > self.tpm):
+                self.rejected += 1
+                retry_after = max(1, int(self._history[0][0] + self.window - now + 1)) if self._history else 1
+                return 429, {"error": {"message": "rate limit exceeded", "type": "rate_limit"}}, \
+                    {"Retry-After": retry_after}
+            self._history.append((now, tokens))
+            self.accepted += 1
+        return super().handle(payload)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动假的大模型chat/completions接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=None, help="同时处理的最大请求数")
+    args = parser.parse_args()
+
+    fake = FakeLLMServer(args.host, args.port, args.latency, args.jitter, max_concurrency=args.concurrency)
+    print(f"假大模型服务已启动: {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
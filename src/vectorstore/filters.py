@@ -0,0 +1,186 @@
+# 元数据过滤检索
+# 需要将回答限定在部分文章或某些抓取批次内，例如只使用网络相关的页面（5G/6G/Wi-Fi/蓝牙），或只使用某个日期之后抓取的内容。
+# 对检索出的前k个结果做后过滤时，过滤条件较严格的查询往往一个结果都剩不下。本模块将过滤条件编译为索引行的位图：
+# 1. 过滤条件先在文章级元数据（{prefix}_articles.json）上求值，得到文章的布尔掩码，
+#    再通过片段→文章映射数组（{prefix}_chunk_article.npy）一次查表展开为索引行的掩码。
+# 2. 行掩码打包为位图（每行1比特）并包装为faiss.IDSelectorBitmap，检索时由Faiss跳过未选中的行，
+#    因此过滤后的检索仍返回满足条件的top-k，召回率和速度不受后过滤的影响。
+# 3. 编译结果按规范化的过滤条件缓存（LRU），相同的过滤条件只计算一次位图。
+# 支持的过滤条件（各条件之间为“与”关系）：
+#   {"articles": ["5G", "https://zh.wikipedia.org/wiki/6G"],   文章标题或URL，任意一个匹配即可
+#    "sources": ["zh.wikipedia.org"],                           来源站点
+#    "crawled_after": "2025-02-01",                             抓取时间不早于该时间
+#    "crawled_before": "2025-03-01T12:00:00"}                   抓取时间早于该时间
+# 时间比较统一在UTC下进行，结果不受服务器所在时区影响：
+# - 过滤条件中的时间带时区时换算为UTC，不带时区时按UTC处理。
+# - 元数据中的crawled_at：爬虫现在写入带时区的UTC时间；此前的数据由 datetime.now() 写入，是不带时区的爬虫所在机器的
+#   本地时间，加载时按环境变量 QA_CRAWL_TZ（IANA时区名，如 Asia/Shanghai）换算，未设置时按本机时区换算。
+#   爬虫与问答服务不在同一时区时必须设置 QA_CRAWL_TZ，否则旧数据的时间过滤会相差两地的时差。
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, tzinfo
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import faiss
+import numpy as np
+
+FILTER_KEYS = ("articles", "sources", "crawled_after", "crawled_before")
+CRAWL_TZ_ENV = "QA_CRAWL_TZ"
+
+
+class FilterError(ValueError):
+    """过滤条件格式错误"""
+
+
+def to_utc_timestamp(value, naive_tz: Optional[tzinfo] = timezone.utc) -> float:
+    """
+    将ISO 8601时间转换为UTC时间戳。
+
+    :param naive_tz: 不带时区的时间所在的时区，为None时按本机时区处理
+    """
+    moment = datetime.fromisoformat(str(value))
+    if moment.tzinfo is None and naive_tz is not None:
+        moment = moment.replace(tzinfo=naive_tz)
+    return moment.timestamp()
+
+
+def crawl_timezone(name: Optional[str] = None) -> Optional[tzinfo]:
+    """
+    旧数据中不带时区的crawled_at所在的时区。
+
+    :param name: IANA时区名，为None时读取环境变量 QA_CRAWL_TZ
+    :return: 时区，都未设置时返回None（按本机时区处理）
+    """
+    name = name or os.environ.get(CRAWL_TZ_ENV)
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"无效的时区: {name}")
+
+
+def _parse_time(value, name: str) -> float:
+    try:
+        return to_utc_timestamp(value)
+    except ValueError:
+        raise FilterError(f"{name} 不是有效的ISO 8601时间: {value}")
+
+
+def selector_params(bitmap: np.ndarray):
+    """根据打包的位图构建检索参数，返回 (参数, 选择器)，调用方需在检索期间保持位图和选择器存活"""
+    # IDSelectorBitmap的第一个参数是位图的字节数，行号超出位图范围的行视为未选中
+    selector = faiss.IDSelectorBitmap(bitmap.size, faiss.swig_ptr(bitmap))
+    return faiss.SearchParameters(sel=selector), selector
+
+
+class RowFilter:
+    """编译后的过滤条件：索引行位图及对应的Faiss检索参数"""
+
+    def __init__(self, key: tuple, mask: np.ndarray):
+        self.key = key
+        self.count = int(mask.sum())
+        self.num_rows = int(mask.size)
+        self.bitmap = np.packbits(mask, bitorder="little")
+        # IDSelectorBitmap只保存指向位图的指针，位图与选择器的生命周期与本对象一致
+        self.params, self.selector = selector_params(self.bitmap)
+
+    @property
+    def selectivity(self) -> float:
+        """选中的行占全部行的比例"""
+        return self.count / max(self.num_rows, 1)
+
+
+class FilterCompiler:
+    def __init__(self, articles: List[Dict], chunk_articles: np.ndarray, cache_size: int = 128,
+                 crawl_tz: Optional[str] = None):
+        """
+        :param articles: 按文章编号排列的文章级元数据（title、url、source、crawled_at）
+        :param chunk_articles: (n, 2) 的片段→文章映射数组
+        :param cache_size: 缓存的编译结果数量
+        :param crawl_tz: 不带时区的crawled_at所在的时区（IANA名称），为None时读取环境变量 QA_CRAWL_TZ，都未设置时为本机时区
+        """
+        self.row_articles = np.ascontiguousarray(chunk_articles[:, 0])
+        self.num_articles = len(articles)
+        self._by_name: Dict[str, List[int]] = {}
+        for i, article in enumerate(articles):
+            for name in {article.get("title"), article.get("url")}:
+                if name:
+                    self._by_name.setdefault(name, []).append(i)
+        self._sources = np.array([article.get("source") or "" for article in articles], dtype=object)
+        naive_tz = crawl_timezone(crawl_tz)
+        self._crawled = np.array([
+            to_utc_timestamp(article["crawled_at"], naive_tz) if article.get("crawled_at") else np.nan
+            for article in articles
+        ], dtype=np.float64)
+        self._cache: "OrderedDict[tuple, Optional[RowFilter]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(filters: Optional[Dict]) -> Optional[tuple]:
+        """校验过滤条件并转换为可哈希的规范形式，没有任何条件时返回None"""
+        if not filters:
+            return None
+        if not isinstance(filters, dict):
+            raise FilterError("过滤条件必须是JSON对象")
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise FilterError(f"不支持的过滤条件: {', '.join(sorted(unknown))}")
+        key = []
+        for name in ("articles", "sources"):
+            values = filters.get(name)
+            if values is None:
+                continue
+            if isinstance(values, str):
+                values = [values]
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                raise FilterError(f"{name} 必须是字符串列表")
+            key.append((name, tuple(sorted(set(values)))))
+        for name in ("crawled_after", "crawled_before"):
+            if filters.get(name) is not None:
+                key.append((name, _parse_time(filters[name], name)))
+        return tuple(key) or None
+
+    def _article_mask(self, key: tuple) -> np.ndarray:
+        mask = np.ones(self.num_articles, dtype=bool)
+        for name, value in key:
+            if name == "articles":
+                selected = np.zeros(self.num_articles, dtype=bool)
+                for article_name in value:
+                    selected[self._by_name.get(article_name, [])] = True
+                mask &= selected
+            elif name == "sources":
+                mask &= np.isin(self._sources, list(value))
+            elif name == "crawled_after":
+                mask &= self._crawled >= value  # 没有抓取时间的文章不满足时间条件（NaN比较为False）
+            elif name == "crawled_before":
+                mask &= self._crawled < value
+        return mask
+
+    def compile(self, filters: Optional[Dict]) -> Optional[RowFilter]:
+        """
+        将过滤条件编译为索引行位图。
+
+        :param filters: 过滤条件，格式见模块说明
+        :return: 没有过滤条件或所有行都满足条件时返回None（无需过滤）；否则返回RowFilter，count可能为0
+        :raises FilterError: 过滤条件格式错误
+        """
+        key = self.normalize(filters)
+        if key is None:
+            return None
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        row_mask = self._article_mask(key)[self.row_articles]
+        row_filter = None if row_mask.all() else RowFilter(key, row_mask)
+        with self._lock:
+            self._cache[key] = row_filter
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return row_filter
@@ -0,0 +1,178 @@
+# 多知识库服务
+# StrictQASystem绑定一个索引前缀和固定的MongoDB集合，每个知识库都需要一个单独的进程，各自持有一份向量化模型。
+# 本模块在一个服务进程中托管多个知识库：
+# 1. 知识库在配置文件（JSON，名称 -> {"index_prefix", "database", "collection"}）中声明，所有知识库共享
+#    同一个向量化模型、同一个MongoDB连接和同一个上游调度器（共用上游配额）。
+# 2. 知识库在第一次被访问时才加载，内容索引以内存映射方式打开；同一知识库的并发首次访问只加载一次。
+# 3. 按索引和元数据文件的大小估算每个知识库占用的内存，总量超过预算时按LRU淘汰最久未使用的知识库，
+#    被淘汰的知识库在进行中的请求结束后随对象一起释放，下次访问时重新加载。
+# 配置示例（knowledge_bases.json）：
+#   {"tech": {"index_prefix": "enhanced", "database": "tech_data1", "collection": "articles"},
+#    "network": {"index_prefix": "kb/network", "database": "network_kb", "collection": "articles"}}
+
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from qa_system_pro import StrictQASystem
+from singleflight import SingleFlight
+from upstream_scheduler import UpstreamScheduler
+
+# 元数据JSON加载为Python对象后占用的内存约为文件大小的倍数
+JSON_OVERHEAD = 4
+
+KB_LOADED = metrics.REGISTRY.gauge("qa_kb_loaded", "Knowledge bases currently loaded")
+KB_LOADED_BYTES = metrics.REGISTRY.gauge("qa_kb_loaded_bytes", "Estimated memory of loaded knowledge bases")
+KB_LOAD_SECONDS = metrics.REGISTRY.histogram("qa_kb_load_seconds", "Time to load a knowledge base on first use",
+                                             ("kb",))
+KB_EVICTIONS = metrics.REGISTRY.counter("qa_kb_evictions_total", "Knowledge bases evicted to stay within budget",
+                                        ("kb",))
+
+
+class KnowledgeBaseNotFound(KeyError):
+    """请求的知识库没有在配置中声明"""
+
+
+def estimate_kb_bytes(index_prefix: str) -> int:
+    """按索引和元数据文件的大小估算一个知识库加载后占用的内存（字节）"""
+    total = 0
+    for suffix, factor in (("_content.index", 1), ("_chunk_article.npy", 1),
+                           ("_metadata.json", JSON_OVERHEAD), ("_articles.json", JSON_OVERHEAD)):
+        path = f"{index_prefix}{suffix}"
+        if os.path.exists(path):
+            total += os.path.getsize(path) * factor
+    return total
+
+
+class KnowledgeBaseRegistry:
+    def __init__(self,
+                 knowledge_bases: Dict[str, Dict],
+                 default_kb: Optional[str] = None,
+                 memory_budget_mb: float = 4096,
+                 encoder=None,
+                 model_name: str = "shibing624/text2vec-base-chinese",
+                 mongo_uri: str = "mongodb://localhost:27017",
+                 collection_factory: Optional[Callable[[str, str], object]] = None,
+                 upstream_rpm: Optional[float] = None,
+                 upstream_tpm: Optional[float] = None,
+                 **qa_kwargs):
+        """
+        :param knowledge_bases: 知识库名称 -> {"index_prefix", "database", "collection"}
+        :param default_kb: 请求未指定知识库时使用的知识库，默认为配置中的第一个
+        :param memory_budget_mb: 已加载知识库的估算内存总量上限（MB），至少保留最近使用的一个知识库
+        :param encoder: 共享的向量化模型，为None时按model_name加载SentenceTransformer
+        :param mongo_uri: 共享的MongoDB连接地址
+        :param collection_factory: 根据 (数据库, 集合) 返回文档集合的函数，为None时使用共享的MongoClient
+        :param upstream_rpm: 所有知识库共用的上游每分钟请求数配额
+        :param upstream_tpm: 所有知识库共用的上游每分钟token数配额
+        :param qa_kwargs: 创建StrictQASystem的其他参数（api_key、api_url等）
+        """
+        if not knowledge_bases:
+            raise ValueError("至少需要配置一个知识库")
+        self.knowledge_bases = knowledge_bases
+        self.default_kb = default_kb or next(iter(knowledge_bases))
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.logger = logging.getLogger(__name__)
+
+        if encoder is None:
+            from sentence_transformers import SentenceTransformer
+            encoder = SentenceTransformer(model_name)
+        self.encoder = encoder
+        if collection_factory is None:
+            from pymongo import MongoClient
+            client = MongoClient(mongo_uri)
+            collection_factory = lambda database, collection: client[database][collection]
+        self.collection_factory = collection_factory
+        if upstream_rpm and "upstream_scheduler" not in qa_kwargs:
+            qa_kwargs["upstream_scheduler"] = UpstreamScheduler(rpm=upstream_rpm, tpm=upstream_tpm)
+        self.qa_kwargs = qa_kwargs
+
+        self._loaded: "OrderedDict[str, Dict]" = OrderedDict()  # 名称 -> {"qa", "bytes"}，按最近使用排序
+        self._lock = threading.Lock()
+        self._loading = SingleFlight()
+
+    @classmethod
+    def from_config(cls, path: str, **kwargs) -> "KnowledgeBaseRegistry":
+        """从JSON配置文件创建"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def _load(self, name: str) -> StrictQASystem:
+        config = self.knowledge_bases[name]
+        index_prefix = config["index_prefix"]
+        start = time.perf_counter()
+        qa = StrictQASystem(
+            index_prefix=index_prefix,
+            encoder=self.encoder,
+            collection=self.collection_factory(config.get("database", "tech_data1"),
+                                               config.get("collection", "articles")),
+            mmap_index=True,
+            kb_name=name,
+            **self.qa_kwargs,
+        )
+        if qa.sharded_searcher is not None:
+            # 被淘汰后由最后一个持有者释放时关闭分片连接
+            weakref.finalize(qa, qa.sharded_searcher.close)
+        elapsed = time.perf_counter() - start
+        KB_LOAD_SECONDS.labels(name).observe(elapsed)
+
+        size = estimate_kb_bytes(index_prefix)
+        with self._lock:
+            self._loaded[name] = {"qa": qa, "bytes": size}
+            self._evict(keep=name)
+        self.logger.info(f"知识库 {name} 已加载（{elapsed:.2f} 秒，估算 {size / 1024 / 1024:.1f} MB）")
+        return qa
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的知识库直到估算内存不超过预算（调用方持有锁）"""
+        total = sum(entry["bytes"] for entry in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            total -= self._loaded.pop(name)["bytes"]
+            metrics.INDEX_VECTORS.remove(name)
+            KB_EVICTIONS.labels(name).inc()
+            self.logger.info(f"内存预算不足，淘汰知识库 {name}")
+        KB_LOADED.set(len(self._loaded))
+        KB_LOADED_BYTES.set(total)
+
+    def get(self, name: Optional[str] = None) -> StrictQASystem:
+        """
+        返回知识库的问答系统，未加载时先加载。
+
+        :param name: 知识库名称，为None时使用默认知识库
+        :raises KnowledgeBaseNotFound: 知识库没有在配置中声明
+        """
+        name = name or self.default_kb
+        if name not in self.knowledge_bases:
+            raise KnowledgeBaseNotFound(name)
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                self._loaded.move_to_end(name)
+                return entry["qa"]
+        qa, _ = self._loading.do(name, lambda: self._load(name))
+        return qa
+
+    def peek(self, name: Optional[str] = None) -> Optional[StrictQASystem]:
+        """返回已加载的知识库，未加载时返回None（不触发加载，不影响LRU顺序）"""
+        with self._lock:
+            entry = self._loaded.get(name or self.default_kb)
+            return entry["qa"] if entry is not None else None
+
+    def status(self) -> List[Dict]:
+        """所有知识库的加载状态"""
+        with self._lock:
+            return [{"name": name,
+                     "default": name == self.default_kb,
+                     "loaded": name in self._loaded,
+                     "estimated_bytes": self._loaded[name]["bytes"] if name in self._loaded else None}
+                    for name in self.knowledge_bases]
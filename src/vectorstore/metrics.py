@@ -0,0 +1,229 @@
+# 指标采集模块
+# 为问答链路提供轻量级的Prometheus指标：计数器（Counter）、仪表（Gauge）和直方图（Histogram），
+# 并按Prometheus文本格式（text/plain; version=0.0.4）输出，供app.py的 /metrics 接口使用。
+# 为了降低热路径开销，带标签的子指标在首次使用后缓存，记录一次观测只需一次二分查找和一次加锁累加。
+# 模块级的指标对象在进程内全局共享，问答系统和Web层都向同一个注册表写入。
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# 默认的延迟直方图分桶（秒），覆盖从毫秒级检索到30秒级的大模型调用
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+
+    def labels(self, *values):
+        """返回指定标签值对应的子指标（首次使用时创建并缓存）"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values):
+        """删除指定标签值的子指标（例如被卸载的知识库），不存在时忽略"""
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self, labelnames: Tuple[str, ...], labelvalues: Tuple[str, ...]) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if self.labelnames:
+            for key, child in sorted(self._children.items()):
+                lines.extend(child._samples(self.labelnames, key))
+        else:
+            lines.extend(self._samples((), ()))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _samples(self, labelnames, labelvalues):
+        return [f"{self.name}{_format_labels(labelnames, labelvalues)} {_format_value(self._value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._function = None
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float):
+        self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """设置在输出指标时才求值的回调，适合索引大小等按需读取的值"""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        return float(self._function()) if self._function else self._value
+
+    def _samples(self, labelnames, labelvalues):
+        return [f"{self.name}{_format_labels(labelnames, labelvalues)} {_format_value(self.value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value: float):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[position] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self):
+        """计时上下文管理器，退出时记录耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _samples(self, labelnames, labelvalues):
+        names = tuple(labelnames) + ("le",)
+        lines = []
+        cumulative = 0
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(names, labelvalues + (_format_value(bound),))} {cumulative}")
+        labels = _format_labels(labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """按Prometheus文本格式输出全部指标"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 问答链路各阶段耗时：encode、search、reconstruct、hydrate、prompt、llm
+STAGE_SECONDS = REGISTRY.histogram("qa_stage_seconds", "Latency of each QA pipeline stage in seconds", ("stage",))
+QA_REQUESTS = REGISTRY.counter("qa_requests_total", "Questions handled by the QA system")
+CACHE_HITS = REGISTRY.counter("qa_cache_hits_total", "Answers served without a new computation", ("cache",))
+EMPTY_RESULTS = REGISTRY.counter("qa_empty_results_total", "Questions for which retrieval returned no documents")
+UPSTREAM_RESPONSES = REGISTRY.counter("qa_upstream_responses_total", "Upstream LLM responses by HTTP status code",
+                                      ("status",))
+UPSTREAM_ERRORS = REGISTRY.counter("qa_upstream_errors_total", "Failed upstream LLM calls by reason", ("reason",))
+INDEX_VECTORS = REGISTRY.gauge("qa_index_vectors", "Number of vectors in the loaded content index", ("kb",))
+COMPONENT_LOADED = REGISTRY.gauge("qa_component_loaded", "Whether a QA system component is loaded (1) or not (0)",
+                                  ("component",))
+HTTP_REQUESTS = REGISTRY.counter("qa_http_requests_total", "HTTP requests by endpoint and status code",
+                                 ("endpoint", "status"))
+HTTP_SECONDS = REGISTRY.histogram("qa_http_request_seconds", "HTTP request latency in seconds by endpoint",
+                                  ("endpoint",))
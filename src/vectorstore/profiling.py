@@ -0,0 +1,126 @@
+# 按需性能剖析
+# 某个问题很慢时，只能在本地复现才能知道原因。本模块为线上请求提供可选的剖析手段：
+# 1. 请求带有剖析请求头（X-QA-Profile: 1）和正确的管理员令牌（X-QA-Admin-Token），或按配置的比例被抽中时，用cProfile剖析该请求，
+#    结果保存为 {profile_dir}/{request_id}.prof，可用 `python -m pstats` 或snakeviz查看；只保留最近的若干个文件。
+# 2. 同一时间只剖析一个请求（Python 3.12起同一进程不能同时启用多个cProfile），其他请求照常处理、不剖析。
+# 3. 慢请求记录：请求结束时（request_log.finish_request）总耗时超过阈值的请求连同各阶段耗时保存在内存中，
+#    供 /admin/slow-requests 接口（需要管理员令牌）查看。
+# 未启用剖析时（采样比例为0且没有管理员请求头）请求路径上不会创建剖析器，没有额外开销。
+
+import contextlib
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+import metrics
+
+PROFILE_HEADER = "X-QA-Profile"
+ADMIN_HEADER = "X-QA-Admin-Token"
+
+PROFILED_REQUESTS = metrics.REGISTRY.counter("qa_profiled_requests_total", "Requests profiled with cProfile",
+                                             ("trigger",))
+
+_NULL_CONTEXT = contextlib.nullcontext(None)
+
+
+class Profiler:
+    def __init__(self, profile_dir: str = "profiles", sample_rate: float = 0.0, admin_token: Optional[str] = None,
+                 max_profiles: int = 200):
+        """
+        :param profile_dir: 剖析结果保存目录
+        :param sample_rate: 随机剖析的请求比例（0~1），0表示只剖析带管理员请求头的请求
+        :param admin_token: 管理员令牌，带有 X-QA-Profile 请求头且 X-QA-Admin-Token 与之相同的请求会被剖析；
+                            为空时不接受请求头触发，管理接口也不可用
+        :param max_profiles: 最多保留的剖析文件数，超过后删除最旧的文件
+        """
+        self.profile_dir = profile_dir
+        self.sample_rate = sample_rate
+        self.admin_token = admin_token
+        self.max_profiles = max_profiles
+        self._busy = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def is_admin(self, headers) -> bool:
+        """请求头是否携带了正确的管理员令牌"""
+        token = headers.get(ADMIN_HEADER)
+        return bool(self.admin_token) and token is not None and hmac.compare_digest(token, self.admin_token)
+
+    def _trigger(self, headers) -> Optional[str]:
+        if PROFILE_HEADER in headers and self.is_admin(headers):
+            return "header"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    def maybe_profile(self, request_id: str, headers):
+        """
+        返回包裹请求处理的上下文管理器：需要剖析时启用cProfile并在结束时保存结果，否则返回空的上下文管理器。
+
+        :param request_id: 请求ID，作为剖析文件名
+        :param headers: 请求头（支持get和in的映射）
+        """
+        trigger = self._trigger(headers)
+        if trigger is None:
+            return _NULL_CONTEXT
+        return self._profile(request_id, trigger)
+
+    @contextlib.contextmanager
+    def _profile(self, request_id: str, trigger: str):
+        if not self._busy.acquire(blocking=False):
+            # 已有请求正在被剖析，本请求不剖析
+            yield None
+            return
+        try:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield profile
+            finally:
+                profile.disable()
+                path = self._save(profile, request_id)
+                PROFILED_REQUESTS.labels(trigger).inc()
+                self.logger.info(f"请求 {request_id} 的剖析结果已保存: {path}")
+        finally:
+            self._busy.release()
+
+    def profile_path(self, request_id: str) -> str:
+        # 请求ID可能来自外部请求头，只保留安全字符
+        safe_id = "".join(c for c in request_id if c.isalnum() or c in "-_")[:64]
+        return os.path.join(self.profile_dir, f"{safe_id}.prof")
+
+    def _save(self, profile: cProfile.Profile, request_id: str) -> str:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = self.profile_path(request_id)
+        profile.dump_stats(path)
+        files = sorted((os.path.join(self.profile_dir, name) for name in os.listdir(self.profile_dir)
+                        if name.endswith(".prof")), key=os.path.getmtime)
+        for old in files[:max(len(files) - self.max_profiles, 0)]:
+            os.remove(old)
+        return path
+
+
+class SlowRequestLog:
+    def __init__(self, threshold_ms: float = 3000.0, capacity: int = 100):
+        """
+        :param threshold_ms: 总耗时超过该值（毫秒）的请求被记录
+        :param capacity: 最多保留的慢请求数，超过后丢弃最旧的记录
+        """
+        self.threshold_ms = threshold_ms
+        self._records = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self, record: Dict):
+        """request_log.finish_request的回调，参数为请求的结构化日志记录"""
+        if record["total_ms"] >= self.threshold_ms:
+            with self._lock:
+                self._records.append(record)
+
+    def recent(self, limit: int = 20) -> List[Dict]:
+        """最近的慢请求，最新的在前"""
+        with self._lock:
+            return list(self._records)[::-1][:limit]
@@ -1,233 +1,749 @@
-
-# 该脚本实现了一个严格问答系统，支持从MongoDB数据库中提取文档并进行内容检索，
-# 基于问答的上下文生成专业的答案。系统的主要流程包括：
-# 1. 从MongoDB数据库中获取文档并将其向量化。
-# 2. 使用Faiss向量检索库进行相似度匹配，从候选文档中找到最相关的内容。
-# 3. 通过DeepSeek API结合选定文档内容生成精准回答，确保回答严格参考原文。
-# 4. 支持命令行交互，用户输入技术问题后返回基于数据库内容的专业答案。
-
-import faiss
-import numpy as np
-from pymongo import MongoClient
-from sentence_transformers import SentenceTransformer
-import requests
-import logging
-import json
-from typing import List, Dict, Any
-from bson import ObjectId
-from openai import OpenAI
-
-class StrictQASystem:
-    def __init__(self,
-                 api_key: str,
-                 mongo_uri: str = "mongodb://localhost:27017",
-                 index_prefix: str = "enhanced",
-                 model_name: str = "shibing624/text2vec-base-chinese"):
-        """
-        初始化严格问答系统
-
-        Args:
-            api_key: DeepSeek API密钥，用于通过API获取生成的回答
-            mongo_uri: MongoDB连接URI，用于连接MongoDB数据库
-            index_prefix: 索引文件的前缀，用于加载预构建的Faiss向量索引和元数据
-            model_name: 用于将文本内容转换为向量的SentenceTransformer模型名称，默认为中文模型 "shibing624/text2vec-base-chinese"
-        """
-        # 初始化MongoDB连接，获取相关集合
-        self.client = MongoClient(mongo_uri)
-        self.collection = self.client["tech_data1"]["articles"]  # 获取数据库中的文档集合
-        self.api_key = api_key  # DeepSeek API密钥
-
-        # 加载预训练的SentenceTransformer模型，用于文本向量化
-        self.model = SentenceTransformer(model_name)
-
-        # 从磁盘加载Faiss内容向量索引
-        self.content_index = faiss.read_index(f"{index_prefix}_content.index")
-
-        # 加载文档的元数据
-        with open(f"{index_prefix}_metadata.json", "r", encoding="utf-8") as f:
-            self.metadata = json.load(f)
-
-        # 配置日志记录器
-        self.logger = logging.getLogger(__name__)
-        self._configure_logging()
-
-        # 输出调试信息，确认数据库连接是否成功
-        self.logger.info(f"成功连接到MongoDB数据库 {mongo_uri}")
-
-    def _configure_logging(self):
-        """配置日志记录"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s - %(levelname)s - %(message)s",
-            handlers=[logging.StreamHandler()]
-        )
-
-    def _get_content_vector(self, index: int) -> np.ndarray:
-        """根据索引获取对应文档的内容向量"""
-        if index < 0 or index >= self.content_index.ntotal:
-            raise ValueError(f"无效索引: {index}")  # 检查索引是否有效
-        return self.content_index.reconstruct(int(index))  # 获取Faiss索引中存储的内容向量
-
-    def _strict_search(self, query: str) -> List[Dict]:
-        """基于严格匹配的检索逻辑：仅与内容向量进行比较"""
-        # 将查询转换为向量
-        query_vector = self.model.encode([query])[0].astype(np.float32)
-        faiss.normalize_L2(query_vector.reshape(1, -1))  # 归一化查询向量
-
-        # 使用Faiss进行内容匹配，返回相似度和索引
-        content_scores, content_indices = self.content_index.search(query_vector.reshape(1, -1), 7)
-
-        self.logger.info(f"\n=== 内容匹配结果 ===")
-        for i in range(len(content_indices[0])):
-            idx = content_indices[0][i]
-            score = content_scores[0][i]
-            if idx != -1:
-                content = self.metadata[idx].get("content", "未知内容")
-                self.logger.info(f"匹配 {i + 1}: 相似度={score:.4f} | 内容={content[:100]}")  # 输出前100个字符
-
-        # 获取候选匹配结果
-        candidate_results = []
-        for i in range(len(content_indices[0])):
-            idx = content_indices[0][i]
-            if idx == -1:
-                continue
-
-            try:
-                # 获取当前文档的内容向量
-                content_vector = self._get_content_vector(int(idx))
-                faiss.normalize_L2(content_vector.reshape(1, -1))  # 归一化
-                content_sim = float(np.dot(content_vector, query_vector))  # 计算相似度
-
-                candidate_results.append({
-                    "index": int(idx),
-                    "content_sim": content_sim
-                })
-
-                self.logger.info(f"内容匹配检查：内容相似度={content_sim:.4f}")
-
-            except Exception as e:
-                self.logger.warning(f"处理索引 {idx} 时出错: {str(e)}")
-                continue
-
-        # 输出候选结果的数量
-        self.logger.info(f"候选结果数量: {len(candidate_results)}")
-
-        if not candidate_results:
-            self.logger.warning("未找到相关匹配")
-            return []
-
-        # 按内容相似度进行排序
-        sorted_results = sorted(candidate_results,
-                                key=lambda x: x["content_sim"],
-                                reverse=True)
-
-        self.logger.info(f"排序后的结果数量: {len(sorted_results)}")
-
-        # 返回结果
-        output = []
-        for res in sorted_results[:3]:  # 只返回前三个最相关的结果
-            try:
-                # 获取文档ID
-                doc_id = ObjectId(self.metadata[res["index"]]["id"])
-
-                # 打印调试信息，确认索引是否有效
-                self.logger.info(f"正在处理索引 {res['index']}，对应的文档ID: {doc_id}")
-
-                # 从MongoDB查询文档
-                doc = self.collection.find_one({"_id": doc_id})
-
-                if doc:
-                    output.append({
-                        "score": float(res["content_sim"]),  # 存储相似度得分
-                        "content": doc["content"][:2000]  # 限制内容长度为2000字符
-                    })
-                    self.logger.info(f"成功存储文档 {doc_id}，内容: {doc['content'][:100]}")  # 输出文档前100个字符
-                else:
-                    self.logger.warning(f"未找到文档: {doc_id}")
-            except Exception as e:
-                self.logger.warning(f"获取文档失败: {str(e)}")
-
-        if not output:
-            self.logger.warning("未找到任何有效的匹配文档")
-
-        return output
-
-    def generate_answer(self, query: str) -> str:
-        """生成严格限制的答案"""
-        # 执行严格的搜索逻辑，找到相关文档
-        results = self._strict_search(query)
-
-        if not results:
-            self.logger.warning("未找到相关匹配")
-            return "根据现有知识库，暂时无法回答该问题"
-
-        # 构建简明的上下文信息
-        context = "\n".join([f"[文档 {i + 1}] {res['content'][:1000]}"  # 限制每个文档内容为1000字符
-                             for i, res in enumerate(results)])
-
-        # 构建用于生成答案的prompt
-        prompt = f"""你现在是一个智能问答助手，请参考以下文档内容，简明扼要地回答用户问题。请严格参考原文的内容回答，如果文档内容与问题无关，请回答"暂无相关信息"。
-
-相关文档：
-{context}
-
-当前问题：{query}
-请基于上下文用中文给出专业回答："""
-        print(prompt)
-
-        url = "http://maas-api.cn-huabei-1.xf-yun.com/v1/chat/completions"
-        data = {
-            "model": "xdeepseekr1",
-            "messages": [{"role": "user", "content": prompt}],
-            "stream": False
-        }
-        headers = {
-            "Authorization": "Bearer " + self.api_key,  # 使用DeepSeek API密钥进行身份验证
-            "Content-Type": "application/json"
-        }
-        self.logger.info(f"发送API请求到: {url}")
-        self.logger.info(f"请求头: {headers}")
-        self.logger.info(f"请求数据: {json.dumps(data, ensure_ascii=False)[:200]}...")  # 只记录前200个字符
-
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            # 记录API响应
-            self.logger.info(f"API响应状态码: {response.status_code}")
-            self.logger.info(f"API响应内容: {response.text[:200]}...")  # 只记录前200个字符
-
-            if response.status_code == 200:
-                response_data = response.json()
-                return response_data['choices'][0]['message']['content']
-            else:
-                error_message = f"API请求失败，状态码：{response.status_code}，响应：{response.text}"
-                self.logger.error(error_message)
-                return f"抱歉，服务暂时不可用。错误信息：{error_message}"
-        except requests.exceptions.RequestException as e:
-            return f"请求失败: {str(e)}"
-
-# 使用示例
-if __name__ == "__main__":
-    # 设置DeepSeek API密钥
-    API_KEY = ""#输入你的API秘钥
-
-    # 创建问答系统实例
-    qa = StrictQASystem(api_key=API_KEY)
-
-    # 命令行交互，用户输入问题后系统返回答案
-    while True:
-        try:
-            question = input("\n请输入技术问题（输入q退出）: ")
-            if question.lower() in ["q", "exit"]:
-                break
-
-            if not question.strip():
-                continue
-
-            answer = qa.generate_answer(question)
-            print(f"\n专业回答：\n{answer}")
-            print("-" * 60)
-
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            print(f"发生错误: {str(e)}")
+# 该脚本实现了一个严格问答系统，支持从MongoDB数据库中提取文档并进行内容检索，
+# 基于问答的上下文生成专业的答案。系统的主要流程包括：
+# 1. 从MongoDB数据库中获取文档并将其向量化。
+# 2. 使用Faiss向量检索库进行相似度匹配，从候选文档中找到最相关的内容。
+# 3. 通过DeepSeek API结合选定文档内容生成精准回答，确保回答严格参考原文。
+# 4. 支持命令行交互，用户输入技术问题后返回基于数据库内容的专业答案。
+# 5. 检索置信度低于校准阈值（{prefix}_gate.json）的问题直接返回“无法回答”，不调用大模型。
+# 6. 成功生成的答案按规范化问题缓存一段时间，热门问题再次提出时直接返回缓存答案。
+# 7. 支持按文章标题/URL、来源站点和抓取时间过滤检索，过滤条件编译为索引行位图后由Faiss在检索时跳过未选中的行。
+# 8. 请求可以携带截止时间（deadline.py），进入每个阶段前检查，上游调用和分片检索的超时不超过剩余时间。
+
+import faiss
+import numpy as np
+from pymongo import MongoClient
+from sentence_transformers import SentenceTransformer
+import requests
+import logging
+import json
+import os
+import time
+import weakref
+from contextlib import contextmanager
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from bson import ObjectId
+from openai import OpenAI
+
+import metrics
+import request_log
+from answer_cache import AnswerCache
+from aggregation import ArticleAggregator, build_chunk_articles, stitch_chunks
+from confidence_gate import GATE_DECISIONS, ConfidenceGate, gate_features
+from context_packer import ContextPacker, estimate_tokens
+from deadline import DEADLINE_EXCEEDED, Deadline
+from dedup import NearDuplicateDetector
+from filters import FilterCompiler, FilterError, RowFilter
+from quantization import rescore
+from sharded_search import ShardedSearcher
+from singleflight import SingleFlight, normalize_question
+from upstream_scheduler import DeadlineExceeded, UpstreamScheduler
+
+# 默认的上游大模型接口地址和模型名称
+DEFAULT_API_URL = "http://maas-api.cn-huabei-1.xf-yun.com/v1/chat/completions"
+DEFAULT_LLM_MODEL = "xdeepseekr1"
+
+# 上游大模型接口调用的最长超时（秒），请求带截止时间时取剩余时间和该值中较小的一个
+UPSTREAM_TIMEOUT = 30.0
+
+# 知识库中没有可靠依据时的标准答复
+NO_ANSWER = "根据现有知识库，暂时无法回答该问题"
+
+# 生成答案所用的prompt模板
+PROMPT_TEMPLATE = """你现在是一个智能问答助手，请参考以下文档内容，简明扼要地回答用户问题。请严格参考原文的内容回答，如果文档内容与问题无关，请回答"暂无相关信息"。
+
+相关文档：
+{context}
+
+当前问题：{query}
+请基于上下文用中文给出专业回答："""
+
+
+class UpstreamError(Exception):
+    """上游大模型接口调用失败，异常信息即返回给用户的提示"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class StrictQASystem:
+    def __init__(self,
+                 api_key: str,
+                 mongo_uri: str = "mongodb://localhost:27017",
+                 index_prefix: str = "enhanced",
+                 model_name: str = "shibing624/text2vec-base-chinese",
+                 context_tokens: int = 1500,
+                 coalesce_timeout: float = 35.0,
+                 debug_sample_rate: float = 0.01,
+                 async_logging: bool = True,
+                 log_file: str = None,
+                 request_log_file: str = None,
+                 encoder=None,
+                 collection=None,
+                 api_url: str = DEFAULT_API_URL,
+                 llm_model: str = DEFAULT_LLM_MODEL,
+                 shard_addresses: List[str] = None,
+                 shard_authkey: bytes = None,
+                 shard_deadline: float = 0.5,
+                 rescore_factor: int = 4,
+                 upstream_rpm: float = None,
+                 upstream_tpm: float = None,
+                 upstream_scheduler: UpstreamScheduler = None,
+                 upstream_queue_timeout: float = 10.0,
+                 aggregate_articles: bool = True,
+                 article_scoring: str = "max",
+                 mmr_lambda: float = None,
+                 confidence_gate: bool = True,
+                 answer_cache_size: int = 0,
+                 answer_cache_ttl: float = 3600.0,
+                 mongo_database: str = "tech_data1",
+                 mongo_collection: str = "articles",
+                 mmap_index: bool = False,
+                 kb_name: str = "default"):
+        """
+        初始化严格问答系统
+
+        Args:
+            api_key: DeepSeek API密钥，用于通过API获取生成的回答
+            mongo_uri: MongoDB连接URI，用于连接MongoDB数据库
+            index_prefix: 索引文件的前缀，用于加载预构建的Faiss向量索引和元数据
+            model_name: 用于将文本内容转换为向量的SentenceTransformer模型名称，默认为中文模型 "shibing624/text2vec-base-chinese"
+            context_tokens: prompt中检索上下文的token预算
+            coalesce_timeout: 相同问题的并发请求等待进行中计算结果的最长时间（秒）
+            debug_sample_rate: 输出调试级别详细日志（匹配预览、文档内容、上游响应）的请求采样比例
+            async_logging: 是否使用基于队列的异步日志处理
+            log_file: 普通日志文件路径（UTF-8编码）
+            request_log_file: 每个请求一行JSON的结构化日志文件路径
+            encoder: 已加载的向量化模型，为None时按model_name加载SentenceTransformer
+            collection: 提供find_one的文档集合，为None时连接MongoDB的 mongo_database.mongo_collection
+            api_url: 上游大模型的chat/completions接口地址
+            llm_model: 上游大模型名称
+            shard_addresses: 分片检索工作进程地址列表（"host:port"），提供时不在本地加载内容索引，
+                             而是并行查询各分片并合并结果
+            shard_authkey: 分片RPC认证密钥，为None时读取环境变量 QA_SHARD_AUTHKEY
+            shard_deadline: 等待分片返回的最长时间（秒），超时的分片结果被忽略
+            rescore_factor: 使用量化索引时，第一阶段检索的候选数为k的多少倍，候选再用全精度向量精确重排序
+            upstream_rpm: 上游大模型每分钟最多请求数，提供时创建调度器统一限流
+            upstream_tpm: 上游大模型每分钟最多token数
+            upstream_scheduler: 已创建的上游调度器，多个问答系统实例可共享同一个调度器和配额
+            upstream_queue_timeout: 交互式请求等待上游配额的最长时间（秒），超过后直接返回繁忙提示
+            aggregate_articles: 是否按来源文章聚合检索结果（需要索引保存了片段→文章映射）
+            article_scoring: 文章打分方式，"max" 或 "softmax"
+            mmr_lambda: 为None时按文章得分选择文章，否则使用MMR兼顾相关性与差异性
+            confidence_gate: 是否启用检索置信度门控（需要calibrate_gate.py生成的 {prefix}_gate.json）
+            answer_cache_size: 缓存的答案数，默认0表示不缓存答案（问答服务按配置开启）；
+                               缓存的答案在TTL内不受索引重建影响，开启时TTL应不超过索引的重建周期
+            answer_cache_ttl: 缓存答案的有效期（秒）
+            mongo_database: 文档所在的MongoDB数据库
+            mongo_collection: 文档所在的MongoDB集合
+            mmap_index: 是否以内存映射方式打开内容索引（多知识库服务时使用，只有访问到的页面才占用内存）
+            kb_name: 知识库名称，作为索引规模等指标的kb标签
+        """
+        # 初始化MongoDB连接，获取相关集合
+        self.client = None
+        if collection is None:
+            self.client = MongoClient(mongo_uri)
+            collection = self.client[mongo_database][mongo_collection]  # 获取数据库中的文档集合
+        self.collection = collection
+        self.api_key = api_key  # DeepSeek API密钥
+        self.api_url = api_url
+        self.llm_model = llm_model
+
+        # 加载预训练的SentenceTransformer模型，用于文本向量化
+        self.model = encoder if encoder is not None else SentenceTransformer(model_name)
+
+        # 从磁盘加载Faiss内容向量索引；分片模式下由各检索工作进程加载分片索引
+        self.content_index = None
+        self.sharded_searcher = None
+        self.full_vectors = None
+        self.rescore_factor = max(1, rescore_factor)
+        if shard_addresses:
+            self.sharded_searcher = ShardedSearcher(shard_addresses, authkey=shard_authkey, deadline=shard_deadline)
+        else:
+            # IO_FLAG_MMAP_IFC 使平坦/标量量化索引的向量数据也以内存映射方式读取，旧版Faiss只支持IO_FLAG_MMAP
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) if mmap_index else 0
+            self.content_index = faiss.read_index(f"{index_prefix}_content.index", flags)
+            # 量化索引配套的全精度向量以内存映射方式打开，只有重排序时访问到的行才会读入内存
+            if os.path.exists(f"{index_prefix}_vectors.npy"):
+                self.full_vectors = np.load(f"{index_prefix}_vectors.npy", mmap_mode="r")
+
+        # 加载文档的元数据
+        with open(f"{index_prefix}_metadata.json", "r", encoding="utf-8") as f:
+            self.metadata = json.load(f)
+
+        # 片段→文章映射数组（旧索引没有保存时从元数据构建）
+        if os.path.exists(f"{index_prefix}_chunk_article.npy"):
+            chunk_articles = np.load(f"{index_prefix}_chunk_article.npy")
+        else:
+            chunk_articles = build_chunk_articles(self.metadata)
+
+        # 按来源文章聚合结果，避免同一文章的相邻片段占满上下文；聚合时检索更多候选片段
+        self.aggregator = None
+        if aggregate_articles and chunk_articles is not None:
+            self.aggregator = ArticleAggregator(chunk_articles, scoring=article_scoring, mmr_lambda=mmr_lambda)
+        self.search_k = 20 if self.aggregator is not None else 7
+
+        # 将文章标题/来源/抓取时间等过滤条件编译为索引行位图，需要文章级元数据
+        self.filter_compiler = None
+        if chunk_articles is not None and os.path.exists(f"{index_prefix}_articles.json"):
+            with open(f"{index_prefix}_articles.json", "r", encoding="utf-8") as f:
+                self.filter_compiler = FilterCompiler(json.load(f), chunk_articles)
+
+        # 检索置信度门控：置信度低于校准阈值的问题不调用大模型
+        self.confidence_gate = ConfidenceGate.load(f"{index_prefix}_gate.json") if confidence_gate else None
+
+        # 查询时用于折叠近似重复结果的检测器（依赖建索引时写入元数据的simhash指纹）
+        self.dedup_detector = NearDuplicateDetector()
+
+        # 将检索结果合并去冗余后按token预算打包进prompt
+        self.context_packer = ContextPacker(max_tokens=context_tokens)
+
+        # 相同问题的并发请求只执行一次检索和大模型调用，成功生成的答案缓存一段时间
+        self.single_flight = SingleFlight()
+        self.coalesce_timeout = coalesce_timeout
+        self.answer_cache = AnswerCache(answer_cache_size, answer_cache_ttl) if answer_cache_size > 0 else None
+
+        # 上游调用调度：按RPM/TPM限流，交互式请求优先于批量任务
+        if upstream_scheduler is None and upstream_rpm:
+            upstream_scheduler = UpstreamScheduler(rpm=upstream_rpm, tpm=upstream_tpm)
+        self.upstream_scheduler = upstream_scheduler
+        self.upstream_queue_timeout = upstream_queue_timeout
+
+        # 配置日志记录器；详细日志使用单独的记录器，只在被采样的请求中输出
+        self.logger = logging.getLogger(__name__)
+        self.detail_logger = logging.getLogger(f"{__name__}.detail")
+        self.detail_logger.setLevel(logging.DEBUG)
+        self.debug_sample_rate = debug_sample_rate
+        self._configure_logging(async_logging, log_file, request_log_file)
+
+        # 输出调试信息，确认数据库连接是否成功
+        self.logger.info(f"成功连接到MongoDB数据库 {mongo_uri}")
+
+        # 已加载组件和索引规模的指标
+        # 回调只持有弱引用，指标不会让被淘汰的知识库一直留在内存中
+        def indexed_vectors(ref=weakref.ref(self)):
+            qa = ref()
+            return len(qa.metadata) if qa is not None else 0
+
+        metrics.INDEX_VECTORS.labels(kb_name).set_function(indexed_vectors)
+        metrics.COMPONENT_LOADED.labels("model").set(1)
+        metrics.COMPONENT_LOADED.labels("content_index").set(1 if self.content_index is not None else 0)
+        metrics.COMPONENT_LOADED.labels("shards").set(len(shard_addresses) if shard_addresses else 0)
+        metrics.COMPONENT_LOADED.labels("metadata").set(1)
+
+    def _configure_logging(self, async_logging: bool, log_file: str, request_log_file: str):
+        """配置日志记录"""
+        request_log.configure_logging(
+            level=logging.INFO,
+            async_mode=async_logging,
+            log_file=log_file,
+            request_log_file=request_log_file
+        )
+
+    def _detail_enabled(self) -> bool:
+        """当前请求是否被采样输出详细日志"""
+        context = request_log.current_request()
+        return context is not None and context.sampled
+
+    @contextmanager
+    def _stage(self, name: str):
+        """记录问答链路中一个阶段的耗时（同时写入指标和当前请求的结构化日志），请求已超过截止时间时不再进入该阶段"""
+        context = request_log.current_request()
+        if context is not None and context.deadline is not None:
+            context.deadline.check(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.STAGE_SECONDS.labels(name).observe(elapsed)
+            if context is not None:
+                context.add_stage(name, elapsed)
+
+    def _get_content_vector(self, index: int) -> np.ndarray:
+        """根据索引获取对应文档的内容向量"""
+        if index < 0 or index >= self.content_index.ntotal:
+            raise ValueError(f"无效索引: {index}")  # 检查索引是否有效
+        if self.full_vectors is not None:
+            return np.array(self.full_vectors[index], dtype=np.float32)  # 量化索引只能重建近似向量，使用全精度向量
+        return self.content_index.reconstruct(int(index))  # 获取Faiss索引中存储的内容向量
+
+    def _compile_filters(self, filters: Dict = None) -> Optional[RowFilter]:
+        """将过滤条件编译为索引行位图，没有过滤条件时返回None，格式错误时抛出FilterError"""
+        if not filters:
+            return None
+        if self.filter_compiler is None:
+            raise FilterError("当前索引没有保存文章元数据，不支持过滤检索，请重新构建索引")
+        return self.filter_compiler.compile(filters)
+
+    def _search_vectors(self, query_vectors: np.ndarray, k: int, row_filter: RowFilter = None):
+        """在本地索引或各分片上检索（可只检索位图选中的行），返回 (scores, indices)"""
+        if self.sharded_searcher is None:
+            params = row_filter.params if row_filter is not None else None
+            if self.full_vectors is None:
+                return self.content_index.search(query_vectors, k, params=params)
+            # 量化索引：先检索更多候选，再用全精度向量精确重新打分
+            _, candidates = self.content_index.search(query_vectors, k * self.rescore_factor, params=params)
+            return rescore(query_vectors, candidates, self.full_vectors, k)
+        bitmap = row_filter.bitmap if row_filter is not None else None
+        # 分片等待时间不超过请求的剩余时间
+        context = request_log.current_request()
+        deadline = None
+        if context is not None and context.deadline is not None:
+            deadline = context.deadline.timeout(self.sharded_searcher.deadline)
+        scores, indices, complete = self.sharded_searcher.search(query_vectors, k, deadline=deadline, bitmap=bitmap)
+        if not complete:
+            if context is not None:
+                context.fields["partial_shards"] = True
+        return scores, indices
+
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """将查询文本转换为归一化的 (nq, dim) 向量"""
+        query_vectors = np.ascontiguousarray(self.model.encode(queries), dtype=np.float32).reshape(len(queries), -1)
+        faiss.normalize_L2(query_vectors)  # 归一化查询向量
+        return query_vectors
+
+    def _strict_search(self, query: str, filters: Dict = None) -> List[Dict]:
+        """基于严格匹配的检索逻辑：仅与内容向量进行比较，可按文章元数据过滤"""
+        row_filter = self._compile_filters(filters)
+        if row_filter is not None and row_filter.count == 0:
+            self.logger.warning(f"没有满足过滤条件的片段: {filters}")
+            metrics.EMPTY_RESULTS.inc()
+            return []
+
+        # 将查询转换为向量
+        with self._stage("encode"):
+            query_vectors = self._encode_queries([query])
+
+        # 使用Faiss进行内容匹配，返回相似度和索引
+        with self._stage("search"):
+            content_scores, content_indices = self._search_vectors(query_vectors, self.search_k, row_filter)
+
+        return self._rank_results(query_vectors[0], content_scores[0], content_indices[0])
+
+    def batch_search(self, queries: List[str], filters: Dict = None) -> List[List[Dict]]:
+        """
+        批量检索：一次性向量化并检索所有查询，再逐个排序、去重和读取文档，结果与逐条调用_strict_search一致。
+
+        :param queries: 查询列表
+        :param filters: 所有查询共用的过滤条件
+        :return: 与queries一一对应的检索结果列表
+        """
+        row_filter = self._compile_filters(filters)
+        if not queries or (row_filter is not None and row_filter.count == 0):
+            return [[] for _ in queries]
+        with self._stage("batch_encode"):
+            query_vectors = self._encode_queries(queries)
+        with self._stage("batch_search"):
+            content_scores, content_indices = self._search_vectors(query_vectors, self.search_k, row_filter)
+        return [self._rank_results(query_vectors[i], content_scores[i], content_indices[i])
+                for i in range(len(queries))]
+
+    def _rank_results(self, query_vector: np.ndarray, content_scores: np.ndarray,
+                      content_indices: np.ndarray) -> List[Dict]:
+        """对单个查询的Faiss检索结果重新打分、排序、折叠近似重复并读取文档内容"""
+        detail = self._detail_enabled()
+        if detail:
+            self.detail_logger.debug(f"\n=== 内容匹配结果 ===")
+            for i in range(len(content_indices)):
+                idx = content_indices[i]
+                score = content_scores[i]
+                if idx != -1:
+                    content = self.metadata[idx].get("content", "未知内容")
+                    self.detail_logger.debug(f"匹配 {i + 1}: 相似度={score:.4f} | 内容={content[:100]}")  # 输出前100个字符
+
+        # 获取候选匹配结果
+        candidate_results = []
+        with self._stage("reconstruct"):
+            for i in range(len(content_indices)):
+                idx = content_indices[i]
+                if idx == -1:
+                    continue
+
+                try:
+                    if self.content_index is None:
+                        # 分片模式下各分片已在归一化向量上计算内积，直接使用返回的相似度
+                        content_sim = float(content_scores[i])
+                    else:
+                        # 获取当前文档的内容向量
+                        content_vector = self._get_content_vector(int(idx))
+                        faiss.normalize_L2(content_vector.reshape(1, -1))  # 归一化
+                        content_sim = float(np.dot(content_vector, query_vector))  # 计算相似度
+
+                    candidate_results.append({
+                        "index": int(idx),
+                        "content_sim": content_sim
+                    })
+
+                    if detail:
+                        self.detail_logger.debug(f"内容匹配检查：内容相似度={content_sim:.4f}")
+
+                except Exception as e:
+                    self.logger.warning(f"处理索引 {idx} 时出错: {str(e)}")
+                    continue
+
+        # 输出候选结果的数量
+        if detail:
+            self.detail_logger.debug(f"候选结果数量: {len(candidate_results)}")
+
+        if not candidate_results:
+            self.logger.warning("未找到相关匹配")
+            metrics.EMPTY_RESULTS.inc()
+            return []
+
+        # 按内容相似度进行排序
+        sorted_results = sorted(candidate_results,
+                                key=lambda x: x["content_sim"],
+                                reverse=True)
+
+        # 折叠近似重复的候选结果，避免同一内容占用多个上下文位置
+        signatures = [self.metadata[res["index"]].get("simhash") for res in sorted_results]
+        if all(signatures):
+            sorted_results = self.dedup_detector.collapse(sorted_results, [int(s, 16) for s in signatures])
+
+        if detail:
+            self.detail_logger.debug(f"排序后的结果数量: {len(sorted_results)}")
+
+        # 返回结果
+        with self._stage("hydrate"):
+            if self.aggregator is not None:
+                output = self._hydrate_articles(sorted_results, detail)
+            else:
+                output = self._hydrate_chunks(sorted_results[:3], detail)  # 只返回前三个最相关的结果
+
+        if not output:
+            self.logger.warning("未找到任何有效的匹配文档")
+            metrics.EMPTY_RESULTS.inc()
+
+        context = request_log.current_request()
+        if context is not None:
+            context.doc_ids = [doc_id for res in output for doc_id in res.get("ids", [res["id"]])]
+        return output
+
+    def _hydrate_chunks(self, results: List[Dict], detail: bool) -> List[Dict]:
+        """逐个读取片段对应的文档内容（未保存片段→文章映射的旧索引）"""
+        output = []
+        for res in results:
+            try:
+                # 获取文档ID
+                doc_id = ObjectId(self.metadata[res["index"]]["id"])
+
+                # 打印调试信息，确认索引是否有效
+                if detail:
+                    self.detail_logger.debug(f"正在处理索引 {res['index']}，对应的文档ID: {doc_id}")
+
+                # 从MongoDB查询文档
+                doc = self.collection.find_one({"_id": doc_id})
+
+                if doc:
+                    output.append({
+                        "id": str(doc_id),
+                        "score": float(res["content_sim"]),  # 存储相似度得分
+                        "content": doc["content"][:2000]  # 限制内容长度为2000字符
+                    })
+                    if detail:
+                        self.detail_logger.debug(f"成功存储文档 {doc_id}，内容: {doc['content'][:100]}")  # 输出文档前100个字符
+                else:
+                    self.logger.warning(f"未找到文档: {doc_id}")
+            except Exception as e:
+                self.logger.warning(f"获取文档失败: {str(e)}")
+        return output
+
+    def _hydrate_articles(self, sorted_results: List[Dict], detail: bool) -> List[Dict]:
+        """按文章聚合候选片段，一次查询读取入选片段，并将同一文章中连续的片段拼接为一个段落"""
+        vector_fn = self._get_content_vector if self.content_index is not None else None
+        groups = self.aggregator.select(sorted_results, vector_fn=vector_fn)
+        chunk_ids = [ObjectId(self.metadata[c["index"]]["id"]) for g in groups for run in g["runs"] for c in run]
+        try:
+            docs = {str(doc["_id"]): doc for doc in self.collection.find({"_id": {"$in": chunk_ids}})}
+        except Exception as e:
+            self.logger.warning(f"获取文档失败: {str(e)}")
+            return []
+
+        output = []
+        for group in groups:
+            for run in group["runs"]:
+                run_ids = [self.metadata[c["index"]]["id"] for c in run]
+                ids = [doc_id for doc_id in run_ids if doc_id in docs]
+                for doc_id in set(run_ids) - set(ids):
+                    self.logger.warning(f"未找到文档: {doc_id}")
+                if not ids:
+                    continue
+                output.append({
+                    "id": ids[0],
+                    "ids": ids,
+                    "score": max(float(c["content_sim"]) for c in run),  # 段落中最相关片段的相似度
+                    "content": stitch_chunks([docs[i]["content"][:2000] for i in ids])  # 每个片段限制为2000字符
+                })
+                if detail:
+                    self.detail_logger.debug(f"文章 {group['article']}（得分={group['score']:.4f}）拼接片段 {ids}")
+        return output
+
+    def build_prompt(self, query: str, results: List[Dict]) -> str:
+        """将检索结果打包为上下文并填入prompt模板"""
+        passages = self.context_packer.pack(results)
+        context = self.context_packer.render(passages)
+        prompt_tokens = sum(p["tokens"] for p in passages)
+        request = request_log.current_request()
+        if request is not None:
+            request.fields["context_tokens"] = prompt_tokens
+        if self._detail_enabled():
+            self.detail_logger.debug(f"上下文打包: {len(results)} 个片段 -> {len(passages)} 个段落，约 {prompt_tokens} tokens")
+        return PROMPT_TEMPLATE.format(context=context, query=query)
+
+    def generate_answer(self, query: str, priority: str = "interactive", filters: Dict = None,
+                        request_id: str = None, deadline: Deadline = None, use_cache: bool = True) -> str:
+        """
+        生成严格限制的答案，相同问题的并发请求会合并为一次计算
+
+        :param query: 用户问题
+        :param priority: 上游调用的优先级，"interactive"（交互式，有排队截止时间）或 "batch"（批量，一直排队）
+        :param filters: 检索的过滤条件（文章标题/URL、来源站点、抓取时间），格式见filters.py
+        :param request_id: 请求ID（例如来自X-Request-ID请求头），为None时自动生成
+        :param deadline: 请求的截止时间（从请求到达开始计算），为None时不限制总耗时
+        :param use_cache: 为False时不读写答案缓存、不与相同问题的进行中请求合并，每次都执行检索
+                          （回放对比检索结果时使用）
+        :raises FilterError: 过滤条件格式错误，或当前索引不支持过滤
+        :raises DeadlineExceeded: 请求超过截止时间（deadline已过）
+        :raises TimeoutError: 等待相同问题的进行中请求超时
+        """
+        metrics.QA_REQUESTS.inc()
+        context, token = request_log.start_request(query, self.debug_sample_rate, request_id=request_id)
+        context.deadline = deadline
+        status = "ok"
+        queue_deadline = None
+        if priority == "interactive" and self.upstream_queue_timeout is not None:
+            queue_deadline = time.monotonic() + self.upstream_queue_timeout
+        if deadline is not None:
+            queue_deadline = min(queue_deadline or deadline.expires, deadline.expires)
+        try:
+            # 过滤条件是合并键的一部分，过滤条件不同的相同问题不会合并
+            row_filter = self._compile_filters(filters)
+            if filters:
+                context.fields["filters"] = filters
+            key = normalize_question(query) + (f"|{row_filter.key!r}" if row_filter is not None else "")
+            compute = lambda: self._generate_answer(query, priority=priority, deadline=queue_deadline, filters=filters)
+            if not use_cache:
+                context.fields["cache_bypassed"] = True
+                return compute()
+            coalesce_timeout = self.coalesce_timeout if deadline is None else deadline.timeout(self.coalesce_timeout)
+            answer, source = self._answer_once(key, compute, timeout=coalesce_timeout)
+            if source == "cache":
+                context.fields["answer_cached"] = True
+            elif source == "coalesced":
+                context.fields["coalesced"] = True
+            return answer
+        except UpstreamError as e:
+            status = "upstream_error"
+            return str(e)
+        except DeadlineExceeded:
+            if deadline is not None and deadline.expired():
+                # 超时不是答案，抛给调用方（接口返回504），也不会进入答案缓存和热门问题
+                status = "deadline_exceeded"
+                self.logger.warning(f"请求超过截止时间，放弃请求: {query}")
+                raise
+            status = "upstream_busy"
+            self.logger.warning(f"等待上游配额超时，放弃请求: {query}")
+            return "当前请求较多，请稍后再试"
+        except FilterError:
+            status = "bad_request"
+            raise
+        except TimeoutError:
+            status = "coalesce_timeout"
+            self.logger.warning(f"等待相同问题的进行中请求超时: {query}")
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            request_log.finish_request(context, token, status)
+
+    def _answer_once(self, key: str, compute: Callable[[], str], timeout: float = None) -> Tuple[str, str]:
+        """
+        按合并键查询答案缓存，未命中时通过single-flight让相同问题的并发请求只执行一次compute，
+        成功生成的答案写入缓存。
+
+        :return: (答案, 来源)，来源为 "cache"（答案缓存）、"coalesced"（共享进行中的计算）或 "computed"
+        """
+        if self.answer_cache is not None:
+            answer = self.answer_cache.get(key)
+            if answer is not None:
+                metrics.CACHE_HITS.labels("answer").inc()
+                return answer, "cache"
+
+        def run():
+            answer = compute()
+            # 只缓存大模型基于完整检索结果生成的答案：上游失败时抛出异常，不会进入缓存；
+            # 有分片超时时检索结果不完整，答案不缓存，避免在TTL内一直返回缺少部分文档的答案
+            context = request_log.current_request()
+            partial = context is not None and context.fields.get("partial_shards")
+            if self.answer_cache is not None and answer != NO_ANSWER and not partial:
+                self.answer_cache.put(key, answer)
+            return answer
+
+        answer, shared = self.single_flight.do(key, run, timeout=timeout)
+        if shared:
+            metrics.CACHE_HITS.labels("singleflight").inc()
+            return answer, "coalesced"
+        return answer, "computed"
+
+    def answer_retrieved(self, query: str, results: List[Dict], priority: str = "batch") -> str:
+        """
+        为已经检索好的问题生成答案（批量任务在batch_search之后调用）。与generate_answer一样经过答案缓存、
+        相同问题的请求合并和置信度门控，但上游错误以异常抛出，便于调用方按问题记录状态。
+
+        :param query: 用户问题
+        :param results: 该问题的检索结果
+        :param priority: 上游调用的优先级
+        :return: 答案；检索结果为空或未通过置信度门控时返回NO_ANSWER
+        :raises UpstreamError: 上游调用失败
+        """
+        answer, _ = self._answer_once(normalize_question(query),
+                                      lambda: self._generate_answer(query, results, priority=priority),
+                                      timeout=self.coalesce_timeout)
+        return answer
+
+    def is_answer_cached(self, query: str) -> bool:
+        """问题（不带过滤条件）是否已有缓存的答案"""
+        return self.answer_cache is not None and normalize_question(query) in self.answer_cache
+
+    def _generate_answer(self, query: str, results: List[Dict] = None, priority: str = "interactive",
+                         deadline: float = None, filters: Dict = None, gate: bool = True) -> str:
+        """
+        执行检索并调用大模型生成答案，上游调用失败时抛出UpstreamError，排队超过截止时间时抛出DeadlineExceeded
+
+        :param query: 用户问题
+        :param results: 已经检索好的结果（批量模式下由batch_search得到），为None时执行检索
+        :param priority: 上游调用的优先级
+        :param deadline: 等待上游配额的截止时间（time.monotonic()的绝对值）
+        :param filters: 检索的过滤条件
+        :param gate: 是否经过置信度门控（调用方已自行判断时传False）
+        """
+        # 执行严格的搜索逻辑，找到相关文档
+        if results is None:
+            results = self._strict_search(query, filters)
+
+        if not results:
+            self.logger.warning("未找到相关匹配")
+            return NO_ANSWER
+        if gate and not self.passes_gate(query, results):
+            return NO_ANSWER
+
+        # 合并重叠片段、去除冗余后按token预算构建prompt
+        with self._stage("prompt"):
+            prompt = self.build_prompt(query, results)
+        if self._detail_enabled():
+            self.detail_logger.debug(prompt)
+        return self._call_llm(prompt, priority=priority, deadline=deadline)
+
+    def passes_gate(self, query: str, results: List[Dict]) -> bool:
+        """
+        检索置信度门控：判断检索结果是否足够可信、值得调用大模型，并记录门控决策。
+
+        :return: 未启用门控或置信度达到阈值时返回True
+        """
+        if self.confidence_gate is None:
+            return True
+        features = gate_features(results)
+        accepted = self.confidence_gate.accept(features)
+        decision = "accept" if accepted else "reject"
+        GATE_DECISIONS.labels(decision).inc()
+        request = request_log.current_request()
+        if request is not None:
+            request.fields["gate"] = decision
+            request.fields["gate_top_score"] = round(features["top"], 4)
+        if not accepted:
+            self.logger.info(f"检索置信度过低（top={features['top']:.4f}, mean={features['mean']:.4f}），"
+                             f"不调用大模型: {query}")
+        return accepted
+
+    def _call_llm(self, prompt: str, priority: str = "interactive", deadline: float = None) -> str:
+        """调用上游大模型接口，失败时抛出UpstreamError"""
+        url = self.api_url
+        data = {
+            "model": self.llm_model,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": False
+        }
+        headers = {
+            "Authorization": "Bearer " + self.api_key,  # 使用DeepSeek API密钥进行身份验证
+            "Content-Type": "application/json"
+        }
+        detail = self._detail_enabled()
+        if detail:
+            # 请求头中的令牌会由日志脱敏过滤器替换
+            self.detail_logger.debug(f"发送API请求到: {url}")
+            self.detail_logger.debug(f"请求头: {headers}")
+            self.detail_logger.debug(f"请求数据: {json.dumps(data, ensure_ascii=False)[:200]}...")  # 只记录前200个字符
+
+        request = request_log.current_request()
+        if self.upstream_scheduler is not None:
+            # 等待上游配额，截止时间已过的请求不再发送
+            with self._stage("upstream_queue"):
+                waited = self.upstream_scheduler.acquire(priority, estimate_tokens(prompt), deadline)
+            if request is not None:
+                request.fields["upstream_wait_ms"] = round(waited * 1000, 3)
+
+        request_deadline = request.deadline if request is not None else None
+        try:
+            with self._stage("llm"):
+                # 上游超时不超过请求的剩余时间，避免上游变慢时请求在这里堆积
+                timeout = UPSTREAM_TIMEOUT if request_deadline is None else request_deadline.timeout(UPSTREAM_TIMEOUT)
+                response = requests.post(url, headers=headers, json=data, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            metrics.UPSTREAM_ERRORS.labels(type(e).__name__).inc()
+            if isinstance(e, requests.exceptions.Timeout) and request_deadline is not None \
+                    and request_deadline.expired():
+                DEADLINE_EXCEEDED.labels("llm").inc()
+                raise DeadlineExceeded(f"上游调用超过请求的截止时间: {e}")
+            raise UpstreamError(f"请求失败: {str(e)}")
+        metrics.UPSTREAM_RESPONSES.labels(response.status_code).inc()
+
+        # 记录API响应
+        if detail:
+            self.detail_logger.debug(f"API响应状态码: {response.status_code}")
+            self.detail_logger.debug(f"API响应内容: {response.text[:200]}...")  # 只记录前200个字符
+
+        if response.status_code == 200:
+            response_data = response.json()
+            return response_data['choices'][0]['message']['content']
+
+        if response.status_code == 429 and self.upstream_scheduler is not None:
+            # 触发上游限流，在Retry-After指定的时间内暂停放行
+            try:
+                retry_after = float(response.headers.get("Retry-After", 1))
+            except ValueError:
+                retry_after = 1.0
+            self.upstream_scheduler.backoff(retry_after)
+
+        metrics.UPSTREAM_ERRORS.labels("http_status").inc()
+        error_message = f"API请求失败，状态码：{response.status_code}，响应：{response.text}"
+        self.logger.error(error_message)
+        raise UpstreamError(f"抱歉，服务暂时不可用。错误信息：{error_message}", status_code=response.status_code)
+
+# 使用示例
+if __name__ == "__main__":
+    # 设置DeepSeek API密钥
+    API_KEY = ""#输入你的API秘钥
+
+    # 创建问答系统实例
+    qa = StrictQASystem(api_key=API_KEY)
+
+    # 命令行交互，用户输入问题后系统返回答案
+    while True:
+        try:
+            question = input("\n请输入技术问题（输入q退出）: ")
+            if question.lower() in ["q", "exit"]:
+                break
+
+            if not question.strip():
+                continue
+
+            answer = qa.generate_answer(question)
+            print(f"\n专业回答：\n{answer}")
+            print("-" * 60)
+
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            print(f"发生错误: {str(e)}")
@@ -0,0 +1,67 @@
+# 令牌桶限流
+# 上游大模型接口按每分钟请求数等配额限流，批量问答、后台任务等场景需要在客户端主动控制调用速率，
+# 避免触发429后反复重试。令牌桶以固定速率补充令牌，允许不超过桶容量的突发，线程安全。
+
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量，即允许的最大突发量，默认为max(1, rate)
+        """
+        if rate <= 0:
+            raise ValueError("rate必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """立即尝试取出令牌，不足时返回False"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """令牌足够前还需等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        阻塞直到取出令牌。
+
+        :param tokens: 需要的令牌数，不能超过桶容量
+        :param timeout: 最长等待时间（秒），None表示一直等待
+        :return: 是否成功取出令牌
+        """
+        if tokens > self.capacity:
+            raise ValueError(f"请求的令牌数 {tokens} 超过桶容量 {self.capacity}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
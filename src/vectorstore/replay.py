@@ -0,0 +1,218 @@
+# 流量回放工具
+# 将 traffic_capture.py 采集的请求流回放到运行中的问答服务，用于负载测试和检索结果的回归对比。
+# run：按采集时的到达间隔（可用 --speed 加速，0表示不等待、以 --concurrency 个并发尽快发送）向 /qa 发送请求，
+#      统计延迟分布、状态码和调度滞后（线程池饱和时请求晚于计划时间发出），每个请求的结果（状态、耗时、命中文档ID）
+#      写入 --output。可以用 --fake-upstream-port 在本进程中启动假的大模型接口，被测服务需以
+#      QA_API_URL=http://127.0.0.1:<端口>/v1/chat/completions 启动，回放不会消耗真实的上游配额。
+#      注意：被测服务默认开启答案缓存，采集中重复的问题会直接命中缓存、没有检索结果，diff无法对比这些请求。
+#      提供管理员令牌（--admin-token，默认读取 QA_ADMIN_TOKEN，需与被测服务相同）时，回放请求带 X-QA-No-Cache
+#      请求头，服务对每个请求都执行检索；只做负载测试、需要复现线上缓存命中率时使用 --keep-cache。
+# diff：对比两次回放（例如两个版本的索引）或采集文件与回放结果中每个请求命中的文档ID，
+#      统计结果变化的请求比例、首个结果变化的比例和平均Jaccard相似度，并列出变化的问题。
+#      无法对比的请求按原因计入跳过数：只出现在一边（missing）、任一边失败或被拒绝（failed），
+#      任一边没有检索结果（no_ids，例如命中答案缓存、合并到进行中的相同请求或检索为空）。
+# 用法：
+#   QA_CAPTURE_FILE=traffic.jsonl python app.py                      # 采集线上流量
+#   QA_ADMIN_TOKEN=secret QA_API_URL=http://127.0.0.1:8600/v1/chat/completions QA_INDEX_PREFIX=build_a python app.py
+#   QA_ADMIN_TOKEN=secret python replay.py run traffic.jsonl --speed 4 --fake-upstream-port 8600 --output run_a.jsonl
+#   python replay.py diff run_a.jsonl run_b.jsonl
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+
+from bench_suite import percentiles
+from fake_llm_server import FakeLLMServer
+
+
+def load_capture(path: str, limit: int = None) -> List[Dict]:
+    """读取采集文件，按到达时间排序"""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries[:limit] if limit else entries
+
+
+def send(target: str, index: int, entry: Dict, timeout: float, admin_token: str = None) -> Dict:
+    """发送一个回放请求，返回该请求的结果；提供admin_token时请求不使用答案缓存"""
+    payload = {"question": entry["q"], "return_doc_ids": True}
+    if entry.get("kb"):
+        payload["kb"] = entry["kb"]
+    if entry.get("f"):
+        payload["filters"] = entry["f"]
+    headers = {"X-Request-ID": f"replay-{index}"}
+    if admin_token:
+        headers.update({"X-QA-No-Cache": "1", "X-QA-Admin-Token": admin_token})
+    start = time.perf_counter()
+    result = {"i": index, "q": entry["q"]}
+    try:
+        response = requests.post(f"{target}/qa", json=payload, timeout=timeout, headers=headers)
+        result["status"] = response.status_code
+        if response.status_code == 200:
+            result["ids"] = response.json().get("doc_ids", [])
+    except requests.RequestException as e:
+        result["status"] = type(e).__name__
+    result["ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def run(args):
+    entries = load_capture(args.capture, args.limit)
+    if not entries:
+        raise SystemExit("采集文件为空")
+    admin_token = None if args.keep_cache else args.admin_token
+    if not args.keep_cache and not admin_token:
+        print("警告：未提供管理员令牌，重复的问题会命中被测服务的答案缓存，diff时作为no_ids跳过")
+    fake = None
+    if args.fake_upstream_port is not None:
+        fake = FakeLLMServer(port=args.fake_upstream_port, latency=args.fake_latency, jitter=args.fake_jitter).start()
+        print(f"假大模型服务已启动: {fake.url}")
+
+    results, lags = [], []
+    lock = threading.Lock()
+
+    def task(index, entry, scheduled):
+        lag = time.perf_counter() - scheduled
+        result = send(args.target, index, entry, args.timeout, admin_token)
+        result["lag_ms"] = round(lag * 1000, 2)
+        with lock:
+            results.append(result)
+            lags.append(lag)
+
+    first_ts = entries[0]["ts"]
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for index, entry in enumerate(entries):
+                scheduled = start + ((entry["ts"] - first_ts) / args.speed if args.speed > 0 else 0.0)
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(task, index, entry, scheduled)
+    finally:
+        if fake is not None:
+            fake.stop()
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda result: result["i"])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    ok = [result["ms"] / 1000 for result in results if result["status"] == 200]
+    captured = [entry["ms"] / 1000 for entry in entries if "ms" in entry]
+    span = entries[-1]["ts"] - first_ts
+    report = {
+        "requests": len(results),
+        "duration_seconds": round(elapsed, 2),
+        "captured_span_seconds": round(span, 2),
+        "achieved_rps": round(len(results) / elapsed, 2) if elapsed > 0 else None,
+        "status": dict(Counter(str(result["status"]) for result in results)),
+        "cache_bypassed": bool(admin_token),
+        "ok_without_doc_ids": sum(1 for result in results if result["status"] == 200 and not result.get("ids")),
+        "latency": percentiles(ok),
+        "captured_latency": percentiles(captured),
+        "schedule_lag": percentiles(lags),
+    }
+    if fake is not None:
+        report["upstream_requests"] = fake.requests
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+# 采集文件中视为成功（对应回放时的200）的状态
+CAPTURE_OK_STATUSES = ("ok", "cached", "coalesced")
+
+
+def load_ids(path: str) -> Dict[int, Dict]:
+    """读取采集文件或回放结果，返回 序号 -> {"q", "status", "ids"}"""
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    if lines and "i" not in lines[0]:
+        # 采集文件：与回放相同按到达时间排序后的位置作为序号
+        lines.sort(key=lambda entry: entry["ts"])
+        lines = [dict(entry, i=i, status=200 if entry.get("s") in CAPTURE_OK_STATUSES else entry.get("s"))
+                 for i, entry in enumerate(lines)]
+    return {record["i"]: {"q": record["q"], "status": record.get("status"), "ids": record.get("ids") or []}
+            for record in lines}
+
+
+def diff(args):
+    before, after = load_ids(args.before), load_ids(args.after)
+    common, skipped = [], Counter()
+    for index in sorted(before.keys() | after.keys()):
+        if index not in before or index not in after:
+            skipped["missing"] += 1
+        elif before[index]["status"] != 200 or after[index]["status"] != 200:
+            skipped["failed"] += 1
+        elif not before[index]["ids"] or not after[index]["ids"]:
+            skipped["no_ids"] += 1
+        else:
+            common.append(index)
+    changed, top1_changed, similarities = [], 0, []
+    for index in common:
+        a, b = before[index]["ids"], after[index]["ids"]
+        union = set(a) | set(b)
+        similarities.append(len(set(a) & set(b)) / len(union))
+        if a[0] != b[0]:
+            top1_changed += 1
+        if a != b:
+            changed.append({"i": index, "q": before[index]["q"], "before": a, "after": b})
+    total = len(common) + sum(skipped.values())
+    report = {
+        "compared": len(common),
+        "changed": len(changed),
+        "changed_rate": round(len(changed) / len(common), 4) if common else None,
+        # 变化比例只覆盖可对比的请求，跳过比例较高时结论不可靠（例如回放时没有绕过答案缓存）
+        "skipped": sum(skipped.values()),
+        "skipped_rate": round(sum(skipped.values()) / total, 4) if total else None,
+        "skipped_reasons": dict(skipped),
+        "top1_changed": top1_changed,
+        "mean_jaccard": round(sum(similarities) / len(similarities), 4) if similarities else None,
+        "examples": changed[:args.examples],
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放采集的 /qa 请求流，或对比两次回放的检索结果")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="向运行中的服务回放请求")
+    run_parser.add_argument("capture", help="traffic_capture.py 采集的JSONL文件")
+    run_parser.add_argument("--target", default="http://127.0.0.1:5000", help="被测服务地址")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="回放速度倍数，0表示不按到达间隔等待")
+    run_parser.add_argument("--concurrency", type=int, default=64, help="最大并发请求数")
+    run_parser.add_argument("--limit", type=int, default=None, help="只回放前N个请求")
+    run_parser.add_argument("--timeout", type=float, default=60.0, help="单个请求的超时（秒）")
+    run_parser.add_argument("--output", default=None, help="每个请求的结果写入该JSONL文件，供diff使用")
+    run_parser.add_argument("--fake-upstream-port", type=int, default=None, help="在该端口启动假的大模型接口")
+    run_parser.add_argument("--fake-latency", type=float, default=0.2, help="假大模型接口的延迟（秒）")
+    run_parser.add_argument("--fake-jitter", type=float, default=0.0, help="假大模型接口的随机抖动（秒）")
+    run_parser.add_argument("--admin-token", default=os.environ.get("QA_ADMIN_TOKEN"),
+                            help="被测服务的管理员令牌，提供时回放请求不使用答案缓存（默认读取QA_ADMIN_TOKEN）")
+    run_parser.add_argument("--keep-cache", action="store_true", help="回放请求使用答案缓存（复现线上的缓存命中率）")
+    run_parser.set_defaults(handler=run)
+
+    diff_parser = commands.add_parser("diff", help="对比两次回放（或采集文件与回放结果）中命中的文档ID")
+    diff_parser.add_argument("before", help="基准：回放结果或采集文件")
+    diff_parser.add_argument("after", help="对比：回放结果或采集文件")
+    diff_parser.add_argument("--examples", type=int, default=10, help="列出的变化示例数")
+    diff_parser.set_defaults(handler=diff)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# 请求级结构化日志模块
+# 问答热路径上每个问题原本会同步输出十几行INFO日志（全部匹配预览、逐条内容检查、每个文档、请求头和原始响应），
+# 在高并发下同步的格式化和磁盘I/O会直接体现在请求延迟上，请求头中的Bearer令牌也会被写入日志。
+# 本模块提供：
+# 1. 基于队列的异步日志处理：业务线程只把日志记录放入队列，格式化和写入在后台线程完成。
+# 2. 请求上下文RequestContext：收集每个阶段耗时和命中的文档ID，请求结束时输出一行JSON。
+# 3. 按可配置比例对请求进行采样，只有被采样的请求才输出调试级别的详细日志。
+# 4. 敏感信息脱敏：Bearer令牌、Authorization头和api_key等在写出前被替换。
+# 5. 请求结束回调：其他模块（例如慢请求记录）可以注册回调，接收每个请求的结构化记录。
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+# 每个请求输出一行JSON的专用日志记录器
+REQUEST_LOGGER_NAME = "qa.requests"
+
+_REDACT_PATTERNS = [
+    (re.compile(r"(Bearer\s+)[^\s'\",}]+", re.IGNORECASE), r"\1***"),
+    (re.compile(r"(['\"]?(?:authorization|api[_-]?key|token)['\"]?\s*[:=]\s*['\"]?)[^'\",}\s]+", re.IGNORECASE),
+     r"\1***"),
+]
+
+_current: contextvars.ContextVar[Optional["RequestContext"]] = contextvars.ContextVar("qa_request", default=None)
+
+
+def redact(text: str) -> str:
+    """替换文本中的Bearer令牌、Authorization头和api_key等敏感信息"""
+    for pattern, replacement in _REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """在日志写出前对消息进行脱敏"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        redacted = redact(message)
+        if redacted != message:
+            record.msg = redacted
+            record.args = None
+        return True
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    只把日志记录放入队列，不在业务线程中格式化消息。
+    标准QueueHandler.prepare会在调用线程中完成格式化，这里将其推迟到后台监听线程。
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class RequestContext:
+    """一次问答请求的上下文：阶段耗时、命中文档以及是否输出调试日志"""
+
+    def __init__(self, question: str, sampled: bool, request_id: Optional[str] = None):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.question = question
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+        self.stages: Dict[str, float] = {}
+        self.doc_ids: List[str] = []
+        self.fields: Dict[str, object] = {}
+        self.deadline = None  # 请求的截止时间（deadline.Deadline），在进入各阶段前检查
+
+    def add_stage(self, name: str, seconds: float):
+        """累加某个阶段的耗时（秒）"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_record(self, status: str) -> Dict[str, object]:
+        record = {
+            "ts": round(self.timestamp, 3),
+            "request_id": self.request_id,
+            "status": status,
+            "question": self.question[:200],
+            "total_ms": round(self.elapsed() * 1000, 2),
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            "doc_ids": self.doc_ids,
+        }
+        record.update(self.fields)
+        return record
+
+
+def current_request() -> Optional[RequestContext]:
+    """返回当前线程正在处理的请求上下文，没有时返回None"""
+    return _current.get()
+
+
+def start_request(question: str, sample_rate: float = 0.0, request_id: Optional[str] = None):
+    """
+    开始一个请求上下文。
+
+    :param question: 用户问题
+    :param sample_rate: 输出调试级别详细日志的采样比例（0~1）
+    :param request_id: 外部传入的请求ID，为None时自动生成
+    :return: (context, token)，token用于finish_request时恢复之前的上下文
+    """
+    context = RequestContext(question, sampled=random.random() < sample_rate, request_id=request_id)
+    return context, _current.set(context)
+
+
+_finish_hooks: List[Callable[[Dict[str, object]], None]] = []
+
+
+def add_finish_hook(hook: Callable[[Dict[str, object]], None]):
+    """注册请求结束回调，参数为该请求的结构化记录（与请求日志中的JSON相同）"""
+    _finish_hooks.append(hook)
+
+
+def finish_request(context: RequestContext, token, status: str = "ok"):
+    """结束请求上下文，调用请求结束回调，并输出一行结构化JSON日志"""
+    _current.reset(token)
+    logger = logging.getLogger(REQUEST_LOGGER_NAME)
+    enabled = logger.isEnabledFor(logging.INFO)
+    if not enabled and not _finish_hooks:
+        return
+    record = context.to_record(status)
+    for hook in _finish_hooks:
+        hook(record)
+    if enabled:
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+
+class _JsonLineFormatter(logging.Formatter):
+    """请求日志本身已是JSON，直接输出消息"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return record.getMessage()
+
+
+_listeners: List[logging.handlers.QueueListener] = []
+
+
+def _attach(logger: logging.Logger, handlers: List[logging.Handler], async_mode: bool):
+    """为日志记录器挂载处理器；异步模式下业务线程只负责入队，格式化、脱敏和写出由后台线程完成"""
+    if not async_mode:
+        for handler in handlers:
+            logger.addHandler(handler)
+        return
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+    logger.addHandler(_DeferredQueueHandler(log_queue))
+
+
+def configure_logging(level: int = logging.INFO,
+                      async_mode: bool = True,
+                      log_file: Optional[str] = None,
+                      request_log_file: Optional[str] = None,
+                      console: bool = True):
+    """
+    配置问答系统的日志输出。若根日志记录器已配置过处理器则不做任何修改（与logging.basicConfig一致）。
+
+    :param level: 根日志级别
+    :param async_mode: 是否使用队列异步写日志
+    :param log_file: 普通日志文件路径（UTF-8编码），为None时只输出到控制台
+    :param request_log_file: 每请求一行JSON的日志文件路径，为None时与普通日志输出到同一位置
+    :param console: 是否输出到控制台
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        return
+
+    handlers = [logging.StreamHandler()] if console else []
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        handler.addFilter(RedactingFilter())
+
+    root.setLevel(level)
+    _attach(root, handlers, async_mode)
+
+    if request_log_file:
+        request_handler = logging.FileHandler(request_log_file, encoding="utf-8")
+        request_handler.setFormatter(_JsonLineFormatter())
+        request_logger = logging.getLogger(REQUEST_LOGGER_NAME)
+        request_logger.propagate = False
+        _attach(request_logger, [request_handler], async_mode)
+
+    if async_mode:
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """停止后台日志线程，并写出队列中剩余的日志"""
+    while _listeners:
+        _listeners.pop().stop()
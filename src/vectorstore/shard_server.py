@@ -0,0 +1,153 @@
+# 分片检索工作进程
+# 单个进程中的一个IndexFlatIP限制了可服务的语料规模。分片模式下，EnhancedVectorStore.save_shards
+# 将向量按行切分为N个分片索引（IndexIDMap2，保存全局行号作为ID），每个分片由一个轻量级的检索工作进程加载。
+# 工作进程基于 multiprocessing.connection 提供简单的RPC（带authkey认证），既可以在本机以多进程方式运行，
+# 也可以部署在其他节点上，由StrictQASystem通过ShardedSearcher并行分发查询并合并结果。
+# multiprocessing.connection 会反序列化（unpickle）收到的所有消息，知道认证密钥就能在分片主机上执行代码，
+# 因此没有默认密钥：密钥必须通过参数、密钥文件（--authkey-file）或环境变量 QA_SHARD_AUTHKEY 提供，
+# 旧版本内置的公开密钥只允许在本机回环地址上使用。
+# 协议（请求/响应均为元组）：
+#   ("ping",)                     -> ("ok", ntotal)
+#   ("search", vectors, k)        -> ("ok", scores, ids)   ids为全局行号，不足k个时以-1填充
+#   ("search", vectors, k, bitmap) -> 同上，只检索位图（按全局行号打包，见filters.py）选中的行
+#   其他或出错                     -> ("error", message)
+
+import argparse
+import ipaddress
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Listener
+from typing import List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from filters import selector_params
+
+AUTHKEY_ENV = "QA_SHARD_AUTHKEY"
+_LEGACY_AUTHKEY = b"smart-qa-shard"  # 旧版本内置的公开密钥
+
+
+def resolve_authkey(authkey: Optional[bytes] = None, authkey_file: Optional[str] = None) -> bytes:
+    """
+    确定分片RPC认证密钥，优先级：参数 > 密钥文件 > 环境变量 QA_SHARD_AUTHKEY。
+
+    :raises ValueError: 没有提供任何密钥
+    """
+    if authkey:
+        return authkey
+    if authkey_file:
+        with open(authkey_file, "rb") as f:
+            authkey = f.read().strip()
+    else:
+        authkey = os.environ.get(AUTHKEY_ENV, "").encode()
+    if not authkey:
+        raise ValueError(f"未提供分片RPC认证密钥，请通过 --authkey-file 或环境变量 {AUTHKEY_ENV} 设置")
+    return authkey
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ShardWorker:
+    def __init__(self, index_path: str):
+        """
+        :param index_path: 分片索引文件路径（由EnhancedVectorStore.save_shards生成）
+        """
+        self.index_path = index_path
+        self.index = faiss.read_index(index_path)
+        self.logger = logging.getLogger(__name__)
+
+    def handle(self, message: tuple) -> tuple:
+        """处理一个RPC请求"""
+        command = message[0]
+        if command == "ping":
+            return "ok", int(self.index.ntotal)
+        if command == "search":
+            _, vectors, k = message[:3]
+            params = selector = None
+            if len(message) >= 4 and message[3] is not None:
+                params, selector = selector_params(np.ascontiguousarray(message[3], dtype=np.uint8))
+            scores, ids = self.index.search(np.ascontiguousarray(vectors, dtype=np.float32), int(k), params=params)
+            return "ok", scores, ids
+        return "error", f"未知命令: {command}"
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = self.handle(message)
+                except Exception as e:
+                    self.logger.warning(f"处理分片请求出错: {e}")
+                    response = ("error", str(e))
+                connection.send(response)
+
+    def serve(self, authkey: bytes, host: str = "127.0.0.1", port: int = 7100):
+        """
+        在指定地址上提供检索服务，每个连接由单独的线程处理。
+
+        :raises ValueError: 在非回环地址上使用旧版本内置的公开密钥
+        """
+        if authkey == _LEGACY_AUTHKEY and not is_loopback(host):
+            raise ValueError(f"内置的公开密钥不能用于非回环地址 {host}，请设置独立的认证密钥")
+        with Listener((host, port), authkey=authkey) as listener:
+            self.logger.info(f"分片 {self.index_path} 已加载 {self.index.ntotal} 个向量，监听 {host}:{port}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    self.logger.warning(f"接受连接失败: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+
+
+def _run_worker(index_path: str, host: str, port: int, authkey: bytes):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    ShardWorker(index_path).serve(authkey, host, port)
+
+
+def launch_local_workers(shard_paths: List[str], authkey: bytes, host: str = "127.0.0.1",
+                         base_port: int = 7100) -> Tuple[List[multiprocessing.Process], List[str]]:
+    """
+    在本机为每个分片启动一个检索工作进程，便于在单台机器上测试分片模式。
+
+    :param authkey: RPC认证密钥，本机测试时可用 os.urandom(32) 生成
+    :return: (进程列表, 地址列表)，地址格式为 "host:port"
+    """
+    context = multiprocessing.get_context("spawn")
+    processes, addresses = [], []
+    for i, path in enumerate(shard_paths):
+        port = base_port + i
+        process = context.Process(target=_run_worker, args=(path, host, port, authkey), daemon=True)
+        process.start()
+        processes.append(process)
+        addresses.append(f"{host}:{port}")
+    return processes, addresses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="启动一个分片检索工作进程")
+    parser.add_argument("--index", required=True, help="分片索引文件，例如 enhanced_shard0.index")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7100)
+    parser.add_argument("--authkey-file", default=None,
+                        help=f"RPC认证密钥文件，未提供时读取环境变量 {AUTHKEY_ENV}")
+    args = parser.parse_args()
+
+    try:
+        key = resolve_authkey(authkey_file=args.authkey_file)
+    except ValueError as e:
+        parser.error(str(e))
+    _run_worker(args.index, args.host, args.port, key)
@@ -0,0 +1,201 @@
+# 分片检索客户端（scatter-gather）
+# 将查询向量并行发送到所有分片检索工作进程（见shard_server.py），在截止时间内收集各分片的top-k结果并合并。
+# 慢分片或故障分片不会拖慢整个请求：超过截止时间仍未返回的分片会被跳过，结果标记为不完整，并计入指标。
+# 每个分片维护一个空闲连接池，multiprocessing的连接不是线程安全的，每个进行中的请求独占一个连接。
+# 每次调用等待响应的时间不超过截止时间（connection.poll），超时的连接可能还会收到迟到的响应，直接关闭而不放回连接池。
+# 分片进程挂起时新连接的握手也会阻塞，仍有调用超过截止时间未结束的分片在之后的检索中直接跳过，
+# 避免一个挂起的分片占满共享的线程池，让正常分片的调用排在它后面。
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from multiprocessing.connection import Client
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from shard_server import resolve_authkey
+
+SHARD_SECONDS = metrics.REGISTRY.histogram("qa_shard_search_seconds", "Latency of one shard search RPC", ("shard",))
+SHARD_FAILURES = metrics.REGISTRY.counter("qa_shard_failures_total", "Shard searches that timed out or failed",
+                                          ("shard", "reason"))
+
+
+PING_TIMEOUT = 10.0  # 查询分片规模的超时（秒）
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+class _ShardClient:
+    """单个分片的连接池"""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self._endpoint = parse_address(address)
+        self._authkey = authkey
+        self._idle = queue.LifoQueue()
+        self._running: Dict[int, float] = {}  # 进行中的调用 -> 截止时间（time.monotonic()）
+        self._running_lock = threading.Lock()
+        self._call_ids = itertools.count()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return Client(self._endpoint, authkey=self._authkey)
+
+    def overdue(self) -> int:
+        """已超过截止时间仍未结束的调用数（分片挂起时这些调用阻塞在握手或发送上）"""
+        now = time.monotonic()
+        with self._running_lock:
+            return sum(1 for expires in self._running.values() if expires < now)
+
+    def call(self, message: tuple, expires: Optional[float] = None) -> tuple:
+        """
+        发送一次请求并等待响应。
+
+        :param expires: 截止时间（time.monotonic()的值），为None时一直等待
+        :raises TimeoutError: 截止时间前没有收到响应
+        """
+        call_id = next(self._call_ids)
+        with self._running_lock:
+            self._running[call_id] = float("inf") if expires is None else expires
+        try:
+            connection = self._acquire()
+            try:
+                connection.send(message)
+                if expires is not None and not connection.poll(max(expires - time.monotonic(), 0.0)):
+                    raise TimeoutError(f"分片 {self.address} 未在截止时间内返回")
+                response = connection.recv()
+            except BaseException:
+                # 连接可能已损坏，或之后还会收到本次调用迟到的响应，直接丢弃
+                connection.close()
+                raise
+        finally:
+            with self._running_lock:
+                del self._running[call_id]
+        self._idle.put(connection)
+        if response[0] != "ok":
+            raise RuntimeError(f"分片 {self.address} 返回错误: {response[1]}")
+        return response
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardedSearcher:
+    def __init__(self, addresses: List[str], authkey: Optional[bytes] = None, deadline: float = 0.5,
+                 max_workers: Optional[int] = None):
+        """
+        :param addresses: 分片检索工作进程地址列表，格式为 "host:port"
+        :param authkey: RPC认证密钥，为None时读取环境变量 QA_SHARD_AUTHKEY（未设置时抛出ValueError）
+        :param deadline: 等待各分片返回的最长时间（秒），超时的分片结果被忽略
+        :param max_workers: 分发查询的线程数，默认为分片数的4倍
+        """
+        authkey = resolve_authkey(authkey)
+        self.shards = [_ShardClient(address, authkey) for address in addresses]
+        self.deadline = deadline
+        self.logger = logging.getLogger(__name__)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or 4 * len(addresses),
+                                        thread_name_prefix="shard-search")
+        self._ntotal = None
+        self._ntotal_lock = threading.Lock()
+
+    @property
+    def ntotal(self) -> int:
+        """所有分片的向量总数（首次访问时向各分片查询）"""
+        with self._ntotal_lock:
+            if self._ntotal is None:
+                expires = time.monotonic() + PING_TIMEOUT
+                self._ntotal = sum(shard.call(("ping",), expires)[1] for shard in self.shards)
+            return self._ntotal
+
+    def _search_shard(self, shard: _ShardClient, message: tuple, expires: float):
+        start = time.perf_counter()
+        try:
+            _, scores, ids = shard.call(message, expires)
+            return scores, ids
+        finally:
+            SHARD_SECONDS.labels(shard.address).observe(time.perf_counter() - start)
+
+    def search(self, vectors: np.ndarray, k: int, deadline: Optional[float] = None,
+               bitmap: Optional[np.ndarray] = None):
+        """
+        并行检索所有分片并合并top-k。
+
+        :param vectors: (nq, dim) 的已归一化查询向量
+        :param k: 返回的结果数
+        :param deadline: 本次检索的截止时间（秒），默认使用构造时的设置
+        :param bitmap: 按全局行号的过滤位图（见filters.RowFilter），只检索选中的行，None表示不过滤
+        :return: (scores, ids, complete)，scores/ids形状为 (nq, k)，不足时ids为-1；
+                 complete为False表示有分片超时或失败，结果可能不完整
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        message = ("search", vectors, k) if bitmap is None else ("search", vectors, k, bitmap)
+        timeout = self.deadline if deadline is None else deadline
+        expires = time.monotonic() + timeout
+        futures, skipped = {}, 0
+        for shard in self.shards:
+            if shard.overdue():
+                # 上次的调用超过截止时间仍未结束，分片很可能已挂起，不再向它分配线程
+                skipped += 1
+                SHARD_FAILURES.labels(shard.address, "stuck").inc()
+                continue
+            futures[self._pool.submit(self._search_shard, shard, message, expires)] = shard
+        done, pending = wait(futures, timeout=timeout)
+
+        all_scores, all_ids = [], []
+        complete = not pending and not skipped
+        for future in pending:
+            shard = futures[future]
+            SHARD_FAILURES.labels(shard.address, "timeout").inc()
+            self.logger.warning(f"分片 {shard.address} 未在截止时间内返回，结果可能不完整")
+        for future in done:
+            shard = futures[future]
+            try:
+                scores, ids = future.result()
+            except TimeoutError:
+                complete = False
+                SHARD_FAILURES.labels(shard.address, "timeout").inc()
+                self.logger.warning(f"分片 {shard.address} 未在截止时间内返回，结果可能不完整")
+                continue
+            except Exception as e:
+                complete = False
+                SHARD_FAILURES.labels(shard.address, "error").inc()
+                self.logger.warning(f"分片 {shard.address} 检索失败: {e}")
+                continue
+            all_scores.append(scores)
+            all_ids.append(ids)
+
+        nq = vectors.shape[0]
+        if not all_scores:
+            return np.full((nq, k), -np.inf, dtype=np.float32), np.full((nq, k), -1, dtype=np.int64), False
+
+        # 合并各分片的结果，按得分取全局top-k
+        scores = np.concatenate(all_scores, axis=1)
+        ids = np.concatenate(all_ids, axis=1).astype(np.int64)
+        scores = np.where(ids >= 0, scores, -np.inf)
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        merged_scores = np.take_along_axis(scores, order, axis=1)
+        merged_ids = np.take_along_axis(ids, order, axis=1)
+        if merged_ids.shape[1] < k:
+            pad = k - merged_ids.shape[1]
+            merged_scores = np.pad(merged_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+            merged_ids = np.pad(merged_ids, ((0, 0), (0, pad)), constant_values=-1)
+        return merged_scores, merged_ids, complete
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,89 @@
+# 请求合并（single-flight）模块
+# 热点话题出现时，大量用户会在几秒内提出相同的问题，每个请求都会单独执行一次向量检索和一次长达30秒的大模型调用。
+# 本模块按规范化后的问题对并发中的相同请求去重：
+# 1. 第一个到达的请求（leader）真正执行计算，其余相同请求（follower）等待并共享其结果。
+# 2. 计算结束后立即移除该键，结果不会被缓存，之后到达的请求会发起新的计算。
+# 3. leader失败时异常不会直接扩散给所有follower：follower会重新发起一轮合并后的计算（有次数上限）。
+# 4. follower可以设置等待超时，超时只影响该follower自身，不会中断leader的计算。
+
+import re
+import threading
+import unicodedata
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s?？!！。.,，~～]+$")
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本（NFKC、小写、合并空白、去除结尾标点），作为合并请求的键"""
+    question = unicodedata.normalize("NFKC", question or "").lower()
+    question = " ".join(question.split())
+    return _TRAILING_PUNCTUATION.sub("", question)
+
+
+class _Call:
+    """一次正在进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    def __init__(self, follower_retries: int = 1):
+        """
+        :param follower_retries: leader失败后，follower重新发起计算的最大次数
+        """
+        self.follower_retries = follower_retries
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def in_flight(self) -> int:
+        """返回当前正在进行中的计算数量"""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        执行fn，相同key的并发调用只会真正执行一次。
+
+        :param key: 合并请求的键
+        :param fn: 实际的计算函数
+        :param timeout: follower等待结果的最长时间（秒），None表示一直等待
+        :return: (result, shared)，shared为True表示结果来自其他请求发起的计算
+        :raises TimeoutError: follower等待超时
+        """
+        attempts = 0
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self._calls[key] = call
+                else:
+                    call.followers += 1
+
+            if leader:
+                try:
+                    call.result = fn()
+                    return call.result, False
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    # 先移除键再唤醒follower，保证之后的请求不会拿到已结束的计算
+                    with self._lock:
+                        self._calls.pop(key, None)
+                    call.done.set()
+
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"等待合并请求结果超时: {key}")
+            if call.error is None:
+                return call.result, True
+            if attempts >= self.follower_retries:
+                raise call.error
+            attempts += 1
+
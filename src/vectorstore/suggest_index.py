@@ -0,0 +1,188 @@
+# 输入提示（typeahead）前缀索引
+# 用户在首页输入较长的问题，只有提交时才会请求 /qa。/suggest 接口根据已输入的前缀返回匹配的文章标题和热门历史问题，
+# 需要在几毫秒内完成。本模块实现一个紧凑的有序数组前缀索引：
+# 1. 所有条目按规范化后的文本（与single-flight合并键相同的规范化）排序存放，前缀查询通过两次二分查找
+#    得到匹配条目的连续区间，再按权重（标题为固定权重，问题为被提问的次数）取前若干个。
+# 2. 新增条目先进入一个小的待合并缓冲区，查询时一并扫描，缓冲区超过上限时才与有序数组合并，
+#    因此记录新问题、刷新标题都是增量的，不需要重建整个索引。
+# 3. 答案已缓存的问题排在前面，引导用户提出可以直接命中答案缓存的问题，减少大模型调用。
+# 4. 用户的问题被提问至少 min_count 次后才会出现在提示中和被保存，只被问过一两次的问题（可能包含个人信息）
+#    不会展示给其他用户；调用方应先对问题做匿名化（见traffic_capture.anonymize）。
+# 索引与向量索引放在一起：标题来自 {prefix}_articles.json，热门问题保存在 {prefix}_questions.json。
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from singleflight import normalize_question
+
+TITLE_WEIGHT = 1.0  # 标题的权重，相当于被提问过一次的问题
+_MAX_CHAR = "\U0010ffff"
+
+
+class SuggestIndex:
+    def __init__(self, max_pending: int = 2048, is_cached: Optional[Callable[[str], bool]] = None,
+                 min_count: int = 3):
+        """
+        :param max_pending: 待合并缓冲区的最大条目数，超过后合并到有序数组
+        :param is_cached: 判断问题是否已有缓存答案的函数，参数为问题文本
+        :param min_count: 问题至少被提问多少次才会被推荐和保存
+        """
+        self.max_pending = max_pending
+        self.is_cached = is_cached
+        self.min_count = min_count
+        # 有序数组以元组整体替换，查询时取一次引用即可得到一致的快照
+        self._sorted = ([], [], [], np.zeros(0, dtype=np.float64))  # (键, 原文, 类型, 权重)
+        self._positions: Dict[str, int] = {}  # 键 -> 有序数组中的位置
+        self._pending: Dict[str, list] = {}  # 键 -> [原文, 类型, 权重]
+        self._lock = threading.Lock()
+        self._source_paths: Dict[str, float] = {}  # 已加载的标题文件 -> 修改时间
+        self._last_refresh = 0.0
+        self.logger = logging.getLogger(__name__)
+
+    def __len__(self) -> int:
+        return len(self._sorted[0]) + len(self._pending)
+
+    def add(self, text: str, kind: str = "title", weight: float = TITLE_WEIGHT):
+        """添加一个条目，已存在的条目保持不变"""
+        key = normalize_question(text)
+        if not key:
+            return
+        with self._lock:
+            if key in self._positions or key in self._pending:
+                return
+            self._pending[key] = [text.strip(), kind, weight]
+            if len(self._pending) >= self.max_pending:
+                self._merge()
+
+    def record_question(self, question: str, count: int = 1):
+        """记录一次被提问（并成功回答）的问题，增加其权重（问题应已匿名化）"""
+        key = normalize_question(question)
+        if not key:
+            return
+        with self._lock:
+            position = self._positions.get(key)
+            if position is not None:
+                self._sorted[3][position] += count
+                return
+            entry = self._pending.get(key)
+            if entry is not None:
+                entry[2] += count
+                return
+            self._pending[key] = [question.strip(), "question", float(count)]
+            if len(self._pending) >= self.max_pending:
+                self._merge()
+
+    def _merge(self):
+        """将待合并缓冲区并入有序数组（调用方持有锁）"""
+        keys, texts, kinds, weights = self._sorted
+        items = [(key, texts[i], kinds[i], weights[i]) for i, key in enumerate(keys)]
+        items.extend((key, *entry) for key, entry in self._pending.items())
+        items.sort(key=lambda item: item[0])
+        self._sorted = ([item[0] for item in items], [item[1] for item in items], [item[2] for item in items],
+                        np.array([item[3] for item in items], dtype=np.float64))
+        self._positions = {key: i for i, key in enumerate(self._sorted[0])}
+        self._pending = {}
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[Dict]:
+        """
+        返回以prefix开头的条目。
+
+        :param prefix: 用户已输入的文本
+        :param limit: 返回的条目数
+        :return: 按（答案已缓存，权重）从高到低排列的条目，每项包含 text、type（title/question）、cached；
+                 被提问次数少于min_count的问题不会返回
+        """
+        prefix = normalize_question(prefix)
+        if not prefix or limit <= 0:
+            return []
+        keys, texts, kinds, weights = self._sorted
+        lo = bisect.bisect_left(keys, prefix)
+        hi = bisect.bisect_left(keys, prefix + _MAX_CHAR, lo)
+
+        # 多取一些候选，再把答案已缓存的问题排到前面
+        pool = limit * 4
+        if hi - lo > pool:
+            positions = lo + np.argpartition(-weights[lo:hi], pool)[:pool]
+        else:
+            positions = range(lo, hi)
+        candidates = [(keys[i], texts[i], kinds[i], float(weights[i])) for i in positions]
+        with self._lock:
+            candidates.extend((key, *entry) for key, entry in self._pending.items() if key.startswith(prefix))
+
+        ranked = []
+        for key, text, kind, weight in candidates:
+            if kind == "question" and weight < self.min_count:
+                continue
+            cached = kind == "question" and self.is_cached is not None and self.is_cached(text)
+            ranked.append((cached, weight, key, text, kind))
+        ranked.sort(key=lambda item: (not item[0], -item[1], item[2]))
+        return [{"text": text, "type": kind, "cached": cached} for cached, _, _, text, kind in ranked[:limit]]
+
+    def add_titles_from(self, path: str) -> int:
+        """
+        从 {prefix}_articles.json 增量加载文章标题（文件未变化时跳过）。
+
+        :return: 新增的标题数
+        """
+        if not os.path.exists(path):
+            return 0
+        mtime = os.path.getmtime(path)
+        if self._source_paths.get(path) == mtime:
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            records = json.load(f)  # 按文章编号排列的文章级元数据
+        before = len(self)
+        for article in records:
+            if article.get("title"):
+                self.add(article["title"], "title", TITLE_WEIGHT)
+        self._source_paths[path] = mtime
+        return len(self) - before
+
+    def maybe_refresh(self, interval: float = 60.0) -> int:
+        """距离上次检查超过interval秒时，重新检查标题文件是否更新（索引重建后增量加入新文章）"""
+        now = time.monotonic()
+        if now - self._last_refresh < interval:
+            return 0
+        self._last_refresh = now
+        added = sum(self.add_titles_from(path) for path in list(self._source_paths))
+        if added:
+            self.logger.info(f"输入提示索引新增 {added} 个标题")
+        return added
+
+    def save_questions(self, path: str, top: int = 5000):
+        """将最热门的问题及其被提问次数保存到文件，下次启动时加载（被提问次数少于min_count的问题不保存）"""
+        with self._lock:
+            keys, texts, kinds, weights = self._sorted
+            questions = [(texts[i], float(weights[i])) for i in range(len(keys)) if kinds[i] == "question"]
+            questions.extend((entry[0], entry[2]) for entry in self._pending.values() if entry[1] == "question")
+        questions = [item for item in questions if item[1] >= self.min_count]
+        questions.sort(key=lambda item: -item[1])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(questions[:top]), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_prefix: str, **kwargs) -> "SuggestIndex":
+        """
+        根据向量索引旁的文件构建输入提示索引。
+
+        :param index_prefix: 索引文件前缀，读取 {prefix}_articles.json 中的标题和 {prefix}_questions.json 中的热门问题
+        """
+        index = cls(**kwargs)
+        # 初始加载时所有条目先进入缓冲区，最后只合并一次
+        max_pending, index.max_pending = index.max_pending, float("inf")
+        index.add_titles_from(f"{index_prefix}_articles.json")
+        if os.path.exists(f"{index_prefix}_questions.json"):
+            with open(f"{index_prefix}_questions.json", "r", encoding="utf-8") as f:
+                for question, count in json.load(f).items():
+                    index.record_question(question, count)
+        with index._lock:
+            index._merge()
+        index.max_pending = max_pending
+        return index
@@ -0,0 +1,195 @@
+# 合成语料与离线测试组件
+# 在没有MongoDB、没有下载向量化模型、也无法访问远程大模型接口的环境中衡量系统性能所需的组件：
+# 1. generate_documents：按爬虫（wiki_spider1）的切片方式生成可配置规模的中文合成片段，
+#    文档结构与MongoDB中 tech_data1.articles 的文档一致。
+# 2. StubEncoder：确定性的桩编码器，对字符二元组做特征哈希得到向量，共享词语的文本相似度更高，
+#    接口与SentenceTransformer一致，可直接注入EnhancedVectorStore和StrictQASystem。
+# 3. InMemoryCollection：在内存中模拟MongoDB集合的find_one/find接口。
+# 4. make_queries：从语料中抽取句子作为查询，并记录其来源片段，便于计算召回率。
+# 5. SlowEncoder：为编码器加上每个片段固定的耗时，模拟真实模型的向量化开销。
+
+import random
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+_TOPICS = [
+    "机器学习", "深度学习", "人工智能", "计算机科学", "自然科学", "社会科学", "应用科学", "物联网",
+    "第五代移动通信", "第六代移动通信", "无线局域网", "蓝牙", "神经网络", "数据挖掘", "云计算", "边缘计算",
+    "量子计算", "信息论", "操作系统", "编译原理", "分布式系统", "数据库", "密码学", "计算机视觉",
+]
+_TERMS = [
+    "算法", "模型", "数据", "网络", "信号", "频谱", "协议", "带宽", "延迟", "吞吐量", "节点", "终端", "基站",
+    "天线", "编码", "调制", "训练", "推理", "特征", "参数", "梯度", "优化", "存储", "计算", "传感器", "芯片",
+    "标准", "架构", "接口", "安全", "隐私", "能耗", "精度", "鲁棒性", "泛化", "样本", "标注", "向量", "矩阵",
+    "概率", "统计", "实验", "理论", "应用", "系统", "平台", "服务", "设备", "频段", "速率", "覆盖",
+]
+_VERBS = ["提出了", "研究了", "改进了", "实现了", "描述了", "依赖于", "用于", "提高了", "降低了", "结合了", "定义了"]
+_LINKS = ["，并且", "，同时", "。此外，", "，因此", "。然而，", "，其中", "。在此基础上，"]
+
+# 与爬虫一致的切片参数：每500字切一次，相邻片段保留50字重叠
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+CRAWLED_AT = "2025-02-13T00:00:00"  # 固定的抓取时间，保证生成的语料完全可复现
+
+
+def _entity(rng: random.Random) -> str:
+    """随机生成由2~4个常用汉字组成的专有名词，使不同文章之间的内容有足够的区分度"""
+    return "".join(chr(0x4E00 + rng.randrange(0x5000)) for _ in range(rng.randint(2, 4)))
+
+
+def _sentence(rng: random.Random, topic: str, entities: List[str]) -> str:
+    parts = [f"{topic}{rng.choice(_VERBS)}{rng.choice(entities)}{rng.choice(_TERMS)}与{rng.choice(_TERMS)}"]
+    for _ in range(rng.randint(1, 3)):
+        parts.append(f"{rng.choice(_LINKS)}{rng.choice(entities)}{rng.choice(_TERMS)}"
+                     f"{rng.choice(_VERBS)}{rng.choice(_TERMS)}")
+    return "".join(parts) + "。"
+
+
+def split_chunks(content: str) -> List[str]:
+    """按照wiki_spider1的方式切分正文"""
+    chunks = []
+    prev_end = 0
+    while prev_end < len(content):
+        end = min(prev_end + CHUNK_SIZE, len(content))
+        start = prev_end - CHUNK_OVERLAP if prev_end > 0 else 0  # 保留上一段的最后50字
+        chunks.append(content[start:end])
+        prev_end = end
+    return chunks
+
+
+def generate_documents(num_chunks: int, seed: int = 0, chunks_per_article: int = 8) -> List[Dict]:
+    """
+    生成合成片段文档。
+
+    :param num_chunks: 片段数量（例如1万到100万）
+    :param seed: 随机种子，相同参数生成的语料完全一致
+    :param chunks_per_article: 每篇合成文章的平均片段数
+    :return: 文档列表，每个文档包含 _id、content（标题+换行+片段）、title、url、chunk_index、crawled_at
+    """
+    rng = random.Random(seed)
+    documents = []
+    article = 0
+    while len(documents) < num_chunks:
+        topic = rng.choice(_TOPICS)
+        title = f"{topic}（{article}）"
+        target = rng.randint(max(chunks_per_article // 2, 1), chunks_per_article * 3 // 2) * CHUNK_SIZE
+        entities = [_entity(rng) for _ in range(12)]
+        body = []
+        length = 0
+        while length < target:
+            sentence = _sentence(rng, topic, entities)
+            body.append(sentence)
+            length += len(sentence)
+        for position, chunk in enumerate(split_chunks("".join(body))):
+            if len(documents) >= num_chunks:
+                break
+            documents.append({
+                "_id": ObjectId(f"{len(documents):024x}"),
+                "content": f"{title}\n{chunk}",
+                "title": title,
+                "url": f"https://synthetic.local/wiki/{article}",
+                "chunk_index": position,
+                "crawled_at": CRAWLED_AT,
+            })
+        article += 1
+    return documents
+
+
+def make_queries(documents: Sequence[Dict], count: int, seed: int = 1) -> List[Tuple[str, str]]:
+    """
+    从语料中随机抽取句子作为查询。
+
+    :return: (query, source_id) 列表，source_id为抽取句子所在片段的文档ID
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        doc = documents[rng.randrange(len(documents))]
+        sentences = [s for s in doc["content"].split("\n", 1)[-1].split("。") if len(s) > 8]
+        sentence = rng.choice(sentences) if sentences else doc["content"][:40]
+        queries.append((f"{sentence}是什么？", str(doc["_id"])))
+    return queries
+
+
+class StubEncoder:
+    """
+    确定性的桩编码器：对字符二元组做带符号的特征哈希，结果与SentenceTransformer的encode接口兼容。
+    不需要下载模型，速度快，且共享词语的文本得到更高的内积，适合检索链路的性能与回归测试。
+    """
+
+    def __init__(self, dim: int = 768, seed: int = 0):
+        self.dim = dim
+        self._salt = np.uint64(seed * 2654435761 + 1)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _encode_one(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if codes.size < 2:
+            return vector
+        with np.errstate(over="ignore"):
+            hashes = (codes[:-1] * np.uint64(1000003) + codes[1:]) * np.uint64(0x9E3779B97F4A7C15) + self._salt
+        buckets = (hashes >> np.uint64(33)) % np.uint64(self.dim)
+        signs = np.where((hashes >> np.uint64(7)) & np.uint64(1), 1.0, -1.0)
+        np.add.at(vector, buckets.astype(np.int64), signs)
+        return vector
+
+    def encode(self, texts: Iterable[str], batch_size: int = 32, show_progress_bar: bool = False,
+               **kwargs) -> np.ndarray:
+        texts = list(texts)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            vectors[i] = self._encode_one(text)
+        return vectors
+
+
+class SlowEncoder:
+    """
+    为编码器的每个片段加上固定的耗时，模拟真实模型的向量化开销（CPU上的BERT类模型每个片段约数毫秒）。
+    桩编码器本身几乎不耗时，衡量向量缓存这类减少编码次数的优化时需要用它包装。
+    """
+
+    def __init__(self, encoder, per_text_ms: float = 4.0):
+        """
+        :param encoder: 被包装的编码器，返回的向量与其一致
+        :param per_text_ms: 每个片段额外的耗时（毫秒）
+        """
+        self.encoder = encoder
+        self.per_text_ms = per_text_ms
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.encoder.get_sentence_embedding_dimension()
+
+    def encode(self, texts: Iterable[str], **kwargs) -> np.ndarray:
+        texts = list(texts)
+        time.sleep(len(texts) * self.per_text_ms / 1000)
+        return self.encoder.encode(texts, **kwargs)
+
+
+class InMemoryCollection:
+    """以 _id 为键的内存文档集合，模拟pymongo Collection的find_one/find接口"""
+
+    def __init__(self, documents: Iterable[Dict]):
+        self._documents = {doc["_id"]: doc for doc in documents}
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def find_one(self, query: Optional[Dict] = None) -> Optional[Dict]:
+        if not query:
+            return next(iter(self._documents.values()), None)
+        return self._documents.get(query.get("_id"))
+
+    def find(self, query: Optional[Dict] = None) -> List[Dict]:
+        if not query:
+            return list(self._documents.values())
+        condition = query.get("_id")
+        if isinstance(condition, dict) and "$in" in condition:
+            return [self._documents[i] for i in condition["$in"] if i in self._documents]
+        doc = self._documents.get(condition)
+        return [doc] if doc else []
@@ -0,0 +1,5 @@
+# 测试配置：src/vectorstore 下的模块按文件名直接导入，将该目录加入模块搜索路径
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,93 @@
+# 请求合并（single-flight）测试
+# N个同时到达的相同问题只触发一次上游调用；leader失败后follower重新合并为一次调用；
+# 通过StrictQASystem和进程内的假大模型服务验证端到端的上游调用次数。
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight, normalize_question
+
+
+def run_concurrently(fn, args):
+    """所有线程在屏障处同时出发，返回各线程的结果"""
+    barrier = threading.Barrier(len(args))
+
+    def call(arg):
+        barrier.wait()
+        return fn(arg)
+
+    with ThreadPoolExecutor(max_workers=len(args)) as pool:
+        return list(pool.map(call, args))
+
+
+def test_concurrent_identical_questions_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def upstream():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+
+    # 仅大小写、全半角和结尾标点不同的问题视为相同
+    questions = ["什么是5G？"] * 25 + ["什么是5g"] * 25
+    outcomes = run_concurrently(lambda question: flight.do(normalize_question(question), upstream), questions)
+
+    assert len(calls) == 1
+    assert all(result == "answer" for result, _ in outcomes)
+    assert sum(shared for _, shared in outcomes) == len(questions) - 1
+
+
+def test_followers_retry_once_after_leader_failure():
+    flight = SingleFlight()
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        time.sleep(0.2)
+        if len(calls) == 1:
+            raise RuntimeError("upstream error")
+        return "recovered"
+
+    def ask(_):
+        try:
+            return flight.do("q", flaky)[0]
+        except RuntimeError:
+            return "failed"
+
+    outcomes = run_concurrently(ask, range(20))
+
+    assert outcomes.count("failed") == 1
+    assert outcomes.count("recovered") == 19
+    assert len(calls) == 2
+
+
+def test_generate_answer_makes_one_upstream_call(tmp_path):
+    pytest.importorskip("faiss")
+    pytest.importorskip("sentence_transformers")
+    from fake_llm_server import FakeLLMServer
+    from qa_system_pro import StrictQASystem
+    from synthetic_corpus import InMemoryCollection, StubEncoder, generate_documents, make_queries
+    from vectorstore_enhanced import EnhancedVectorStore
+
+    encoder = StubEncoder()
+    documents = generate_documents(500, seed=0)
+    store = EnhancedVectorStore(cache_dir=None, encoder=encoder)
+    store.create_indices()
+    store.process_data(documents=documents)
+    prefix = str(tmp_path / "bench")
+    store.save_indices(prefix)
+    question = make_queries(documents, 1, seed=1)[0][0]
+
+    with FakeLLMServer(latency=0.3) as upstream:
+        qa = StrictQASystem(api_key="test", index_prefix=prefix, encoder=encoder,
+                            collection=InMemoryCollection(documents), api_url=upstream.url,
+                            debug_sample_rate=0.0, async_logging=False, answer_cache_size=0,
+                            confidence_gate=False)
+        answers = run_concurrently(lambda _: qa.generate_answer(question), range(10))
+
+    assert upstream.requests == 1
+    assert answers == [upstream.answer] * 10
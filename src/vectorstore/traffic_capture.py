@@ -0,0 +1,100 @@
+# 线上流量采集
+# qa_system.log 是自由文本，无法用来复现线上的请求模式。本模块把 /qa 请求按可配置比例采集为紧凑的JSONL，
+# 每行一个请求，供 replay.py 回放做负载测试和检索结果回归对比：
+#   {"ts": 到达时间, "q": 问题, "kb": 知识库, "f": 过滤条件, "ids": 命中的文档ID, "st": 各阶段耗时(ms),
+#    "ms": 总耗时(ms), "s": 状态}
+# 状态与请求日志相同（ok、deadline_exceeded等），命中答案缓存和合并到进行中请求的记为cached、coalesced（没有检索结果）；
+# 准入控制拒绝的请求（接口返回503）没有进入问答链路，记为shed，回放时同样会发送，以复现过载时的请求量。
+# 匿名化：不记录请求ID、客户端地址和请求头；问题中的邮箱、手机号、身份证号和较长的数字串被替换为占位符，
+# 并经过 request_log.redact 去除令牌等敏感信息。
+# 写入在请求线程中完成，只做一次json序列化和一次按行缓冲的追加写（相对于一次问答请求的耗时可以忽略），
+# 进程被直接终止时也不会丢失已完成请求的记录。
+
+import atexit
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+from request_log import redact
+
+CAPTURED_REQUESTS = metrics.REGISTRY.counter("qa_traffic_captured_total", "Requests written to the traffic capture")
+
+_ANONYMIZE_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), "<email>"),
+    (re.compile(r"(?<!\d)\d{17}[\dXx](?!\d)"), "<id>"),
+    (re.compile(r"(?<!\d)1[3-9]\d{9}(?!\d)"), "<phone>"),
+    (re.compile(r"\d{6,}"), "<num>"),
+]
+
+
+def anonymize(question: str) -> str:
+    """替换问题中的邮箱、身份证号、手机号和较长的数字串"""
+    for pattern, replacement in _ANONYMIZE_PATTERNS:
+        question = pattern.sub(replacement, question)
+    return redact(question)
+
+
+class TrafficCapture:
+    def __init__(self, path: str, sample_rate: float = 1.0):
+        """
+        :param path: 采集文件路径（追加写入）
+        :param sample_rate: 采集的请求比例（0~1）
+        """
+        self.path = path
+        self.sample_rate = sample_rate
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def capture(self, record: Dict, question: str, kb: Optional[str] = None):
+        """
+        采集一个请求。
+
+        :param record: request_log中该请求的结构化记录
+        :param question: 完整的问题（请求日志中的问题会被截断）
+        :param kb: 请求使用的知识库
+        """
+        if record.get("answer_cached"):
+            status = "cached"
+        elif record.get("coalesced"):
+            status = "coalesced"
+        else:
+            status = record["status"]
+        self._write(record["ts"], question, kb, record.get("filters"), ids=record["doc_ids"], st=record["stages_ms"],
+                    ms=record["total_ms"], s=status)
+
+    def capture_rejected(self, question: str, status: str, elapsed_ms: float, kb: Optional[str] = None,
+                         filters: Optional[Dict] = None):
+        """
+        采集没有进入问答链路的请求（例如被准入控制拒绝）。
+
+        :param status: 请求状态，例如 "shed"
+        :param elapsed_ms: 请求从到达到被拒绝的耗时（毫秒）
+        """
+        arrived = time.time() - elapsed_ms / 1000
+        self._write(round(arrived, 3), question, kb, filters, ids=[], st={}, ms=round(elapsed_ms, 2), s=status)
+
+    def _write(self, ts: float, question: str, kb: Optional[str], filters: Optional[Dict], **fields):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        entry = {"ts": ts, "q": anonymize(question)}
+        if kb:
+            entry["kb"] = kb
+        if filters:
+            entry["f"] = filters
+        entry.update(fields)
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+        CAPTURED_REQUESTS.inc()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
@@ -0,0 +1,155 @@
+# 上游大模型调用调度器
+# 上游接口按每分钟请求数（RPM）和每分钟token数（TPM）限额。交互式 /qa 请求和批量任务同时调用时如果互不协调，
+# 会一起触发429。调度器在同一进程内统一放行所有上游调用：
+# 1. 以两个令牌桶分别限制请求速率和token速率，token数按prompt估算值加上预留的输出token数计算。
+# 2. 等待中的调用按优先级排队：交互式（interactive）总是先于批量（batch），同一优先级内先到先得。
+# 3. 每个调用可以带截止时间，排队期间截止时间已过的调用直接丢弃（抛出DeadlineExceeded），不再发送到上游。
+# 4. 收到429时按Retry-After暂停放行，避免在限额恢复前继续发送。
+# 5. 通过指标报告各优先级的排队深度、排队等待时间和被丢弃的调用数。
+# 调用方在自己的线程中阻塞等待放行，放行后由调用方自己发送请求，调度器本身不创建线程。
+# 调度器只协调同一进程内的调用。问答服务和批量任务（batch_qa.py）在不同进程中运行，各自只能使用账号限额的一部分：
+# 两者读取相同的环境变量（账号限额 QA_UPSTREAM_RPM / QA_UPSTREAM_TPM，批量任务所占比例 QA_BATCH_UPSTREAM_SHARE），
+# 由 process_quota 计算各自的配额，两者之和不超过账号限额。
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import metrics
+from rate_limit import TokenBucket
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+QUEUE_DEPTH = metrics.REGISTRY.gauge("qa_upstream_queue_depth", "Upstream calls waiting for a rate-limit slot",
+                                     ("priority",))
+QUEUE_WAIT_SECONDS = metrics.REGISTRY.histogram("qa_upstream_queue_wait_seconds",
+                                                "Time upstream calls spent waiting for a rate-limit slot",
+                                                ("priority",))
+DROPPED = metrics.REGISTRY.counter("qa_upstream_dropped_total", "Upstream calls dropped before being sent",
+                                   ("priority", "reason"))
+
+ACCOUNT_RPM_ENV = "QA_UPSTREAM_RPM"
+ACCOUNT_TPM_ENV = "QA_UPSTREAM_TPM"
+BATCH_SHARE_ENV = "QA_BATCH_UPSTREAM_SHARE"
+DEFAULT_BATCH_SHARE = 0.25
+
+
+class DeadlineExceeded(Exception):
+    """调用在排队期间超过了截止时间，未发送到上游"""
+
+
+class UpstreamScheduler:
+    def __init__(self, rpm: float, tpm: Optional[float] = None, completion_tokens: int = 512,
+                 request_burst: float = 1, token_burst_seconds: float = 5.0):
+        """
+        :param rpm: 每分钟最多放行的请求数
+        :param tpm: 每分钟最多放行的token数，None表示不限制token
+        :param completion_tokens: 为每个调用的输出预留的token数，与prompt的token数一起计入TPM
+        :param request_burst: 请求令牌桶的容量，即空闲后允许的突发请求数
+        :param token_burst_seconds: token令牌桶的容量，以几秒的token配额计算；单个调用的token数超过容量时按容量计
+        注意：令牌桶在任意一分钟内最多放行 容量 + 每分钟速率，配置rpm/tpm时应为上游限额留出相应余量。
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.completion_tokens = completion_tokens
+        self._requests = TokenBucket(rpm / 60.0, capacity=request_burst)
+        self._tokens = TokenBucket(tpm / 60.0, capacity=tpm / 60.0 * token_burst_seconds) if tpm else None
+        self._cond = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._paused_until = 0.0
+
+    def _wait_time(self, tokens: float) -> float:
+        wait = max(self._requests.wait_time(1), self._paused_until - time.monotonic())
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(min(tokens, self._tokens.capacity)))
+        return wait
+
+    def _take(self, tokens: float):
+        self._requests.try_acquire(1)
+        if self._tokens is not None:
+            self._tokens.try_acquire(min(tokens, self._tokens.capacity))
+
+    def _remove(self, entry: list):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        QUEUE_DEPTH.labels(entry[2]).dec()
+        # 队首可能发生变化，唤醒其他等待者
+        self._cond.notify_all()
+
+    def acquire(self, priority: str = "interactive", tokens: float = 0, deadline: Optional[float] = None) -> float:
+        """
+        阻塞直到获得一次上游调用的配额。
+
+        :param priority: "interactive" 或 "batch"
+        :param tokens: 本次调用prompt的token数（预留的输出token数会自动加上）
+        :param deadline: 截止时间（time.monotonic()的绝对值），None表示不设截止时间
+        :return: 排队等待的秒数
+        :raises DeadlineExceeded: 获得配额前截止时间已过
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        start = time.monotonic()
+        tokens += self.completion_tokens
+        entry = [PRIORITIES[priority], next(self._counter), priority]
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            QUEUE_DEPTH.labels(priority).inc()
+            while True:
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    self._remove(entry)
+                    DROPPED.labels(priority, "deadline").inc()
+                    raise DeadlineExceeded(f"上游调用排队 {now - start:.2f} 秒后超过截止时间")
+
+                timeout = None
+                if self._queue[0] is entry:
+                    timeout = self._wait_time(tokens)
+                    if timeout <= 0:
+                        self._take(tokens)
+                        self._remove(entry)
+                        waited = time.monotonic() - start
+                        QUEUE_WAIT_SECONDS.labels(priority).observe(waited)
+                        return waited
+                if deadline is not None:
+                    timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                self._cond.wait(timeout)
+
+    def backoff(self, seconds: float):
+        """上游返回429时调用，在指定时间内暂停放行所有调用"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        """当前排队的调用数"""
+        with self._cond:
+            return sum(1 for entry in self._queue if priority is None or entry[2] == priority)
+
+
+def process_quota(role: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                  batch_share: Optional[float] = None) -> Tuple[Optional[float], Optional[float]]:
+    """
+    按账号限额计算本进程可以使用的上游配额：批量任务使用batch_share比例，问答服务使用其余部分。
+
+    :param role: "interactive"（问答服务）或 "batch"（批量任务）
+    :param rpm: 账号每分钟请求数限额，为None时读取环境变量 QA_UPSTREAM_RPM
+    :param tpm: 账号每分钟token数限额，为None时读取环境变量 QA_UPSTREAM_TPM
+    :param batch_share: 批量任务所占比例（0~1），为None时读取环境变量 QA_BATCH_UPSTREAM_SHARE（默认0.25）
+    :return: (rpm, tpm)，账号限额未配置的项为None
+    """
+    if role not in PRIORITIES:
+        raise ValueError(f"未知的角色: {role}")
+    if rpm is None and os.environ.get(ACCOUNT_RPM_ENV):
+        rpm = float(os.environ[ACCOUNT_RPM_ENV])
+    if tpm is None and os.environ.get(ACCOUNT_TPM_ENV):
+        tpm = float(os.environ[ACCOUNT_TPM_ENV])
+    if batch_share is None:
+        batch_share = float(os.environ.get(BATCH_SHARE_ENV, DEFAULT_BATCH_SHARE))
+    if not 0 <= batch_share <= 1:
+        raise ValueError(f"批量任务的配额比例应在0~1之间: {batch_share}")
+    share = batch_share if role == "batch" else 1 - batch_share
+    return (rpm * share if rpm else None), (tpm * share if tpm else None)
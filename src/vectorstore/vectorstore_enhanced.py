@@ -1,69 +1,278 @@
-
-# 该脚本用于从MongoDB数据库中提取文档内容，使用预训练的SentenceTransformer模型将文本内容转换为向量表示，
-# 然后使用Faiss库构建高效的向量索引以便进行快速的相似度查询。脚本的主要功能包括：
-# 1. 从MongoDB中提取文档内容。
-# 2. 使用SentenceTransformer将文本转化为向量表示。
-# 3. 使用Faiss构建和保存内容的向量索引，支持快速相似度检索。
-# 4. 存储向量索引和相关元数据，以便后续查询和检索。
-
-from sentence_transformers import SentenceTransformer
-import faiss
-import numpy as np
-from pymongo import MongoClient
-import logging
-import json
-from tqdm import tqdm
-
-
-class EnhancedVectorStore:
-    def __init__(self, model_name: str = "shibing624/text2vec-base-chinese"):
-        """
-        初始化EnhancedVectorStore类实例，配置SentenceTransformer模型。
-
-        :param model_name: 用于文本向量化的SentenceTransformer模型的名称，默认为中文模型 "shibing624/text2vec-base-chinese"
-        """
-        self.model = SentenceTransformer(model_name)  # 初始化模型
-        self.content_index = None  # 内容向量的Faiss索引
-        self.metadata = []  # 用于存储文档的元数据（例如，文档ID）
-        self.logger = logging.getLogger(__name__)  # 配置日志记录器
-
-    def create_indices(self):
-        """
-        创建空的Faiss向量索引结构，用于存储文本内容的向量表示。
-
-        初始化Faiss索引时，需要知道向量的维度，通过SentenceTransformer模型获取。
-        """
-        dim = self.model.get_sentence_embedding_dimension()  # 获取向量的维度
-        self.content_index = faiss.IndexFlatIP(dim)  # 创建一个基于内积的向量索引（适用于相似度查询）
-
-    def process_data(self, mongo_uri: str = "mongodb://localhost:27017"):
-        """
-        从MongoDB数据库中提取文档内容，并使用SentenceTransformer模型将内容转换为向量表示，
-        生成并添加到Faiss索引中。
-
-        :param mongo_uri: MongoDB的连接URI，默认为 "mongodb://localhost:27017"
-        """
-        client = MongoClient(mongo_uri)  # 连接MongoDB
-        collection = client["tech_data1"]["articles"]  # 连接到指定的数据库和集合
-
-        # 获取集合中的所有文档
-        cursor = collection.find({})
-        documents = list(cursor)  # 将文档转换为列表
-
-        contents = []  # 存储文档内容
-        self.metadata = []  # 存储文档的元数据（例如，文档ID）
-
-        # 遍历每一个文档，提取内容并收集元数据
-        for doc in tqdm(documents, desc="Processing documents"):
-            contents.append(doc["content"])  # 提取内容字段
-            self.metadata.append({
-                "id": str(doc["_id"]),  # 提取文档的ID，并将其转换为字符串格式
-            })
-
-        # 使用SentenceTransformer将内容转换为向量
-        content_vectors = self.model.encode(contents, show_progress_bar=True)
-
-        # 对向量进行归一化处理，确保所有向量长度相同，方便进行高效的相似度计算
-        faiss.normalize_L2(content_vectors)
-
-
+# 该脚本用于从MongoDB数据库中提取文档内容，使用预训练的SentenceTransformer模型将文本内容转换为向量表示，
+# 然后使用Faiss库构建高效的向量索引以便进行快速的相似度查询。脚本的主要功能包括：
+# 1. 从MongoDB中提取文档内容。
+# 2. 使用SentenceTransformer将文本转化为向量表示。
+# 3. 使用Faiss构建和保存内容的向量索引，支持快速相似度检索。
+# 4. 存储向量索引和相关元数据，以便后续查询和检索。
+# 5. 在向量化之前使用SimHash近似重复检测剔除重复片段，减小索引体积并节省向量化时间。
+# 6. 通过持久化向量缓存只对新增或变化的片段重新向量化，加快索引重建。
+# 7. 支持将索引按行切分为多个分片，由独立的检索工作进程（shard_server.py）加载，实现横向扩展。
+# 8. 支持保存标量量化（SQ8/fp16）的紧凑索引，全精度向量单独保存供查询时内存映射并精确重排序。
+# 9. 记录每个片段所属的文章和在文章中的序号，保存紧凑的片段→文章映射数组，供查询时按文章聚合结果。
+# 10. 保存文章级的元数据（标题、URL、来源站点、抓取时间），供查询时将过滤条件编译为索引行的位图。
+
+from sentence_transformers import SentenceTransformer
+import faiss
+import numpy as np
+from pymongo import MongoClient
+import logging
+import json
+import os
+import time
+from urllib.parse import urlparse
+from tqdm import tqdm
+
+from aggregation import build_chunk_articles
+from context_packer import split_title
+from dedup import NearDuplicateDetector
+from embedding_cache import EmbeddingCache, encoder_fingerprint
+from quantization import QUANTIZATION_TYPES, build_quantized_index
+
+
+class EnhancedVectorStore:
+    def __init__(self,
+                 model_name: str = "shibing624/text2vec-base-chinese",
+                 dedup: bool = True,
+                 cache_dir: str = "embedding_cache",
+                 encoder=None):
+        """
+        初始化EnhancedVectorStore类实例，配置SentenceTransformer模型。
+
+        :param model_name: 用于文本向量化的SentenceTransformer模型的名称，默认为中文模型 "shibing624/text2vec-base-chinese"
+        :param dedup: 是否在向量化之前剔除近似重复的片段
+        :param cache_dir: 持久化向量缓存目录，为None时不使用缓存
+        :param encoder: 已加载的向量化模型（需提供encode和get_sentence_embedding_dimension方法），
+                        为None时按model_name加载SentenceTransformer；基准测试中可传入确定性的桩编码器
+        """
+        self.model_name = model_name
+        self.model = encoder if encoder is not None else SentenceTransformer(model_name)  # 初始化模型
+        self.content_index = None  # 内容向量的Faiss索引
+        self.metadata = []  # 用于存储文档的元数据（例如，文档ID）
+        self.articles = []  # 文章级的元数据（标题、URL、来源站点、抓取时间），按文章编号排列
+        self.logger = logging.getLogger(__name__)  # 配置日志记录器
+        self.dedup_detector = NearDuplicateDetector() if dedup else None  # 近似重复检测器
+        self.dedup_stats = {"total": 0, "removed": 0, "seconds": 0.0}  # 最近一次去重的统计信息
+
+        # 以（模型标识，文本哈希）为键的持久化向量缓存；直接传入的模型按其输出的指纹区分，
+        # 避免不同模型沿用默认的model_name而共用缓存条目
+        self.embedding_cache = None
+        if cache_dir:
+            cache_name = model_name if encoder is None else f"{model_name}@{encoder_fingerprint(self.model)}"
+            self.embedding_cache = EmbeddingCache(cache_dir, cache_name, self.model.get_sentence_embedding_dimension())
+
+    def create_indices(self):
+        """
+        创建空的Faiss向量索引结构，用于存储文本内容的向量表示。
+
+        初始化Faiss索引时，需要知道向量的维度，通过SentenceTransformer模型获取。
+        """
+        dim = self.model.get_sentence_embedding_dimension()  # 获取向量的维度
+        self.content_index = faiss.IndexFlatIP(dim)  # 创建一个基于内积的向量索引（适用于相似度查询）
+
+    def process_data(self, mongo_uri: str = "mongodb://localhost:27017", documents: list = None):
+        """
+        从MongoDB数据库中提取文档内容，并使用SentenceTransformer模型将内容转换为向量表示，
+        生成并添加到Faiss索引中。
+
+        :param mongo_uri: MongoDB的连接URI，默认为 "mongodb://localhost:27017"
+        :param documents: 直接传入的文档列表（包含 "_id" 和 "content" 字段，可选 "url"、"title"、"chunk_index"），
+                          传入时不再读取MongoDB
+        """
+        if documents is None:
+            client = MongoClient(mongo_uri)  # 连接MongoDB
+            collection = client["tech_data1"]["articles"]  # 连接到指定的数据库和集合
+
+            # 获取集合中的所有文档
+            cursor = collection.find({})
+            documents = list(cursor)  # 将文档转换为列表
+
+        contents = []  # 存储文档内容
+        self.metadata = []  # 存储文档的元数据（例如，文档ID）
+        articles = {}  # 文章（url，旧数据没有url时使用标题）-> 文章编号
+        self.articles = []  # 按文章编号排列的文章级元数据
+        chunk_counts = {}  # 文章编号 -> 已出现的片段数，旧数据没有chunk_index时按出现顺序编号
+
+        # 遍历每一个文档，提取内容并收集元数据
+        for doc in tqdm(documents, desc="Processing documents"):
+            contents.append(doc["content"])  # 提取内容字段
+            article_key = doc.get("url") or doc.get("title") or split_title(doc["content"])[0]
+            article = articles.setdefault(article_key, len(articles))
+            if article == len(self.articles):
+                url = doc.get("url")
+                self.articles.append({
+                    "title": doc.get("title") or split_title(doc["content"])[0],
+                    "url": url,
+                    "source": urlparse(url).netloc if url else "",
+                    "crawled_at": doc.get("crawled_at"),
+                })
+            chunk = doc.get("chunk_index")
+            if chunk is None:
+                chunk = chunk_counts.get(article, 0)
+            chunk_counts[article] = chunk_counts.get(article, 0) + 1
+            self.metadata.append({
+                "id": str(doc["_id"]),  # 提取文档的ID，并将其转换为字符串格式
+                "article": article,  # 所属文章的编号
+                "chunk": int(chunk),  # 片段在文章中的序号
+            })
+
+        # 计算SimHash指纹并剔除近似重复的片段，指纹同时写入元数据供查询时折叠重复结果
+        if self.dedup_detector is not None and contents:
+            contents = self._deduplicate(contents)
+
+        # 使用SentenceTransformer将内容转换为向量（仅对缓存未命中的片段）
+        start = time.perf_counter()
+        content_vectors = self._encode(contents)
+        encode_seconds = time.perf_counter() - start
+        self.encode_seconds = encode_seconds
+        self.logger.info(f"向量化 {len(contents)} 个片段耗时 {encode_seconds:.2f} 秒")
+
+        # 对向量进行归一化处理，确保所有向量长度相同，方便进行高效的相似度计算
+        content_vectors = np.asarray(content_vectors, dtype=np.float32)
+        faiss.normalize_L2(content_vectors)
+
+        # 将向量加入Faiss索引
+        if self.content_index is None:
+            self.create_indices()
+        self.content_index.add(content_vectors)
+
+        if self.dedup_stats["removed"]:
+            saved = self.dedup_stats["removed"] * encode_seconds / max(len(contents), 1)
+            self.dedup_stats["saved_seconds"] = saved
+            self.logger.info(f"近似重复去除节省的向量化时间约 {saved:.2f} 秒")
+
+    def _encode(self, contents: list) -> np.ndarray:
+        """
+        将片段内容转换为向量，优先从持久化缓存中读取，只对未命中的片段调用模型。
+
+        :param contents: 片段内容列表
+        :return: (len(contents), dim) 的float32向量数组
+        """
+        if self.embedding_cache is None:
+            return self.model.encode(contents, show_progress_bar=True)
+
+        vectors, misses = self.embedding_cache.lookup(contents)
+        self.logger.info(f"向量缓存命中 {len(contents) - len(misses)} 个，未命中 {len(misses)} 个")
+        if misses:
+            missing_texts = [contents[i] for i in misses]
+            encoded = self.model.encode(missing_texts, show_progress_bar=True)
+            self.embedding_cache.add(missing_texts, encoded)
+            # 与缓存中存储的精度保持一致，保证有无缓存时构建出的索引完全相同
+            vectors[misses] = np.asarray(encoded, dtype=np.float16)
+        return vectors
+
+    def _deduplicate(self, contents: list) -> list:
+        """
+        剔除近似重复片段，同步更新元数据，并记录语料缩减情况。
+
+        :param contents: 与self.metadata一一对应的片段内容
+        :return: 去重后的片段内容
+        """
+        start = time.perf_counter()
+        signatures = self.dedup_detector.signatures(contents)
+        keep = self.dedup_detector.keep_mask(signatures)
+        elapsed = time.perf_counter() - start
+
+        kept_contents = []
+        kept_metadata = []
+        for content, meta, signature, kept in zip(contents, self.metadata, signatures, keep):
+            if kept:
+                meta["simhash"] = format(int(signature), "016x")
+                kept_contents.append(content)
+                kept_metadata.append(meta)
+        self.metadata = kept_metadata
+
+        removed = len(contents) - len(kept_contents)
+        self.dedup_stats = {"total": len(contents), "removed": removed, "seconds": elapsed}
+        self.logger.info(
+            f"近似重复检测: 原始片段 {len(contents)} 个，去除 {removed} 个，"
+            f"语料缩减 {removed / len(contents):.1%}，检测耗时 {elapsed:.2f} 秒"
+        )
+        return kept_contents
+
+    def save_indices(self, index_prefix: str = "enhanced", quantization: str = None):
+        """
+        将Faiss索引和元数据保存到磁盘，供StrictQASystem加载。
+
+        :param index_prefix: 索引文件的前缀，生成 {prefix}_content.index、{prefix}_metadata.json、
+                             {prefix}_chunk_article.npy 和 {prefix}_articles.json
+        :param quantization: None保存全精度的IndexFlatIP；"sq8"或"fp16"保存标量量化索引，
+                             同时将全精度向量保存为 {prefix}_vectors.npy，供查询时内存映射并精确重排序
+        """
+        if quantization:
+            vectors = self.content_index.reconstruct_n(0, self.content_index.ntotal)
+            np.save(f"{index_prefix}_vectors.npy", vectors)
+            index = build_quantized_index(vectors, quantization)
+            faiss.write_index(index, f"{index_prefix}_content.index")
+        else:
+            faiss.write_index(self.content_index, f"{index_prefix}_content.index")
+            # 避免残留的旧全精度向量文件与新索引不一致
+            if os.path.exists(f"{index_prefix}_vectors.npy"):
+                os.remove(f"{index_prefix}_vectors.npy")
+        with open(f"{index_prefix}_metadata.json", "w", encoding="utf-8") as f:
+            json.dump(self.metadata, f, ensure_ascii=False)
+        self._save_articles(index_prefix)
+        self.logger.info(f"索引已保存: {index_prefix}_content.index，共 {self.content_index.ntotal} 个向量")
+
+    def _save_articles(self, index_prefix: str):
+        """
+        保存片段→文章映射数组 {prefix}_chunk_article.npy（每行为 [文章编号, 片段序号]）
+        和按文章编号排列的文章级元数据 {prefix}_articles.json
+        """
+        chunk_articles = build_chunk_articles(self.metadata)
+        if chunk_articles is not None:
+            np.save(f"{index_prefix}_chunk_article.npy", chunk_articles)
+            with open(f"{index_prefix}_articles.json", "w", encoding="utf-8") as f:
+                json.dump(self.articles, f, ensure_ascii=False)
+
+    def save_shards(self, index_prefix: str = "enhanced", num_shards: int = 2) -> list:
+        """
+        将索引按行切分为多个分片并保存，每个分片是以全局行号为ID的IndexIDMap2，
+        元数据仍保存为一个完整的文件，由StrictQASystem在本地加载。
+
+        :param index_prefix: 索引文件的前缀，生成 {prefix}_shard{i}.index 和 {prefix}_shards.json
+        :param num_shards: 分片数量
+        :return: 分片索引文件路径列表
+        """
+        total = self.content_index.ntotal
+        bounds = np.linspace(0, total, num_shards + 1).astype(np.int64)
+        shards = []
+        for i in range(num_shards):
+            start, end = int(bounds[i]), int(bounds[i + 1])
+            shard = faiss.IndexIDMap2(faiss.IndexFlatIP(self.content_index.d))
+            if end > start:
+                vectors = self.content_index.reconstruct_n(start, end - start)
+                shard.add_with_ids(vectors, np.arange(start, end, dtype=np.int64))
+            path = f"{index_prefix}_shard{i}.index"
+            faiss.write_index(shard, path)
+            shards.append({"path": path, "start": start, "end": end})
+
+        with open(f"{index_prefix}_shards.json", "w", encoding="utf-8") as f:
+            json.dump({"total": int(total), "shards": shards}, f, ensure_ascii=False, indent=2)
+        with open(f"{index_prefix}_metadata.json", "w", encoding="utf-8") as f:
+            json.dump(self.metadata, f, ensure_ascii=False)
+        self._save_articles(index_prefix)
+        self.logger.info(f"索引已切分为 {num_shards} 个分片，共 {total} 个向量")
+        return [shard["path"] for shard in shards]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="从MongoDB读取文档，构建并保存向量索引")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017", help="MongoDB连接地址")
+    parser.add_argument("--output-prefix", default="enhanced", help="索引文件前缀，与StrictQASystem的index_prefix一致")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="同时将索引切分为N个分片（{prefix}_shard{i}.index），"
+                             "每个分片由一个 shard_server.py --index 工作进程加载；0表示不切分")
+    parser.add_argument("--quantization", choices=["none", *QUANTIZATION_TYPES], default="none",
+                        help="内容索引的标量量化方式，量化时全精度向量另存为 {prefix}_vectors.npy，供查询时精确重排序")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    store = EnhancedVectorStore()
+    store.create_indices()
+    store.process_data(mongo_uri=args.mongo_uri)
+    store.save_indices(args.output_prefix, quantization=None if args.quantization == "none" else args.quantization)
+    if args.shards > 0:
+        for path in store.save_shards(args.output_prefix, args.shards):
+            print(path)
@@ -4,4 +4,8 @@ import scrapy
 class TechCrawlerItem(scrapy.Item):
     content = scrapy.Field()     # 文章内容
     author = scrapy.Field()      # 作者
-    date = scrapy.Field()        # 发布时间
\ No newline at end of file
+    date = scrapy.Field()        # 发布时间
+    title = scrapy.Field()       # 文章标题
+    url = scrapy.Field()         # 文章URL，同一文章的所有片段相同，用于按文章聚合检索结果
+    chunk_index = scrapy.Field()  # 片段在文章中的序号（从0开始），用于拼接相邻片段
+    crawled_at = scrapy.Field()  # 抓取时间（ISO 8601格式）
\ No newline at end of file
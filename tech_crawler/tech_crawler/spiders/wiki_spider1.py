@@ -4,11 +4,13 @@
 # 为了避免存储过长的文章内容，内容会被分割成多个小段，每段不超过500个字符，并且将标题与每段内容一起存储。
 # 本爬虫还会将抓取的文本内容转换为简体字存储，确保处理过的文本适用于后续的自然语言处理。
 # 爬虫工作流程包括：抓取指定 URL、清理文本内容、分段存储到数据库。
+# 每个片段同时存储文章标题、URL、片段序号和抓取时间，建索引时据此记录片段所属的文章，查询时按文章聚合结果。
 
 import scrapy
 from tech_crawler.items1 import TechCrawlerItem
 from pymongo import MongoClient
 import re
+from datetime import datetime, timezone
 from opencc import OpenCC
 
 
@@ -104,7 +106,7 @@ class WikiSpider(scrapy.Spider):
         # 返回拼接后的所有内容部分
         return '\n'.join(content_parts)
 
-    def split_and_store_content(self, title, content):
+    def split_and_store_content(self, title, content, url=None):
         """每500字分割一次内容，并存储每一段"""
         content_len = len(content)
         chunks = []
@@ -121,11 +123,16 @@ class WikiSpider(scrapy.Spider):
             prev_end = end
 
         # 存储每个片段
-        for chunk in chunks:
+        crawled_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        for chunk_index, chunk in enumerate(chunks):
             item = TechCrawlerItem()
             item["content"] = title + "\n" + self.cc.convert(chunk)  # 标题和内容合并存储
             item["author"] = None
             item["date"] = None
+            item["title"] = title
+            item["url"] = url
+            item["chunk_index"] = chunk_index  # 片段在文章中的序号
+            item["crawled_at"] = crawled_at
 
             # 将每一片段存入数据库
             try:
@@ -149,7 +156,7 @@ class WikiSpider(scrapy.Spider):
         # 确保内容有效
         if content:
             # 将标题与内容合并存储在 "content" 字段中
-            self.split_and_store_content(title, content)  # 分割并存储内容
+            self.split_and_store_content(title, content, response.url)  # 分割并存储内容
         else:
             self.log(f"无法提取正文内容: {response.url}")
 